@@ -0,0 +1,83 @@
+# お笑いSQL道場（Flaskアプリ）
+#   `create_app()`でアプリを組み立てる
+#   このパッケージのimport自体は軽くしておき、`.env`の読み込みやDB・各ページの
+#   モジュールの読み込みは`create_app()`を呼んだときに行う
+import os
+from typing import Any, Mapping, Optional
+
+def create_app(config: Optional[Mapping[str, Any]]=None):
+    """ Flaskアプリを作って返す
+        `config`を渡すと、`.env`・環境変数から決めた設定値を上書きする
+          - `USING_EXCEL`: DB接続に踏み台Excelを使うか
+          - `STORAGE_DIR`: ユーザーのクエリ（`.sql`）の保存先
+          - `SCHEMA_REFRESHER`: テーブル構造キャッシュを裏で読み込み・読み直すか
+          - `SERVER_TIMING`: 応答に処理段階ごとの時間（`Server-Timing`ヘッダ）をつけるか
+          - `ANSWER_DIGEST_REFRESHER`: 古い正解の要約を裏で計算し直すか（踏み台Excelでは行わない）
+          - `ADMIN_TOKEN`: 管理用Web API（`/api/admin/...`）の合言葉（未設定なら管理用Web APIは使えない）
+    """
+    from dotenv import load_dotenv
+    from flask import Flask
+    from flask_wtf.csrf import CSRFProtect
+
+    # `.env`読み込み（DBの接続設定はimport時に環境変数から読むので、各ページより先に）
+    load_dotenv()
+
+    app = Flask(__name__)
+    app.config.from_mapping(
+        # CSRF対策・セッション用の秘密鍵（`SESSION_SECRET_KEY`があればそちらを使う）
+        SECRET_KEY=os.getenv("SESSION_SECRET_KEY") or os.getenv("SECRET_KEY"),
+        # DB接続に踏み台Excelを使うかどうか
+        USING_EXCEL=os.getenv("USING_EXCEL", "FALSE").upper() == "TRUE",
+        # クエリ保存用フォルダ（保存するときに作る）
+        STORAGE_DIR=os.path.join(os.getcwd(), "storage", "queries"),
+        SCHEMA_REFRESHER=True,
+        # 処理段階ごとの時間を応答ヘッダで見せるかどうか（`/metrics`への集計はいつも行う）
+        SERVER_TIMING=os.getenv("SERVER_TIMING", "TRUE").upper() == "TRUE",
+        ANSWER_DIGEST_REFRESHER=True,
+        # 管理用Web APIの合言葉（`X-Admin-Token`ヘッダで送る）
+        ADMIN_TOKEN=os.getenv("ADMIN_TOKEN"),
+    )
+    if config:
+        app.config.update(config)
+    # CSRF対策
+    csrf = CSRFProtect(app)
+
+    from dbapp.config import SCHEMA_REFRESH_INTERVAL, PAGE_FRAGMENT_CACHE_SIZE
+    from dbapp.db.queries import TABLE_NAMES
+    from dbapp.services.admission_service import AdmissionRejectedError
+    from dbapp.services.answer_digest_service import start_digest_refresher
+    from dbapp.services.page_cache_service import FragmentCache, template_fingerprint
+    from dbapp.services.schema_service import SchemaCache
+    from dbapp.views import console, jobs, metrics, practice, schema
+    from dbapp.views.common import handle_admission_rejected
+
+    for module in (console, practice, jobs, schema, metrics):
+        app.register_blueprint(module.bp)
+    # 管理用Web APIは`X-Admin-Token`ヘッダで確かめるので、CSRFトークンは要らない
+    for view in (console.api_result_cache_toggle, console.api_result_cache_invalidate):
+        csrf.exempt(view)
+    app.register_error_handler(AdmissionRejectedError, handle_admission_rejected)
+    # リクエストごとの処理時間の計測
+    metrics.init_timing(app)
+
+    # テーブル構造のキャッシュ（裏で読み込み、以降は定期的に読み直す）
+    schema_cache = SchemaCache(
+        table_names=TABLE_NAMES,
+        refresh_interval=SCHEMA_REFRESH_INTERVAL,
+        use_excel=app.config["USING_EXCEL"]
+    )
+    if app.config["SCHEMA_REFRESHER"]:
+        schema_cache.start_refresher()
+    app.extensions["schema_cache"] = schema_cache
+
+    # 正解クエリの結果の要約（まだないもの・古いものを裏で計算する）
+    if app.config["ANSWER_DIGEST_REFRESHER"] and not app.config["USING_EXCEL"]:
+        start_digest_refresher()
+
+    # 練習問題ページの描画済みHTML（問題データのバージョンが変わったら捨てる）
+    app.extensions["page_fragments"] = FragmentCache(max_entries=PAGE_FRAGMENT_CACHE_SIZE)
+    # テンプレートを差し替えたらETagが変わるようにする
+    app.config["TEMPLATE_FINGERPRINT"] = template_fingerprint(
+        os.path.join(app.root_path, app.template_folder))
+
+    return app
@@ -0,0 +1,118 @@
+# ベンチマーク用の代替データ（乱数の種を固定して毎回同じものを作る）
+#   - 問題データ: `data/schema.sql`の構造で、章・節・問題をでっち上げたSQLiteファイル
+#   - SQLのコーパス: 正解クエリ風のSELECT文と、はじかれるべき文
+#   - 結果セット: pyodbcの行と同じく、int / str / Decimal / date の値を持つタプルのリスト
+import os
+import random
+import sqlite3
+from datetime import date, timedelta
+from decimal import Decimal
+from typing import Any, List, Tuple
+
+_CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+SCHEMA_PATH = os.path.join(os.path.dirname(_CURRENT_DIR), "data", "schema.sql")
+
+SEED = 20240601
+
+# 結果セットの列
+RESULT_COLUMNS = ["SaleID", "CustomerName", "Price", "SaleDate"]
+
+_TABLES = ["Sales", "Products", "Customers", "Employees", "Departments", "Prefecturals"]
+_COLUMNS = ["ID", "Name", "Price", "Quantity", "SaleDate", "Birthday", "Gender", "Address"]
+_NAMES = ["佐藤", "鈴木", "高橋", "田中", "伊藤", "渡辺", "山本", "中村", "小林", "加藤"]
+
+def build_practice_db(path: str, chapters: int=20, sections: int=10, questions: int=10,
+                      seed: int=SEED) -> int:
+    """ 問題データの代替DBを`path`に作り、問題数を返す
+    """
+    rng = random.Random(seed)
+    if os.path.exists(path):
+        os.remove(path)
+    conn = sqlite3.connect(path)
+    try:
+        with open(SCHEMA_PATH, encoding="utf-8") as f:
+            conn.executescript(f.read())
+        conn.executemany(
+            "INSERT INTO Chapters (ChapterNumber, ChapterTitle) VALUES (?, ?);",
+            [(c, f"第{c}章のタイトル") for c in range(1, chapters + 1)])
+        conn.executemany(
+            "INSERT INTO Sections (SectionNumber, ChapterNumber, SectionTitle) VALUES (?, ?, ?);",
+            [(s, c, f"第{c}章 その{s}") for c in range(1, chapters + 1) for s in range(1, sections + 1)])
+        rows = [
+            (c, s, q, f"問題文 {c}-{s}-{q}: " + "テーブルから条件に合う行を取り出しなさい。" * rng.randint(1, 4),
+             random_select(rng), rng.choice(["strict", "strict", "loose"]))
+            for c in range(1, chapters + 1)
+            for s in range(1, sections + 1)
+            for q in range(0, questions)
+        ]
+        conn.executemany("INSERT INTO Questions VALUES (?, ?, ?, ?, ?, ?);", rows)
+        conn.execute("PRAGMA user_version = 1;")
+        conn.commit()
+    finally:
+        conn.close()
+    return len(rows)
+
+def random_select(rng: random.Random) -> str:
+    """ 正解クエリ風のSELECT文を1つ作る
+    """
+    table = rng.choice(_TABLES)
+    columns = ", ".join(f"t.{c}" for c in rng.sample(_COLUMNS, rng.randint(1, 4)))
+    parts = [f"SELECT\n\t{columns}\nFROM\n\t{table} AS t"]
+    if rng.random() < 0.5:
+        parts.append(f"JOIN {rng.choice(_TABLES)} AS u ON u.ID = t.ID")
+    if rng.random() < 0.7:
+        parts.append(f"WHERE\n\tt.Name LIKE '%{rng.choice(_NAMES)}%' -- 名前で絞る\n\tAND t.Price >= {rng.randint(100, 9999)}")
+    if rng.random() < 0.3:
+        parts.append("GROUP BY t.Name HAVING COUNT(*) > 1")
+    if rng.random() < 0.5:
+        parts.append(f"ORDER BY {rng.choice(_COLUMNS)} DESC")
+    sql = "\n".join(parts) + "\n;"
+    if rng.random() < 0.2:
+        sql = f"/* サブクエリ */\nWITH x AS (\n{sql.rstrip(';')}\n)\nSELECT * FROM x;"
+    return sql
+
+def sql_corpus(size: int=1000, seed: int=SEED) -> List[str]:
+    """ SQLの検査用コーパス（1割ほどは、はじかれるべき文を混ぜる）
+    """
+    rng = random.Random(seed)
+    rejected = [
+        "DELETE FROM Sales;",
+        "SELECT * FROM Sales; DROP TABLE Sales;",
+        "UPDATE Products SET Price = 0;",
+        "SELECT 1; SELECT 2;",
+    ]
+    return [
+        rng.choice(rejected) if rng.random() < 0.1 else random_select(rng)
+        for _ in range(size)
+    ]
+
+def result_rows(count: int, seed: int=SEED) -> List[Tuple[Any, ...]]:
+    """ 結果セットの行（`RESULT_COLUMNS`の順の値のタプル）を`count`行作る
+    """
+    rng = random.Random(seed)
+    start = date(2020, 1, 1)
+    return [
+        (
+            i,
+            f"{rng.choice(_NAMES)}{rng.randint(1, 999)}",
+            Decimal(rng.randint(100, 999999)) / 100,
+            start + timedelta(days=rng.randint(0, 1500)),
+        )
+        for i in range(1, count + 1)
+    ]
+
+def shuffled(rows: List[Tuple[Any, ...]], seed: int=SEED) -> List[Tuple[Any, ...]]:
+    """ 同じ行を並べ替えたもの（ORDER BY違いの答案）
+    """
+    rows = list(rows)
+    random.Random(seed).shuffle(rows)
+    return rows
+
+def with_one_changed(rows: List[Tuple[Any, ...]]) -> List[Tuple[Any, ...]]:
+    """ 真ん中の1行だけ値が違うもの（中身違いの答案）
+    """
+    rows = [tuple(row) for row in rows]
+    i = len(rows) // 2
+    sale_id, name, price, sale_date = rows[i]
+    rows[i] = (sale_id, name, price + 1, sale_date)
+    return rows
@@ -0,0 +1,72 @@
+# 起動時間のベンチマーク
+#   使い方: リポジトリのルートで `python -m dbapp.benchmarks.startup`
+#   毎回新しいPythonプロセスを立ち上げて（モジュールのキャッシュがない状態で）、次を測る
+#     - import: `import dbapp`
+#     - create_app: `create_app()`（`.env`の読み込み、各ページの読み込み・登録）
+#     - first request: 最初のリクエスト（`GET /practices`）の応答まで
+#   あわせて、重い任意の依存（pandas / pywin32 / numpy）がその時点で読み込まれたかも出す
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+_CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(os.path.dirname(_CURRENT_DIR))
+
+# 起動してから読み込まれていてほしくないモジュール
+OPTIONAL_MODULES = ("pandas", "win32com", "pythoncom", "numpy")
+
+# 子プロセスで動かすスクリプト（結果はJSONで標準出力に書く）
+_CHILD = """
+import json, sys, time
+t0 = time.perf_counter()
+import dbapp
+t1 = time.perf_counter()
+app = dbapp.create_app({"SCHEMA_REFRESHER": False, "ANSWER_DIGEST_REFRESHER": False})
+t2 = time.perf_counter()
+loaded = [m for m in %(optional)r if m in sys.modules]
+response = app.test_client().get(%(path)r)
+t3 = time.perf_counter()
+print(json.dumps({
+    "import": t1 - t0,
+    "create_app": t2 - t1,
+    "first_request": t3 - t2,
+    "status": response.status_code,
+    "loaded": loaded,
+}))
+"""
+
+def run_once(path: str) -> dict:
+    """ 新しいプロセスで1回測って、結果（秒）を返す
+    """
+    script = _CHILD % {"optional": OPTIONAL_MODULES, "path": path}
+    output = subprocess.run(
+        [sys.executable, "-c", script],
+        cwd=REPO_ROOT, capture_output=True, text=True, check=True
+    ).stdout
+    # アプリが標準出力に何か書いても、最後の行だけを読む
+    return json.loads(output.strip().splitlines()[-1])
+
+def main(repeat: int=10, path: str="/practices") -> None:
+    # 1回目は`.pyc`の作成を含むので捨てる
+    run_once(path)
+    results = [run_once(path) for _ in range(repeat)]
+
+    print(f"( ´_ゝ`) < 新しいプロセスで {repeat} 回、最初のリクエストは GET {path}"
+          f"（ステータス {results[-1]['status']}）")
+    for name in ("import", "create_app", "first_request"):
+        values = [r[name] * 1000 for r in results]
+        print(f"{name:>14}: 中央値 {statistics.median(values):8.1f} ms"
+              f"  最小 {min(values):8.1f} ms  最大 {max(values):8.1f} ms")
+    total = [sum(r[name] for name in ("import", "create_app", "first_request")) * 1000 for r in results]
+    print(f"{'total':>14}: 中央値 {statistics.median(total):8.1f} ms")
+    print(f"最初のリクエスト前に読み込まれた任意の依存: {', '.join(results[-1]['loaded']) or 'なし'}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="起動時間のベンチマーク")
+    parser.add_argument("--repeat", type=int, default=10, help="プロセスを立ち上げる回数")
+    parser.add_argument("--path", default="/practices", help="最初に送るリクエストのパス")
+    args = parser.parse_args()
+    main(repeat=args.repeat, path=args.path)
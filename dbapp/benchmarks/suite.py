@@ -0,0 +1,279 @@
+# ホットパスのマイクロベンチマーク
+#   使い方: リポジトリのルートで
+#     `python -m dbapp.benchmarks.suite --output bench.json`
+#     `python -m dbapp.benchmarks.suite --compare base.json bench.json`（2つの結果を比べる）
+#   乱数の種を固定した代替データ（`benchmarks/dataset.py`）を一時ディレクトリに作って測る
+#   （本物の`practice.db`・`storage/tmp`・MySQLには触らない）
+#   結果はJSONで出力するので、コミット間で比べて性能の劣化を見つけられる
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+from dbapp.benchmarks import dataset
+
+# 結果のJSONの形式（項目を変えたら上げる）
+FORMAT_VERSION = 1
+# 比較で「遅くなった」とみなす比率
+REGRESSION_THRESHOLD = 1.10
+
+DEFAULT_SIZES = (1000, 100000, 1000000)
+
+class Suite:
+    """ ベンチマークを登録順に測って、結果をためておく
+    """
+
+    def __init__(self, only: Optional[List[str]]=None):
+        self.only = only
+        self.results: List[Dict[str, Any]] = []
+
+    def wants(self, prefix: str) -> bool:
+        """ `prefix`で始まるベンチマークを測るか（`--only`の指定）
+        """
+        return not self.only or any(
+            name.startswith(prefix) or prefix.startswith(name) for name in self.only)
+
+    def measure(self, name: str, func: Callable[[], Any], params: Optional[Dict[str, Any]]=None,
+                number: int=1, repeat: int=5, setup: Optional[Callable[[], Any]]=None) -> None:
+        """ `func()`を`number`回呼ぶ時間を`repeat`回測り、1回あたりの秒数で記録する
+            `setup()`は各回の前に呼ぶ（時間には含めない）
+        """
+        if self.only and not any(name.startswith(prefix) for prefix in self.only):
+            return
+        samples = []
+        for _ in range(repeat):
+            if setup is not None:
+                setup()
+            start = time.perf_counter()
+            for _ in range(number):
+                func()
+            samples.append((time.perf_counter() - start) / number)
+        result = {
+            "name": name,
+            "params": params or {},
+            "number": number,
+            "repeat": repeat,
+            "min": min(samples),
+            "median": statistics.median(samples),
+            "mean": statistics.fmean(samples),
+            "stdev": statistics.stdev(samples) if len(samples) > 1 else 0.0,
+        }
+        self.results.append(result)
+        print(f"{name:<48} {_format_seconds(result['median']):>12}  (min {_format_seconds(result['min'])})",
+              file=sys.stderr)
+
+def bench_validate_sql(suite: Suite) -> None:
+    if not suite.wants("validate_sql"):
+        return
+    from dbapp.db import queries as dbq
+
+    corpus = dataset.sql_corpus(size=1000)
+
+    def validate_all():
+        for sql_query in corpus:
+            try:
+                dbq.sanitize_and_validate_sql(sql_query, allowed_start=("SELECT", "WITH"))
+            except ValueError:
+                pass
+
+    params = {"queries": len(corpus)}
+    # 走査そのもの（毎回キャッシュを空にする）と、キャッシュが効いている状態
+    suite.measure("validate_sql/cold", validate_all, params, setup=dbq._scan_sql.cache_clear)
+    dbq._scan_sql.cache_clear()
+    validate_all()
+    suite.measure("validate_sql/warm", validate_all, params)
+
+def bench_compare_strict(suite: Suite, sizes) -> None:
+    if not suite.wants("compare_strict"):
+        return
+    from dbapp.services.query_compare.strict import compare_strict
+
+    columns = dataset.RESULT_COLUMNS
+    for size in sizes:
+        answer = dataset.result_rows(size)
+        # 値は同じで別のタプル（取得し直した結果セットと同じ状態）
+        cases = {
+            "match": [tuple(value for value in row) for row in answer],
+            "order_mismatch": dataset.shuffled(answer),
+            "content_mismatch": dataset.with_one_changed(answer),
+        }
+        repeat = 3 if size >= 1000000 else 5
+        for case, user in cases.items():
+            suite.measure(
+                f"compare_strict/{case}/{size}",
+                lambda: compare_strict((columns, user), (columns, answer)),
+                {"rows": size}, repeat=repeat)
+        del answer, cases
+
+def bench_catalog(suite: Suite) -> None:
+    if not suite.wants("practice_list") and not suite.wants("next_question_key"):
+        return
+    from dbapp.db import question_catalog
+    from dbapp.db.practices import generate_structured_practice_list, get_next_question_key
+
+    # カタログの作り直し（SQLiteから全問題を読む）と、作り済みのカタログから返すだけの場合
+    suite.measure(
+        "practice_list/rebuild", generate_structured_practice_list,
+        setup=question_catalog.invalidate)
+    generate_structured_practice_list()
+    suite.measure("practice_list/cached", generate_structured_practice_list, number=1000)
+
+    keys = question_catalog.get_catalog().keys
+
+    def walk():
+        for key in keys:
+            get_next_question_key(key)
+
+    suite.measure("next_question_key/walk", walk, {"questions": len(keys)})
+
+def bench_temp_result(suite: Suite, sizes) -> None:
+    if not suite.wants("temp_result"):
+        return
+    from dbapp.services import file_service
+
+    columns = dataset.RESULT_COLUMNS
+    for size in sizes:
+        rows = dataset.result_rows(size)
+        saved: List[str] = []
+
+        def save():
+            saved.append(file_service.save_temp_result(columns, rows))
+
+        def cleanup():
+            while saved:
+                file_service.delete_temp_result(saved.pop())
+
+        suite.measure(f"temp_result/save/{size}", save, {"rows": size}, setup=cleanup)
+        cleanup()
+        save()
+        result_id = saved[-1]
+        # 読み出しのたびに結果グリッド用のメモリキャッシュを捨てて、ファイルから読む
+        suite.measure(
+            f"temp_result/load/{size}", lambda: file_service.load_temp_result(result_id),
+            {"rows": size}, setup=lambda: file_service._window_cache.clear())
+        cleanup()
+
+def bench_render(suite: Suite, sizes) -> None:
+    if not suite.wants("render"):
+        return
+    from flask import render_template
+    from dbapp import create_app
+
+    app = create_app({"SCHEMA_REFRESHER": False, "ANSWER_DIGEST_REFRESHER": False, "SECRET_KEY": "benchmark"})
+    columns = dataset.RESULT_COLUMNS
+    for size in sizes:
+        rows = dataset.result_rows(size)
+        with app.test_request_context("/"):
+            suite.measure(
+                f"render/result_table/{size}",
+                lambda: render_template(
+                    "components/show_result/show_result.html",
+                    columns=columns, rows=rows, page_info=None, result_id=None),
+                {"rows": size}, repeat=3 if size >= 10000 else 5)
+
+def run(sizes, render_sizes, temp_sizes, only: Optional[List[str]]=None) -> Dict[str, Any]:
+    """ 全ベンチマークを測って、結果（JSONにできるdict）を返す
+    """
+    with tempfile.TemporaryDirectory(prefix="dbapp-bench-") as work_dir:
+        # 代替データを使うように、アプリのモジュールを読み込む前に環境変数で差し替える
+        db_path = os.path.join(work_dir, "practice.db")
+        questions = dataset.build_practice_db(db_path)
+        os.environ["PRACTICE_DB_PATH"] = db_path
+        os.environ["TEMP_RESULT_DIR"] = os.path.join(work_dir, "tmp")
+
+        suite = Suite(only=only)
+        bench_validate_sql(suite)
+        bench_compare_strict(suite, sizes)
+        bench_catalog(suite)
+        bench_temp_result(suite, temp_sizes)
+        bench_render(suite, render_sizes)
+
+    return {
+        "format_version": FORMAT_VERSION,
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "seed": dataset.SEED,
+            "questions": questions,
+        },
+        "unit": "seconds",
+        "results": suite.results,
+    }
+
+def compare(base: Dict[str, Any], head: Dict[str, Any], threshold: float=REGRESSION_THRESHOLD) -> int:
+    """ 2つの結果の中央値を比べて表示し、遅くなったベンチマークの数を返す
+    """
+    base_results = {r["name"]: r for r in base["results"]}
+    print(f"base: {base['meta'].get('commit')}  head: {head['meta'].get('commit')}")
+    regressions = 0
+    for result in head["results"]:
+        old = base_results.get(result["name"])
+        if old is None:
+            print(f"{result['name']:<48} {'(new)':>12}")
+            continue
+        ratio = result["median"] / old["median"] if old["median"] else float("inf")
+        mark = ""
+        if ratio > threshold:
+            mark = "  <- 遅くなった"
+            regressions += 1
+        print(f"{result['name']:<48} {_format_seconds(old['median']):>12} -> "
+              f"{_format_seconds(result['median']):>12}  x{ratio:5.2f}{mark}")
+    return regressions
+
+def _format_seconds(seconds: float) -> str:
+    if seconds < 1e-3:
+        return f"{seconds * 1e6:.1f} us"
+    if seconds < 1:
+        return f"{seconds * 1e3:.2f} ms"
+    return f"{seconds:.3f} s"
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def _sizes(text: str):
+    return tuple(int(size) for size in text.split(",") if size)
+
+def _load(path: str) -> Dict[str, Any]:
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ホットパスのマイクロベンチマーク")
+    parser.add_argument("--output", help="結果のJSONを書き出すファイル（省略時は標準出力）")
+    parser.add_argument("--sizes", type=_sizes, default=DEFAULT_SIZES,
+                        help="compare_strictの行数（カンマ区切り）")
+    parser.add_argument("--render-sizes", type=_sizes, default=(1000, 10000),
+                        help="結果テーブルの描画の行数（カンマ区切り）")
+    parser.add_argument("--temp-sizes", type=_sizes, default=(1000, 100000),
+                        help="一時保存の行数（カンマ区切り）")
+    parser.add_argument("--only", action="append",
+                        help="名前がこれで始まるベンチマークだけ測る（複数指定可）")
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "HEAD"),
+                        help="2つの結果のJSONを比べる（測定はしない）")
+    args = parser.parse_args()
+
+    if args.compare:
+        regressions = compare(_load(args.compare[0]), _load(args.compare[1]))
+        sys.exit(1 if regressions else 0)
+
+    report = run(args.sizes, args.render_sizes, args.temp_sizes, only=args.only)
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
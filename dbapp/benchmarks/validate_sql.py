@@ -0,0 +1,87 @@
+# SQLの検査（`sanitize_and_validate_sql()`）のベンチマーク
+#   使い方: リポジトリのルートで `python -m dbapp.benchmarks.validate_sql`
+#   `questions.yaml`の正解クエリ全件を、次の3通りで検査して時間を比べる
+#     - sqlparse: 以前の実装（`sanitize_sql()` -> sqlparseで2回解析）
+#     - single-pass: `_scan_sql()`による1回の走査（キャッシュなし）
+#     - cached: `_scan_sql()`のキャッシュが効いている状態
+import argparse
+import os
+import time
+
+import yaml
+
+from dbapp.db import queries as dbq
+
+_CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+QUESTIONS_PATH = os.path.join(os.path.dirname(_CURRENT_DIR), "data", "src", "questions.yaml")
+
+ALLOWED_START = ("SELECT", "WITH")
+
+def load_corpus(path: str=QUESTIONS_PATH):
+    """ 正解クエリのリストを返す
+    """
+    with open(path, encoding="utf-8") as f:
+        data = yaml.safe_load(f)
+    return [item["answer_query"] for item in data if item.get("answer_query")]
+
+def validate_with_sqlparse(sql_query: str, allowed_start=ALLOWED_START):
+    """ 以前の実装と同じ手順での検査（比較用）
+    """
+    clean_sql = dbq.sanitize_sql(sql_query)
+    if not clean_sql:
+        return False, "有効なクエリがありません。", clean_sql
+    upper = clean_sql.upper()
+    if not any(upper.startswith(kw) for kw in allowed_start):
+        return False, f"{', '.join(allowed_start)}文のみ実行可能です。", clean_sql
+    if dbq.contains_forbidden_keywords(clean_sql):
+        return False, "書き込み系・DDL文は使用禁止です。", clean_sql
+    if dbq.is_multi_statement(sql_query=clean_sql):
+        return False, "マルチステートメントは使用禁止です。", clean_sql
+    return True, None, clean_sql
+
+def validate_single_pass(sql_query: str, allowed_start=ALLOWED_START):
+    # 毎回キャッシュを空にして、走査そのものの時間を測る
+    dbq._scan_sql.cache_clear()
+    return dbq._validate_sql_core(sql_query, allowed_start)
+
+def validate_cached(sql_query: str, allowed_start=ALLOWED_START):
+    return dbq._validate_sql_core(sql_query, allowed_start)
+
+def _measure(func, corpus, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for sql_query in corpus:
+            func(sql_query)
+    return time.perf_counter() - start
+
+def main(repeat: int=20) -> None:
+    corpus = load_corpus()
+
+    # 判定結果（合否とメッセージ）が以前の実装と一致することを確認
+    mismatches = [
+        q for q in corpus
+        if validate_with_sqlparse(q)[:2] != validate_single_pass(q)[:2]
+    ]
+    print(f"( ´_ゝ`) < クエリ {len(corpus)} 件 x {repeat} 回、判定の不一致 {len(mismatches)} 件")
+
+    # キャッシュを温めておく
+    dbq._scan_sql.cache_clear()
+    for q in corpus:
+        validate_cached(q)
+
+    baseline = None
+    for name, func in (
+            ("sqlparse", validate_with_sqlparse),
+            ("single-pass", validate_single_pass),
+            ("cached", validate_cached)):
+        elapsed = _measure(func, corpus, repeat)
+        per_query = elapsed / (len(corpus) * repeat) * 1e6
+        if baseline is None:
+            baseline = elapsed
+        print(f"{name:>12}: {elapsed:8.3f} s  {per_query:9.1f} us/query  x{baseline / elapsed:7.1f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="SQL検査のベンチマーク")
+    parser.add_argument("--repeat", type=int, default=20, help="コーパスを繰り返す回数")
+    args = parser.parse_args()
+    main(repeat=args.repeat)
@@ -14,5 +14,87 @@ FAILED_ROWS = [
     ["残念ｗ", "レコードセットが返らなかったよｗｗｗ"]
 ]
 
+# 結果表示のページング
+# 1ページに表示する行数（既定値と上限）
+RESULT_PAGE_SIZE = 100
+MAX_RESULT_PAGE_SIZE = 1000
+# 結果セットを先頭から読む行数の上限（これより先はページを送っても表示しない）
+MAX_RESULT_ROWS = 10000
+
+# 結果グリッド（仮想スクロール）が1回に取得する行数（既定値と上限）
+RESULT_WINDOW_SIZE = 200
+MAX_RESULT_WINDOW_SIZE = 1000
+# 取得した結果セットをメモリに置いておく件数と秒数
+RESULT_WINDOW_CACHE_SIZE = 16
+RESULT_WINDOW_CACHE_TTL = 60
+
+# クエリの実行期限（秒）
+#   SQLコンソールでの実行と、正誤判定（ユーザークエリ・正解クエリの両方）に使う
+QUERY_TIMEOUT = 30
+
+# 結果セットのエクスポート（CSV / NDJSON）
+# 実行期限（秒）と、先頭から書き出す行数の上限
+EXPORT_TIMEOUT = 5 * 60
+EXPORT_MAX_ROWS = 1000000
+
+# クエリ実行の受付制御
+# 全体・1セッションあたりの同時実行クエリ数、待ち行列の長さ、待つ最大秒数
+ADMISSION_MAX_ACTIVE = 16
+ADMISSION_MAX_PER_SESSION = 2
+ADMISSION_MAX_QUEUE = 64
+ADMISSION_MAX_WAIT = 10
+
+# テーブル構造のキャッシュを読み直す間隔（秒）
+SCHEMA_REFRESH_INTERVAL = 10 * 60
+
+# 練習問題ページのキャッシュ
+# 描画済みのHTML断片をメモリに置いておく件数
+PAGE_FRAGMENT_CACHE_SIZE = 512
+
+# 処理時間の計測（Server-Timingヘッダと`/metrics`のヒストグラム）
+# リクエスト全体・処理段階ごとの秒数、取得した行数のヒストグラムの区切り
+TIMING_SECONDS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+TIMING_ROWS_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000, 1000000)
+
+# SQLコンソールの結果キャッシュ（練習用データセットは読み取り専用なので、同じクエリは同じ結果）
+# 合計サイズの上限（バイト、おおよそ）と、1件あたりの上限（これより大きい結果は置かない）
+RESULT_CACHE_MAX_BYTES = 64 * 1024 * 1024
+RESULT_CACHE_MAX_ENTRY_BYTES = 4 * 1024 * 1024
+
+# 遅いクエリの記録（`storage/slow_queries.db`）
+# 記録する実行時間のしきい値（秒）、書き込み待ちにためる件数の上限、残しておく件数
+SLOW_QUERY_THRESHOLD = 1.0
+SLOW_QUERY_QUEUE_SIZE = 1000
+SLOW_QUERY_MAX_RECORDS = 100000
+
+# 非同期ジョブ（クエリ実行・正誤判定をリクエストとは別のワーカーで動かす）
+# ワーカー数、1セッションが同時に持てる未完了のジョブ数、
+# 終わったジョブの結果を残しておく秒数、進捗イベントを送る間隔（秒）
+JOB_MAX_WORKERS = 8
+JOB_MAX_PER_SESSION = 4
+JOB_RESULT_TTL = 5 * 60
+JOB_PROGRESS_INTERVAL = 0.5
+
+# 結果セットの一時保存（`storage/tmp`）
+# 合計サイズの上限（バイト）、1件の有効期限（秒）、掃除スレッドの実行間隔（秒）
+TEMP_RESULT_MAX_BYTES = 200 * 1024 * 1024
+TEMP_RESULT_TTL = 60 * 60
+TEMP_RESULT_JANITOR_INTERVAL = 5 * 60
+
 # CodeMirror関係
-DEFAULT_EDITOR_HEIGHT = 300
\ No newline at end of file
+DEFAULT_EDITOR_HEIGHT = 300
+
+# 正誤判定関係
+
+# 'loose'モードで数値を比べる小数点以下の桁数（差がこの桁の半分以下なら一致）
+LOOSE_COMPARE_DECIMALS = 2
+
+# 正誤判定でユーザークエリと正解クエリを並行実行するワーカー数
+JUDGE_MAX_WORKERS = 8
+
+# 正解クエリの結果の要約（`practice.db`の`AnswerDigests`、正誤判定で正解クエリを流さないため）
+# 計算で正解クエリを並行して流す数、1問あたりの実行期限（秒）、
+# 行そのものも保存する結果セットの行数の上限（これより多ければ要約だけ）
+ANSWER_DIGEST_MAX_WORKERS = 4
+ANSWER_DIGEST_TIMEOUT = 60
+ANSWER_DIGEST_MAX_ROWS = 1000
@@ -0,0 +1,44 @@
+# 全問題の正解クエリを流して、結果の要約を`practice.db`の`AnswerDigests`に書くツール
+#   使い方: リポジトリのルートで `python -m dbapp.data.compute_answer_digests`
+#   既定では、まだ計算していないもの・正解クエリかデータセットが変わったものだけを計算する
+#   `--force`で全部計算し直す、`--question 2-7-1`で指定の問題だけ（複数指定可）
+#   正解クエリは`.env`の接続先（`DB_BACKEND`）に流す
+#   MySQLでは`.env`に`DATASET_VERSION`が要る（ないとデータセットが変わったことがわからないので）
+import argparse
+import sys
+
+from dotenv import load_dotenv
+
+# 接続先は`import`時に環境変数から決まるので、先に`.env`を読む
+load_dotenv()
+
+from dbapp.config import ANSWER_DIGEST_MAX_WORKERS
+from dbapp.db.connection import has_dataset_version
+from dbapp.services.answer_digest_service import DATASET_VERSION_MISSING, refresh_answer_digests
+
+def _question_key(text: str) -> tuple:
+    try:
+        chapter, section, question = (int(part) for part in text.split("-"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"章-節-問題番号で指定してください: {text}")
+    return chapter, section, question
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="正解クエリの結果の要約を計算する")
+    parser.add_argument("--question", type=_question_key, action="append",
+                        help="計算する問題（章-節-問題番号、複数指定可）")
+    parser.add_argument("--force", action="store_true", help="新しい要約も計算し直す")
+    parser.add_argument("--workers", type=int, default=ANSWER_DIGEST_MAX_WORKERS,
+                        help="並行して流す正解クエリの数")
+    args = parser.parse_args()
+    if not has_dataset_version():
+        print(f"( ´,_ゝ`) < {DATASET_VERSION_MISSING}")
+        sys.exit(1)
+
+    summary = refresh_answer_digests(keys=args.question, force=args.force, max_workers=args.workers)
+    for error in summary["errors"]:
+        chapter, section, question = error["question_key"]
+        print(f"( ´,_ゝ`) < Failed: {chapter}-{section}-{question}: {error['error']}")
+    print(f"( ´_ゝ`) < 全 {summary['computed']} 件計算しました。")
+    print(f"( ´,_ゝ`) < 全 {summary['failed']} 件失敗しましたｗｗｗ")
+    print(f"(ﾟдﾟ)､ﾍﾟｯ < 全 {summary['skipped']} 件スキップしました。")
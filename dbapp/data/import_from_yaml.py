@@ -1,181 +1,264 @@
-import yaml
-import sqlite3
+# 問題データ（`src/`のYAML）を`practice.db`に取り込む
+#   使い方: `dbapp/data`で `python import_from_yaml.py [--initial | --questions | --all] [--dry-run]`
+#   YAMLとDBの中身を行ごとの内容のハッシュで比べ、追加・変更・削除のあった行だけを
+#   `executemany`でまとめて、1回のトランザクションで書く（何も変わらなければ書かない）
+#   YAMLにない行は削除する（章・節を消すと、その下の問題も消える）
+import hashlib
+import json
 import os
+import sqlite3
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+import yaml
+
 from sqlite_connection import (
-    get_connection, 
-    BASE_DIR, 
-    DB_PATH, 
+    get_connection,
+    bump_data_version,
     SRC_PATH
 )
 
-# 問題データをインポート
-def import_questions(reimport: bool=False):
-    # `reimport`フラグがTrueだったら`Question`を空にする
-    if reimport:
-        with get_connection() as conn:
-            cur = conn.cursor()
-            cur.execute("DELETE FROM Questions;")
-            conn.commit()
+# libyamlがあればCの実装で読む（ないときはPure Pythonの実装）
+YamlLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
 
-    yaml_path = os.path.join(SRC_PATH, "questions.yaml")
+class TableSpec:
+    """ 取り込み先のテーブル（キーの列・値の列と、YAMLの項目名との対応）
+    """
 
-    # yamlのデータを読み込む
-    with open(yaml_path, encoding="utf-8") as f:
-        data = yaml.safe_load(f)
+    def __init__(self, table: str, key_columns: Dict[str, str], value_columns: Dict[str, str],
+                 defaults: Optional[Dict[str, Any]]=None, parent: Optional["TableSpec"]=None):
+        self.table = table
+        # 列名 -> YAMLの項目名
+        self.key_columns = key_columns
+        self.value_columns = value_columns
+        self.defaults = defaults or {}
+        # 親テーブル（キーの先頭部分が親のキー）
+        self.parent = parent
 
-    success = 0
-    fail = 0
-    skipped = 0
+    def key_of(self, item: Dict[str, Any]) -> Tuple[int, ...]:
+        return tuple(int(item[name]) for name in self.key_columns.values())
 
-    for item in data:
-        try:
-            if insert_question(item):
-                success += 1
-            else:
-                skipped += 1
-        except Exception as e:
-            print(f"( ´,_ゝ`) < Failed: {e} : {item}")
-            fail += 1        
-
-    print(f"( ´_ゝ`) < 全 {success} 件追加しました。")
-    print(f"( ´,_ゝ`) < 全 {fail} 件失敗しましたｗｗｗ")
-    print(f"(ﾟдﾟ)､ﾍﾟｯ < 全 {skipped} 件スキップしました。")
-
-def insert_question(item) -> bool:
-    # 既存の章・節・問番号だったら追加しない
-    chapter_number = item["chapter_number"]
-    section_number = item["section_number"] 
-    question_number = item["question_number"]
-    
-    if exists_question(
-        chapter_number, 
-        section_number, 
-        question_number
-    ):
-        return False
-    
-    conn = get_connection()
-    cur = conn.cursor()
-
-    query = """
-        INSERT INTO Questions(
-            ChapterNumber,
-            SectionNumber,
-            QuestionNumber,
-            Question,
-            AnswerQuery,
-            CheckMode
-        ) VALUES (
-            ?, ?, ?, ?, ?, ?
-        );
-    """
+    def values_of(self, item: Dict[str, Any]) -> Tuple[Any, ...]:
+        values = []
+        for name in self.value_columns.values():
+            value = item.get(name, self.defaults.get(name))
+            if value is None:
+                raise KeyError(name)
+            values.append(value)
+        return tuple(values)
+
+    def select_query(self, keys_only: bool=False) -> str:
+        columns = ", ".join([*self.key_columns, *([] if keys_only else self.value_columns)])
+        return f"SELECT {columns} FROM {self.table};"
 
-    cur.execute(
-        query, 
-        (
-            chapter_number, 
-            section_number, 
-            question_number, 
-            item["question"], 
-            item["answer_query"], 
-            item.get("check_mode", "strict")
+    def upsert_query(self) -> str:
+        # 値の列だけを更新する（YAMLにない列（説明文など）はそのまま残す）
+        columns = [*self.key_columns, *self.value_columns]
+        updates = ", ".join(f"{column} = excluded.{column}" for column in self.value_columns)
+        return (
+            f"INSERT INTO {self.table} ({', '.join(columns)}) "
+            f"VALUES ({', '.join('?' for _ in columns)}) "
+            f"ON CONFLICT ({', '.join(self.key_columns)}) DO UPDATE SET {updates};"
         )
-    )
 
-    conn.commit()
-    conn.close()
-    return True
+    def delete_query(self) -> str:
+        conditions = " AND ".join(f"{column} = ?" for column in self.key_columns)
+        return f"DELETE FROM {self.table} WHERE {conditions};"
 
+CHAPTERS = TableSpec(
+    "Chapters",
+    key_columns={"ChapterNumber": "chapter_number"},
+    value_columns={"ChapterTitle": "chapter_title"},
+)
+SECTIONS = TableSpec(
+    "Sections",
+    key_columns={"ChapterNumber": "chapter_number", "SectionNumber": "section_number"},
+    value_columns={"SectionTitle": "section_title"},
+    parent=CHAPTERS,
+)
+QUESTIONS = TableSpec(
+    "Questions",
+    key_columns={"ChapterNumber": "chapter_number", "SectionNumber": "section_number", "QuestionNumber": "question_number"},
+    value_columns={"Question": "question", "AnswerQuery": "answer_query", "CheckMode": "check_mode"},
+    defaults={"check_mode": "strict"},
+    parent=SECTIONS,
+)
 
-def exists_question(chapter_number: int, section_number: int, question_number: int) -> bool:
-    conn = get_connection()
-    cur = conn.cursor()
-
-    cur.execute("""
-        SELECT 
-            1
-        FROM
-            Questions
-        WHERE
-            ChapterNumber = ?
-            AND SectionNumber = ?
-            AND QuestionNumber = ?
-        LIMIT
-            1
-        ;
-    """, 
-    (chapter_number, section_number, question_number)
-    )
-
-    row = cur.fetchone()
-    conn.close()
-
-    return row is not None
-
-def initial_import():
-    # 章データ・節データのインポート
-    chapters_yaml = os.path.join(SRC_PATH, "chapters.yaml")
-    chapters_query = """
-        INSERT INTO chapters (
-            ChapterNumber
-            , ChapterTitle
-        ) VALUES (
-            ?, ?
-        );
+class TableDiff:
+    """ YAMLとDBの差分（追加・変更・削除する行と、変わらない行・読めなかった項目の数）
     """
-    conn = get_connection()
-    cur = conn.cursor()
-    # chapters_yamlのデータを読み込む
-    with open(chapters_yaml, encoding="utf-8") as f:
-        data = yaml.safe_load(f)
-        for item in data:
-            cur.execute(chapters_query,
-                (
-                    item["chapter_number"], 
-                    item["chapter_title"]
-                )
-            )
-    conn.commit()
-    
-    sections_yaml = os.path.join(SRC_PATH, "sections.yaml")
-    sections_query = """
-        INSERT INTO sections (
-            SectionNumber, 
-            ChapterNumber, 
-            SectionTitle
-        ) VALUES (
-            ?, ?, ?
-        );
+
+    def __init__(self, spec: TableSpec):
+        self.spec = spec
+        self.inserts: List[Tuple[Any, ...]] = []
+        self.updates: List[Tuple[Any, ...]] = []
+        self.deletes: List[Tuple[int, ...]] = []
+        self.unchanged = 0
+        self.failed: List[Tuple[Any, str]] = []
+        # 取り込み後にあるはずのキー（子テーブルの親の確認用）
+        self.keys: Set[Tuple[int, ...]] = set()
+
+    @property
+    def changed(self) -> bool:
+        return bool(self.inserts or self.updates or self.deletes)
+
+    def apply(self, conn: sqlite3.Connection) -> None:
+        """ 追加・変更した行を書き込む（削除は`apply_deletes()`で別に行う）
+        """
+        rows = self.inserts + self.updates
+        if rows:
+            conn.executemany(self.spec.upsert_query(), rows)
+
+    def apply_deletes(self, conn: sqlite3.Connection) -> None:
+        if self.deletes:
+            conn.executemany(self.spec.delete_query(), self.deletes)
+
+    def print_summary(self, dry_run: bool=False) -> None:
+        table = self.spec.table
+        for item, error in self.failed:
+            print(f"( ´,_ゝ`) < Failed: {error} : {item}")
+        if dry_run:
+            for verb, rows in (("insert", self.inserts), ("update", self.updates), ("delete", self.deletes)):
+                for row in rows:
+                    key = row[:len(self.spec.key_columns)]
+                    print(f"(dry) would {verb}: {table} {'-'.join(map(str, key))}")
+        print(f"( ´_ゝ`) < {table}: 追加 {len(self.inserts)} 件 / 変更 {len(self.updates)} 件 / 削除 {len(self.deletes)} 件")
+        print(f"(ﾟдﾟ)､ﾍﾟｯ < {table}: 変更なし {self.unchanged} 件")
+        if self.failed:
+            print(f"( ´,_ゝ`) < {table}: 全 {len(self.failed)} 件失敗しましたｗｗｗ")
+
+def content_hash(values: Sequence[Any]) -> str:
+    """ 1行分の内容のハッシュ（YAMLとDBの行が同じかどうかの比較用）
+    """
+    text = json.dumps(list(values), ensure_ascii=False, separators=(",", ":"))
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+def load_yaml(file_name: str) -> List[Dict[str, Any]]:
+    with open(os.path.join(SRC_PATH, file_name), encoding="utf-8") as f:
+        return yaml.load(f, Loader=YamlLoader) or []
+
+def diff_table(conn: sqlite3.Connection, spec: TableSpec, items: Iterable[Dict[str, Any]],
+               reimport: bool=False, parent_keys: Optional[Set[Tuple[int, ...]]]=None) -> TableDiff:
+    """ YAMLの項目とDBの行を比べる
+        `reimport`なら、変わらない行も書き直す
+        `parent_keys`を渡すと、親のない項目は失敗として飛ばす
+    """
+    diff = TableDiff(spec)
+    n_parent_keys = len(spec.parent.key_columns) if spec.parent is not None else 0
+    n_keys = len(spec.key_columns)
+    current = {
+        tuple(row[:n_keys]): content_hash(tuple(row[n_keys:]))
+        for row in conn.execute(spec.select_query())
+    }
+    seen = set()
+    for item in items:
+        try:
+            key = spec.key_of(item)
+        except (KeyError, TypeError, ValueError) as e:
+            diff.failed.append((item, f"項目が足りないか不正です: {e}"))
+            continue
+        if key in seen:
+            diff.failed.append((item, "キーが重複しています"))
+            continue
+        # キーが読めたら、値が不正でもDBの行は消さない
+        seen.add(key)
+        try:
+            values = spec.values_of(item)
+        except (KeyError, TypeError, ValueError) as e:
+            diff.failed.append((item, f"項目が足りないか不正です: {e}"))
+            continue
+        if parent_keys is not None and key[:n_parent_keys] not in parent_keys:
+            diff.failed.append((item, f"{spec.parent.table}にありません"))
+            continue
+        diff.keys.add(key)
+        old_hash = current.get(key)
+        if old_hash is None:
+            diff.inserts.append(key + values)
+        elif reimport or old_hash != content_hash(values):
+            diff.updates.append(key + values)
+        else:
+            diff.unchanged += 1
+    # 不正な項目も、YAMLにはあるので消さない
+    diff.deletes = [key for key in current if key not in seen]
+    return diff
+
+def apply_diffs(conn: sqlite3.Connection, diffs: Sequence[TableDiff]) -> bool:
+    """ 差分をまとめて1回のトランザクションで書く（何か書いたらTrue）
+        `diffs`は親テーブルから順に並べておく
+        （追加・変更は親から、削除は子から行う）
+    """
+    if not any(diff.changed for diff in diffs):
+        return False
+    try:
+        for diff in diffs:
+            diff.apply(conn)
+        for diff in reversed(diffs):
+            diff.apply_deletes(conn)
+        # アプリ側の問題カタログを作り直させる（ここでコミットされる）
+        bump_data_version(conn)
+    except Exception:
+        conn.rollback()
+        raise
+    return True
+
+def sync_tables(chapters: Optional[Iterable[Dict[str, Any]]]=None,
+                sections: Optional[Iterable[Dict[str, Any]]]=None,
+                questions: Optional[Iterable[Dict[str, Any]]]=None,
+                reimport: bool=False, dry_run: bool=False) -> List[TableDiff]:
+    """ 章・節・問題の項目（YAMLの形のdictのリスト）をDBに反映し、差分を返す
+        Noneを渡したテーブルには触らない
+        `reimport`なら、変わっていない問題も書き直す
     """
-    # chapters_yamlのデータを読み込む
-    with open(sections_yaml, encoding="utf-8") as f:
-        data = yaml.safe_load(f)
-        for item in data:
-            cur.execute(sections_query,
-                (
-                    item["section_number"], 
-                    item["chapter_number"], 
-                    item["section_title"]
-                )
-            )
-    conn.commit()
-    conn.close() 
-
-# def _get_connection() -> sqlite3.Connection:
-#     conn = sqlite3.connect(DB_PATH)
-#     conn.execute("PRAGMA foreign_keys = ON;")
-#     return conn
+    conn = get_connection()
+    try:
+        diffs = []
+        parent_keys = None
+        for spec, items in ((CHAPTERS, chapters), (SECTIONS, sections), (QUESTIONS, questions)):
+            if items is None:
+                parent_keys = None
+                continue
+            if spec.parent is not None and parent_keys is None:
+                parent_keys = _existing_keys(conn, spec.parent)
+            diff = diff_table(conn, spec, items, reimport=reimport and spec is QUESTIONS, parent_keys=parent_keys)
+            diffs.append(diff)
+            parent_keys = diff.keys
+        if not dry_run:
+            apply_diffs(conn, diffs)
+    finally:
+        conn.close()
+    for diff in diffs:
+        diff.print_summary(dry_run=dry_run)
+    return diffs
+
+def _existing_keys(conn: sqlite3.Connection, spec: TableSpec) -> Set[Tuple[int, ...]]:
+    return {tuple(row) for row in conn.execute(spec.select_query(keys_only=True))}
+
+# 問題データをインポート
+def import_questions(reimport: bool=False, dry_run: bool=False) -> List[TableDiff]:
+    # `reimport`フラグがTrueだったら、変わっていない問題も書き直す
+    return sync_tables(questions=load_yaml("questions.yaml"), reimport=reimport, dry_run=dry_run)
+
+def initial_import(dry_run: bool=False) -> List[TableDiff]:
+    # 章データ・節データのインポート
+    return sync_tables(
+        chapters=load_yaml("chapters.yaml"), sections=load_yaml("sections.yaml"), dry_run=dry_run)
+
+def import_all(reimport: bool=False, dry_run: bool=False) -> List[TableDiff]:
+    # 章・節・問題をまとめて1回のトランザクションでインポート
+    return sync_tables(
+        chapters=load_yaml("chapters.yaml"), sections=load_yaml("sections.yaml"),
+        questions=load_yaml("questions.yaml"), reimport=reimport, dry_run=dry_run)
 
 # エントリポイント
 if __name__ == "__main__":
     import argparse
+    import time
     parser = argparse.ArgumentParser(description="Import YAML -> SQLite for practice questions")
     parser.add_argument("--init-db", action="store_true", help="Initialize DB from schema.sql")
     parser.add_argument("--initial", action="store_true", help="Import chapters and sections")
     parser.add_argument("--questions", action="store_true", help="Import questions")
-    parser.add_argument("--questions-reset", action="store_true", help="Delete all existing questions before importing")
+    parser.add_argument("--questions-reset", action="store_true", help="Rewrite all questions even if unchanged")
     parser.add_argument("--all", action="store_true", help="Import initial data and questions")
-    parser.add_argument("--dry-run", action="store_true", help="Do not write to DB; only simulate")
+    parser.add_argument("--dry-run", action="store_true", help="Do not write to DB; only show the diff")
 
     args = parser.parse_args()
 
@@ -188,34 +271,21 @@ if __name__ == "__main__":
         from migrate import init_db
         init_db()
 
-    # `--dry-run`オプションありのときは、`insert_question()`関数を置き換える
-    #   -> DB書き込みを抑止するため
     if args.dry_run:
         print("( ´_ゝ`) < (dry-run) 実際のDB書き込みは行いません。")
 
-        # 一旦、本家`insert_question()`関数を変数`_real_insert`に退避
-        #   -> 必要になったときに元に戻せるようにするために、元の関数の参照を保持
-        _real_insert = insert_question
-
-        # `insert_question()`を上書きするための関数
-        #   -> DB書き込みを伴わない実装
-        def _insert_dry(item) -> bool:
-            chapter_number = item["chapter_number"]
-            section_number = item["section_number"]
-            question_number = item["question_number"]
-            print(f"(dry) would insert: Chapter={chapter_number}, Section={section_number}, Question={question_number}")
-            return not exists_question(chapter_number, section_number, question_number)
-        # `insert_question()`関数を`_insert_dry()`関数で乗っ取る
-        insert_question = _insert_dry
-
+    started_at = time.perf_counter()
     try:
-        if args.all or args.initial:
-            print("Initial import (chpaters/sections) running...")
-            initial_import()
-        if args.all or args.questions:
+        if args.all or (args.initial and args.questions):
+            print("Import (chapters/sections/questions) running...")
+            import_all(reimport=args.questions_reset, dry_run=args.dry_run)
+        elif args.initial:
+            print("Initial import (chapters/sections) running...")
+            initial_import(dry_run=args.dry_run)
+        else:
             print("Questions import running...")
-            import_questions(reimport=args.questions_reset)
+            import_questions(reimport=args.questions_reset, dry_run=args.dry_run)
     except Exception as e:
         print(f"Error during import: {e}")
         raise
-
+    print(f"( ´_ゝ`) < {(time.perf_counter() - started_at) * 1000:.1f} ms")
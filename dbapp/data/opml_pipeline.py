@@ -0,0 +1,191 @@
+# Dynalistの書き出し（OPML）から問題データを作って、YAML・`practice.db`に書くツール
+#   使い方: `dbapp/data`で `python opml_pipeline.py dynalist-2025-11-22.opml --yaml src/questions.yaml --db`
+#     --yaml PATH: 問題データをYAMLに書く（中身が変わらなければ書き直さない）
+#     --db:        `practice.db`の`Questions`に反映する（変わった問題だけ、`import_from_yaml`と同じ）
+#     --dry-run:   差分を表示するだけで書かない
+#   OPMLは`iterparse`で先頭から1回だけ読み、読み終わった要素はすぐに捨てる
+#   （全体の木を作らず、途中のファイル（`sanitized.opml`）も書かない）
+#
+# アウトラインの形
+#   第N章 > 【そのM】 > 第K問 / 書いてみよう > 問題文 > ※（`_note`に```で囲んだ正解クエリ）
+#   問題文の下に「※」だけがぶら下がっているときは、問題文と「※」を兄弟とみなす
+#   問題番号は節ごとに0から数える
+import os
+import re
+import xml.etree.ElementTree as ET
+from typing import Any, Dict, Iterator, List, Optional
+
+import yaml
+
+from import_from_yaml import QUESTIONS, YamlLoader, content_hash, sync_tables
+
+# libyamlがあればCの実装で書く
+YamlDumper = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+
+_CHAPTER = re.compile(r"第(\d+)章")
+_SECTION = re.compile(r"【その(\d+)】")
+_SQL_BLOCK = re.compile(r"```(.*?)```", re.DOTALL)
+_INDENT = re.compile(r"\n( +)")
+# 正解クエリのノードの印
+SQL_MARK = "※"
+
+def extract_sql(note_text: Optional[str]) -> str:
+    """ `_note`の中の```～```で囲まれたSQLを取り出して整形する
+    """
+    if not note_text:
+        return ""
+    # `&#10;`は`\n`に変換
+    note_text = note_text.replace("&#10;", "\n")
+    # 改行直後のスペース2n個 -> TAB n個
+    note_text = _INDENT.sub(lambda m: "\n" + "\t" * (len(m.group(1)) // 2), note_text)
+    m = _SQL_BLOCK.search(note_text)
+    if not m:
+        return ""
+    return m.group(1).strip()
+
+def is_question_container(text: str) -> bool:
+    # 「第N問」または「書いてみよう」
+    return (text.startswith("第") and "問" in text) or text == "書いてみよう"
+
+class _Node:
+    """ 読んでいる途中の`outline`要素
+        子要素は、問題の組み立てに要るところ（属性と、ただ1つの子の属性）だけを覚える
+    """
+    __slots__ = ("attrib", "chapter", "section", "is_section", "counter", "children")
+
+    def __init__(self, attrib: Dict[str, str], chapter: Optional[int], section: Optional[int], is_section: bool):
+        self.attrib = attrib
+        self.chapter = chapter
+        self.section = section
+        self.is_section = is_section
+        # 節の中の問題番号
+        self.counter = 0
+        # 子要素の(属性, ただ1つの子の属性またはNone)
+        self.children: List[tuple] = []
+
+    def flattened_children(self) -> List[Dict[str, str]]:
+        # 子の下に「※」だけがあれば、子と「※」を兄弟にする
+        flat = []
+        for attrib, only_child in self.children:
+            flat.append(attrib)
+            if only_child is not None and only_child.get("text") == SQL_MARK:
+                flat.append(only_child)
+        return flat
+
+def iter_questions(opml_path: str) -> Iterator[Dict[str, Any]]:
+    """ OPMLを先頭から読みながら、問題データ（`questions.yaml`の形のdict）を順に返す
+    """
+    stack: List[_Node] = []
+    for event, elem in ET.iterparse(opml_path, events=("start", "end")):
+        if elem.tag != "outline":
+            continue
+        if event == "start":
+            parent = stack[-1] if stack else None
+            text = elem.get("text", "")
+            chapter = parent.chapter if parent else None
+            section = parent.section if parent else None
+            chapter_match = _CHAPTER.match(text)
+            if chapter_match:
+                chapter = int(chapter_match.group(1))
+            section_match = _SECTION.match(text)
+            if section_match:
+                section = int(section_match.group(1))
+            stack.append(_Node(dict(elem.attrib), chapter, section, is_section=bool(section_match)))
+            continue
+
+        node = stack.pop()
+        # 子が1つだけなら覚えておく（「※」なら、親の側で兄弟として扱う）
+        only_child = node.children[0][0] if len(node.children) == 1 else None
+        if stack:
+            parent = stack[-1]
+            parent.children.append((node.attrib, only_child))
+            if parent.is_section and is_question_container(node.attrib.get("text", "")):
+                item = _build_question(parent, node)
+                if item is not None:
+                    yield item
+        # 読み終わった要素は捨てる
+        elem.clear()
+
+def _build_question(section: _Node, container: _Node) -> Optional[Dict[str, Any]]:
+    children = container.flattened_children()
+    if len(children) < 2:
+        return None
+    item = {
+        "chapter_number": section.chapter,
+        "section_number": section.section,
+        "question_number": section.counter,
+        "question": children[0].get("text"),
+        "answer_query": extract_sql(children[1].get("_note")),
+        "check_mode": "strict",
+    }
+    section.counter += 1
+    return item
+
+def write_yaml(items: List[Dict[str, Any]], yaml_path: str, dry_run: bool=False) -> bool:
+    """ 問題データをYAMLに書く（書いたらTrue）
+        今のファイルと問題ごとの内容のハッシュで比べ、何も変わっていなければ書かない
+    """
+    current = {}
+    if os.path.exists(yaml_path):
+        with open(yaml_path, encoding="utf-8") as f:
+            for old in yaml.load(f, Loader=YamlLoader) or []:
+                try:
+                    current[QUESTIONS.key_of(old)] = content_hash(QUESTIONS.values_of(old))
+                except (KeyError, TypeError, ValueError):
+                    continue
+
+    added = changed = unchanged = 0
+    keys = set()
+    for item in items:
+        try:
+            key = QUESTIONS.key_of(item)
+            new_hash = content_hash(QUESTIONS.values_of(item))
+        except (KeyError, TypeError, ValueError):
+            # 章・節の外の問題など（YAMLには書き、取り込み時に失敗として報告する）
+            changed += 1
+            continue
+        keys.add(key)
+        old_hash = current.get(key)
+        if old_hash is None:
+            added += 1
+        elif old_hash != new_hash:
+            changed += 1
+        else:
+            unchanged += 1
+    removed = len(current.keys() - keys)
+
+    print(f"( ´_ゝ`) < {yaml_path}: 追加 {added} 件 / 変更 {changed} 件 / 削除 {removed} 件")
+    print(f"(ﾟдﾟ)､ﾍﾟｯ < {yaml_path}: 変更なし {unchanged} 件")
+    if dry_run or not (added or changed or removed):
+        return False
+
+    # 書き出しは一時ファイルに行い、最後に差し替える
+    tmp_path = yaml_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        yaml.dump(items, f, Dumper=YamlDumper, allow_unicode=True, sort_keys=False)
+    os.replace(tmp_path, yaml_path)
+    return True
+
+if __name__ == "__main__":
+    import argparse
+    import time
+    parser = argparse.ArgumentParser(description="Dynalist OPML -> YAML / SQLite for practice questions")
+    parser.add_argument("opml", help="Dynalistから書き出したOPMLファイル")
+    parser.add_argument("--yaml", help="問題データを書くYAMLファイル（例: src/questions.yaml）")
+    parser.add_argument("--db", action="store_true", help="practice.dbのQuestionsに反映する")
+    parser.add_argument("--dry-run", action="store_true", help="差分を表示するだけで書かない")
+    args = parser.parse_args()
+    if not (args.yaml or args.db):
+        parser.error("--yaml か --db のどちらか（または両方）を指定してください")
+
+    if args.dry_run:
+        print("( ´_ゝ`) < (dry-run) 実際の書き込みは行いません。")
+
+    started_at = time.perf_counter()
+    items = list(iter_questions(args.opml))
+    print(f"( ´_ゝ`) < OPMLから {len(items)} 問読みました。")
+    if args.yaml:
+        write_yaml(items, args.yaml, dry_run=args.dry_run)
+    if args.db:
+        sync_tables(questions=items, dry_run=args.dry_run)
+    print(f"( ´_ゝ`) < {(time.perf_counter() - started_at) * 1000:.1f} ms")
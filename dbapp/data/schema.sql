@@ -1,3 +1,4 @@
+DROP TABLE IF EXISTS AnswerDigests;
 DROP TABLE IF EXISTS Questions;
 DROP TABLE IF EXISTS Sections;
 DROP TABLE IF EXISTS Chapters;
@@ -35,3 +36,23 @@ CREATE TABLE Questions (
         REFERENCES Sections(ChapterNumber, SectionNumber)
         ON DELETE CASCADE
 );
+
+-- 正解クエリの結果の要約（`python -m dbapp.data.compute_answer_digests`・アプリの裏で計算）
+--   AnswerQueryHash・DatasetVersionが今の正解クエリ・データセットと違うものは使わない
+CREATE TABLE IF NOT EXISTS AnswerDigests (
+    ChapterNumber INTEGER NOT NULL
+    , SectionNumber INTEGER NOT NULL
+    , QuestionNumber INTEGER NOT NULL
+    , AnswerQueryHash TEXT NOT NULL
+    , DatasetVersion TEXT NOT NULL
+    , Columns TEXT NOT NULL
+    , RowCount INTEGER NOT NULL
+    , OrderedDigest TEXT NOT NULL
+    , MultisetDigest TEXT NOT NULL
+    , ExpectedRows TEXT DEFAULT NULL
+    , ComputedAt REAL NOT NULL
+    , PRIMARY KEY (ChapterNumber, SectionNumber, QuestionNumber)
+    , FOREIGN KEY (ChapterNumber, SectionNumber, QuestionNumber)
+        REFERENCES Questions(ChapterNumber, SectionNumber, QuestionNumber)
+        ON DELETE CASCADE
+);
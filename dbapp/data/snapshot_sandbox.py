@@ -0,0 +1,125 @@
+# MySQLの練習用テーブルをSQLiteファイル（サンドボックス）に写すツール
+#   使い方: リポジトリのルートで `python -m dbapp.data.snapshot_sandbox`
+#   `.env`の接続情報でMySQLにつなぎ、`TABLE_NAMES`の全テーブルを写す
+#   書き出しは一時ファイルに行い、最後に差し替える（実行中のアプリはそのまま読める）
+import argparse
+import os
+import sqlite3
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+
+from dotenv import load_dotenv
+
+# 接続文字列は`import`時に組み立てられるので、先に`.env`を読む
+load_dotenv()
+
+import pyodbc
+
+from dbapp.db.connection import CONNECTION_STRING
+from dbapp.db.queries import TABLE_NAMES
+from dbapp.db.sandbox import SANDBOX_DB_PATH, DESCRIBE_TABLE, SNAPSHOT_FORMAT
+
+# 1回にコピーする行数
+COPY_CHUNK_SIZE = 1000
+
+# MySQLの型名（先頭部分） -> SQLiteの型
+_TYPE_AFFINITY = [
+    (("tinyint", "smallint", "mediumint", "int", "bigint", "bit", "year"), "INTEGER"),
+    (("decimal", "numeric", "float", "double", "real"), "NUMERIC"),
+    # 文字列はMySQLの照合順序と同じく、大文字・小文字を区別せずに比べる・並べる
+    (("char", "varchar", "tinytext", "text", "mediumtext", "longtext", "enum", "set"), "TEXT COLLATE NOCASE"),
+]
+
+def _sqlite_type(mysql_type: str) -> str:
+    base = mysql_type.lower().split("(")[0].strip()
+    for names, affinity in _TYPE_AFFINITY:
+        if base in names:
+            return affinity
+    # 日付・時刻などはTEXT（日付関数は文字列で受け取る）
+    return "TEXT"
+
+def _to_sqlite(value):
+    """ SQLiteに入れられない型を変換する
+    """
+    if isinstance(value, Decimal):
+        # NUMERIC列に文字列で入れると、SQLite側で数値に変換される
+        return str(value)
+    if isinstance(value, datetime):
+        return value.strftime("%Y-%m-%d %H:%M:%S")
+    if isinstance(value, date):
+        return value.strftime("%Y-%m-%d")
+    if isinstance(value, (time, timedelta)):
+        return str(value)
+    return value
+
+def _quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+def _copy_table(src: pyodbc.Connection, dest: sqlite3.Connection, table_name: str) -> int:
+    """ 1テーブル分の構造とデータを写し、コピーした行数を返す
+    """
+    cur = src.cursor()
+    # テーブル構造（`DESC`の結果はそのまま保存して、サンドボックスの`DESC`で返す）
+    cur.execute(f"DESC {table_name};")
+    describe = [tuple(row) for row in cur.fetchall()]
+    dest.executemany(
+        f"INSERT INTO {DESCRIBE_TABLE} VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        [(table_name, i, *map(_to_sqlite, row)) for i, row in enumerate(describe)]
+    )
+
+    column_defs = [f"{_quote(row[0])} {_sqlite_type(row[1])}" for row in describe]
+    primary_keys = [_quote(row[0]) for row in describe if row[3] == "PRI"]
+    if primary_keys:
+        column_defs.append(f"PRIMARY KEY ({', '.join(primary_keys)})")
+    dest.execute(f"CREATE TABLE {_quote(table_name)} ({', '.join(column_defs)});")
+
+    # データ
+    placeholders = ", ".join("?" for _ in describe)
+    insert = f"INSERT INTO {_quote(table_name)} VALUES ({placeholders})"
+    cur.execute(f"SELECT * FROM {table_name};")
+    copied = 0
+    while True:
+        rows = cur.fetchmany(COPY_CHUNK_SIZE)
+        if not rows:
+            break
+        dest.executemany(insert, [tuple(map(_to_sqlite, row)) for row in rows])
+        copied += len(rows)
+    cur.close()
+    return copied
+
+def snapshot(dest_path: str=SANDBOX_DB_PATH, tables=TABLE_NAMES) -> None:
+    """ MySQLのテーブルをSQLiteファイルに写す
+    """
+    tmp_path = dest_path + ".tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    src = pyodbc.connect(CONNECTION_STRING)
+    dest = sqlite3.connect(tmp_path)
+    try:
+        dest.execute(
+            f"CREATE TABLE {DESCRIBE_TABLE} ("
+            "TableName TEXT, Position INTEGER, "
+            'Field TEXT, Type TEXT, "Null" TEXT, "Key" TEXT, "Default" TEXT, Extra TEXT, '
+            "PRIMARY KEY (TableName, Position));"
+        )
+        for table_name in tables:
+            copied = _copy_table(src, dest, table_name)
+            print(f"( ´_ゝ`) < {table_name}: {copied} 件コピーしました。")
+        dest.execute(f"PRAGMA user_version = {SNAPSHOT_FORMAT};")
+        dest.commit()
+        # 統計情報を作っておく（クエリプランナ用）
+        dest.execute("ANALYZE;")
+        dest.commit()
+    finally:
+        dest.close()
+        src.close()
+
+    os.replace(tmp_path, dest_path)
+    print(f"( ´_ゝ`) < サンドボックスを作成しました: {dest_path}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="練習用テーブルをSQLiteに写す")
+    parser.add_argument("--dest", default=SANDBOX_DB_PATH, help="出力先のSQLiteファイル")
+    args = parser.parse_args()
+    snapshot(dest_path=args.dest)
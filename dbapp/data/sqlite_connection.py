@@ -3,11 +3,21 @@ import os
 
 _CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
 BASE_DIR = os.path.dirname(_CURRENT_DIR)
-DB_PATH = os.path.join(BASE_DIR, "data", "practice.db")
+# 問題データのDB（`.env`の`PRACTICE_DB_PATH`で差し替え可能）
+DB_PATH = os.getenv("PRACTICE_DB_PATH", os.path.join(BASE_DIR, "data", "practice.db"))
 SRC_PATH = os.path.join(BASE_DIR, "data", "src")
 
 def get_connection() -> sqlite3.Connection:
     conn = sqlite3.connect(DB_PATH)
     conn.row_factory = sqlite3.Row
     conn.execute("PRAGMA foreign_keys = ON;")
-    return conn
\ No newline at end of file
+    return conn
+
+def bump_data_version(conn: sqlite3.Connection) -> int:
+    """ 問題データのバージョン（`PRAGMA user_version`）を1つ上げる
+        アプリ側の問題カタログは、この値が変わると作り直される
+    """
+    version = conn.execute("PRAGMA user_version;").fetchone()[0] + 1
+    conn.execute(f"PRAGMA user_version = {version};")
+    conn.commit()
+    return version
@@ -1,5 +1,10 @@
 import pyodbc
 import os
+import threading
+from typing import Optional
+
+from .pool import ConnectionPool
+from . import sandbox
 
 CONNECTION_STRING = f"""
 DRIVER={ os.getenv('DB_DRIVER') };
@@ -11,7 +16,91 @@ PWD={ os.getenv('DB_PASSWORD') };
 OPTION=3;
 """
 
-def get_connection():
-    """`pyodbc.Connection`インスタンスを返す
+# クエリの実行先（`.env`で切り替え）
+#   - `odbc`: MySQL（pyodbc経由）
+#   - `sandbox`: 練習用データセットのスナップショット（SQLite、プロセス内）
+DB_BACKEND = os.getenv("DB_BACKEND", "odbc").lower()
+# MySQLのデータセットのバージョン（`.env`の`DATASET_VERSION`、入れ替えたら変える）
+DATASET_VERSION = os.getenv("DATASET_VERSION", "")
+
+# コネクションプールの設定（`.env`で上書き可能）
+POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "0"))
+POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+POOL_IDLE_TIMEOUT = float(os.getenv("DB_POOL_IDLE_TIMEOUT", "300"))
+POOL_MAX_LIFETIME = float(os.getenv("DB_POOL_MAX_LIFETIME", "1800"))
+POOL_CHECKOUT_TIMEOUT = float(os.getenv("DB_POOL_CHECKOUT_TIMEOUT", "30"))
+
+# サーバー側で打ち切るSELECTの実行時間の上限（ミリ秒、0なら無制限）
+#   個々のクエリの期限はこれより短く、`queries`側でドライバのタイムアウトと中断で守る
+#   これは期限の指定漏れや中断の失敗に備えた最後の砦
+MAX_EXECUTION_TIME_MS = int(os.getenv("DB_MAX_EXECUTION_TIME_MS", "60000"))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def _connect():
+    """ 新しいコネクションを作る（プール用）
+        `DB_BACKEND=sandbox`なら`sandbox.SandboxConnection`、それ以外は`pyodbc.Connection`
+    """
+    if DB_BACKEND == "sandbox":
+        return sandbox.connect()
+    conn = pyodbc.connect(CONNECTION_STRING)
+    # 学習者のクエリしか流さないので、セッションを読み取り専用にしておく
+    cur = conn.cursor()
+    try:
+        cur.execute("SET SESSION TRANSACTION READ ONLY;")
+        cur.execute(f"SET SESSION max_execution_time = {MAX_EXECUTION_TIME_MS};")
+    finally:
+        cur.close()
+    conn.commit()
+    return conn
+
+def get_pool() -> ConnectionPool:
+    """ プロセス共通のコネクションプールを返す
+        初回呼び出し時に作成する
+    """
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                pool = ConnectionPool(
+                    connect=_connect,
+                    min_size=POOL_MIN_SIZE,
+                    max_size=POOL_MAX_SIZE,
+                    idle_timeout=POOL_IDLE_TIMEOUT,
+                    max_lifetime=POOL_MAX_LIFETIME,
+                    checkout_timeout=POOL_CHECKOUT_TIMEOUT,
+                )
+                pool.fill()
+                _pool = pool
+    return _pool
+
+def get_connection(timeout: Optional[float] = None):
+    """ プールからコネクション（`pyodbc.Connection`または`SandboxConnection`）を借りる
+        `with get_connection() as conn:`で使い、抜けると返却される
+        `timeout`は空き待ちの最大秒数（省略時は`DB_POOL_CHECKOUT_TIMEOUT`）
+    """
+    return get_pool().connection(timeout)
+
+def get_pool_stats() -> dict:
+    """ コネクションプールの統計情報（貸出中・待ち・作成数・作り直し数）を返す
+    """
+    return get_pool().stats()
+
+def get_dataset_version() -> str:
+    """ 練習用データセットのバージョンを返す（結果キャッシュ・正解の要約の鮮度の確認用）
+        サンドボックスはスナップショットのファイルを作り直したら変わる
+        MySQLは`.env`の`DATASET_VERSION`
+    """
+    if DB_BACKEND == "sandbox":
+        try:
+            return f"sandbox:{os.stat(sandbox.SANDBOX_DB_PATH).st_mtime_ns}"
+        except OSError:
+            return "sandbox:"
+    return f"{DB_BACKEND}:{DATASET_VERSION}"
+
+def has_dataset_version() -> bool:
+    """ データセットのバージョンがわかるか（わからなければ、保存した正解の要約は使えない）
+        サンドボックスはいつもわかる、MySQLは`.env`に`DATASET_VERSION`があるときだけ
     """
-    return pyodbc.connect(CONNECTION_STRING)
\ No newline at end of file
+    return DB_BACKEND == "sandbox" or bool(DATASET_VERSION)
@@ -12,3 +12,18 @@ class QueryRuntimeError(DatabaseExecutionError):
     """ 接続・タイムアウト・ロックなどの実行時エラー
     """
     pass
+
+class PoolTimeoutError(QueryRuntimeError):
+    """ コネクションプールの空き待ちタイムアウト
+    """
+    pass
+
+class QueryCancelledError(QueryRuntimeError):
+    """ 実行中のクエリが外部から中断された
+    """
+    pass
+
+class QueryTimeoutError(QueryRuntimeError):
+    """ 実行期限を過ぎたため、クエリを打ち切った
+    """
+    pass
@@ -1,14 +1,7 @@
 import os
 import time
-import pandas as pd
-import win32com.client
-import pythoncom
-from dotenv import load_dotenv
 from datetime import datetime
 
-# `.env`読み込み
-load_dotenv()
-
 from dbapp.db.connection import CONNECTION_STRING
 
 EXCEL_PATH = os.path.join(os.path.dirname(__file__), "source.xlsm")
@@ -33,6 +26,14 @@ def normalize_value(v):
         return v.strftime('%Y-%m-%d %H:%M:%S')
     return v
 
+def _load_com():
+    """ COM関係のモジュール（pywin32）を読み込んで返す
+        Windows専用で読み込みも重いので、踏み台Excelを実際に使うときまで読み込まない
+    """
+    import pythoncom
+    import win32com.client
+    return pythoncom, win32com.client
+
 def fetch_all_excel(query: str, params=None, timeout: int=30):
     """ Excel経由でDBからレコードセットを取得
         (columns, rows)の形で結果を返却
@@ -52,10 +53,11 @@ def fetch_all_excel(query: str, params=None, timeout: int=30):
         ])
 
     # Flaskのスレッド内でCOMを初期化
+    pythoncom, win32com_client = _load_com()
     pythoncom.CoInitialize()
 
     try:
-        excel = win32com.client.DispatchEx("Excel.Application")
+        excel = win32com_client.DispatchEx("Excel.Application")
         excel.Visible = False
         wb = excel.Workbooks.Open(EXCEL_PATH)
 
@@ -78,9 +80,10 @@ def fetch_both_with_single_excel(user_query, answer_query, timeout=30):
     print("fetch_both_with_single_excel() executed!!")
     role_user = "ユーザ投稿クエリ"
     role_answer = "正解クエリ"
+    pythoncom, win32com_client = _load_com()
     pythoncom.CoInitialize()
     try: 
-        excel = win32com.client.DispatchEx("Excel.Application")
+        excel = win32com_client.DispatchEx("Excel.Application")
         excel.Visible = False
         wb = excel.Workbooks.Open(EXCEL_PATH)
 
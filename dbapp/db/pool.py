@@ -0,0 +1,317 @@
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Optional
+
+from .exceptions import PoolTimeoutError
+
+class _PooledConnection:
+    """ プール内のコネクションと、その管理情報をまとめたもの
+    """
+    __slots__ = ("conn", "created_at", "last_used")
+
+    def __init__(self, conn: Any):
+        now = time.monotonic()
+        self.conn = conn
+        self.created_at = now
+        self.last_used = now
+
+class ConnectionPool:
+    """ スレッドセーフなコネクションプール
+        `connect`には新しいコネクションを返す関数を渡す
+        （`pyodbc.connect`でも`sqlite3.connect`でもOK）
+
+        - `min_size`: 最低限プールに保持しておくコネクション数
+        - `max_size`: 同時に存在できるコネクションの上限
+        - `idle_timeout`: 使われないまま放置されたコネクションを捨てるまでの秒数
+        - `max_lifetime`: コネクションの寿命（秒）。超えたら作り直す
+        - `checkout_timeout`: 空きを待つ最大秒数。超えたら`PoolTimeoutError`
+        - `ping_after`: この秒数以上寝ていたコネクションは貸出前に生存確認する
+    """
+
+    def __init__(
+        self,
+        connect: Callable[[], Any],
+        min_size: int = 0,
+        max_size: int = 10,
+        idle_timeout: float = 300.0,
+        max_lifetime: float = 1800.0,
+        checkout_timeout: float = 30.0,
+        ping_after: float = 5.0,
+        ping_query: str = "SELECT 1",
+    ):
+        if max_size < 1:
+            raise ValueError("max_size must be >= 1")
+        if min_size < 0 or min_size > max_size:
+            raise ValueError("min_size must be between 0 and max_size")
+        self._connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.max_lifetime = max_lifetime
+        self.checkout_timeout = checkout_timeout
+        self.ping_after = ping_after
+        self.ping_query = ping_query
+
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+        # 空きコネクション（後入れ先出しで、温まっているものから使う）
+        self._idle: Deque[_PooledConnection] = deque()
+        # 貸出中のコネクション（`id(conn)` -> 管理情報）
+        self._in_use: Dict[int, _PooledConnection] = {}
+        # 作成中のコネクション数（ロック外で接続するため予約しておく）
+        self._pending = 0
+        # 生存確認中のコネクション数（ロック外で確認するため数えておく）
+        self._checking = 0
+        self._closed = False
+        self._last_prune = time.monotonic()
+
+        # 統計情報
+        self._waiting = 0
+        self._created = 0
+        self._recycled = 0
+
+    # ------------------------------------------------------------------
+    # 貸出・返却
+    # ------------------------------------------------------------------
+    def acquire(self, timeout: Optional[float] = None) -> Any:
+        """ コネクションを1つ借りる
+            空きがなく上限に達しているときは、返却されるまで待つ
+        """
+        if timeout is None:
+            timeout = self.checkout_timeout
+        deadline = time.monotonic() + timeout
+
+        while True:
+            entry = None
+            need_new = False
+            with self._available:
+                while True:
+                    if self._closed:
+                        raise PoolTimeoutError("コネクションプールは閉じられています。")
+                    if self._idle:
+                        entry = self._idle.pop()
+                        self._checking += 1
+                        break
+                    if self._size() < self.max_size:
+                        self._pending += 1
+                        need_new = True
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise PoolTimeoutError(
+                            f"DB接続の空き待ちが{timeout}秒を超えました。"
+                        )
+                    self._waiting += 1
+                    try:
+                        self._available.wait(remaining)
+                    finally:
+                        self._waiting -= 1
+
+            if need_new:
+                entry = self._open_new()
+            elif not self._is_usable(entry):
+                # 期限切れ or 死んでいる -> 捨てて取り直し
+                self._discard(entry, checking=True)
+                continue
+
+            with self._lock:
+                if not need_new:
+                    self._checking -= 1
+                entry.last_used = time.monotonic()
+                self._in_use[id(entry.conn)] = entry
+            return entry.conn
+
+    def release(self, conn: Any, discard: bool = False) -> None:
+        """ 借りたコネクションを返す
+            トランザクションは巻き戻してから戻す
+            `discard=True`のとき、または巻き戻しに失敗したときは捨てる
+        """
+        with self._lock:
+            entry = self._in_use.pop(id(conn), None)
+        if entry is None:
+            # このプールのものではない -> 閉じるだけ
+            _safe_close(conn)
+            return
+
+        if not discard:
+            try:
+                conn.rollback()
+            except Exception:
+                discard = True
+
+        if discard or self._expired(entry, time.monotonic()):
+            self._discard(entry)
+            return
+
+        with self._available:
+            if self._closed:
+                _safe_close(conn)
+                return
+            entry.last_used = time.monotonic()
+            self._idle.append(entry)
+            self._available.notify()
+            # 放置コネクションの掃除はたまにでよい
+            prune_due = entry.last_used - self._last_prune > self.idle_timeout / 2
+            if prune_due:
+                self._last_prune = entry.last_used
+        if prune_due:
+            self.prune()
+
+    def connection(self, timeout: Optional[float] = None) -> "_Checkout":
+        """ `with`文で使うための貸出口
+            `with pool.connection() as conn:`の形で使う
+            `timeout`は空き待ちの最大秒数（省略時は`checkout_timeout`）
+        """
+        return _Checkout(self, timeout)
+
+    # ------------------------------------------------------------------
+    # メンテナンス
+    # ------------------------------------------------------------------
+    def prune(self) -> None:
+        """ 放置されすぎ・寿命切れの空きコネクションを捨て、
+            `min_size`まで補充する
+        """
+        now = time.monotonic()
+        stale = []
+        with self._lock:
+            keep: Deque[_PooledConnection] = deque()
+            for entry in self._idle:
+                if self._expired(entry, now) or (
+                    now - entry.last_used > self.idle_timeout
+                    and self._size() - len(stale) > self.min_size
+                ):
+                    stale.append(entry)
+                else:
+                    keep.append(entry)
+            self._idle = keep
+        for entry in stale:
+            self._discard(entry)
+        self.fill()
+
+    def fill(self) -> None:
+        """ 空きコネクションを`min_size`まで作っておく
+            接続に失敗したら諦める（次の貸出時に作り直す）
+        """
+        while True:
+            with self._lock:
+                if self._closed or self._size() >= self.min_size:
+                    return
+                self._pending += 1
+            try:
+                entry = self._open_new()
+            except Exception:
+                return
+            with self._available:
+                self._idle.append(entry)
+                self._available.notify()
+
+    def close(self) -> None:
+        """ 空きコネクションをすべて閉じ、以後の貸出を止める
+            貸出中のものは返却時に閉じる
+        """
+        with self._available:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+            self._available.notify_all()
+        for entry in idle:
+            _safe_close(entry.conn)
+
+    def stats(self) -> Dict[str, int]:
+        """ プールの統計情報を返す
+        """
+        with self._lock:
+            return {
+                "checked_out": len(self._in_use),
+                "idle": len(self._idle),
+                "waiting": self._waiting,
+                "created": self._created,
+                "recycled": self._recycled,
+                "max_size": self.max_size,
+            }
+
+    # ------------------------------------------------------------------
+    # 内部処理
+    # ------------------------------------------------------------------
+    def _size(self) -> int:
+        # ロック取得済みで呼ぶこと
+        return len(self._idle) + len(self._in_use) + self._pending + self._checking
+
+    def _open_new(self) -> _PooledConnection:
+        # `_pending`を予約済みで呼ぶこと
+        try:
+            conn = self._connect()
+        except Exception:
+            with self._available:
+                self._pending -= 1
+                self._available.notify()
+            raise
+        with self._lock:
+            self._pending -= 1
+            self._created += 1
+        return _PooledConnection(conn)
+
+    def _expired(self, entry: _PooledConnection, now: float) -> bool:
+        return now - entry.created_at > self.max_lifetime
+
+    def _is_usable(self, entry: _PooledConnection) -> bool:
+        now = time.monotonic()
+        if self._expired(entry, now):
+            return False
+        if now - entry.last_used > self.idle_timeout:
+            return False
+        if now - entry.last_used > self.ping_after:
+            return self._ping(entry.conn)
+        return True
+
+    def _ping(self, conn: Any) -> bool:
+        try:
+            cur = conn.cursor()
+            try:
+                cur.execute(self.ping_query)
+                cur.fetchall()
+            finally:
+                cur.close()
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def _discard(self, entry: _PooledConnection, checking: bool = False) -> None:
+        # `checking`: 生存確認中（`_checking`に数えている）のものを捨てるとき
+        _safe_close(entry.conn)
+        with self._available:
+            if checking:
+                self._checking -= 1
+            self._recycled += 1
+            self._available.notify()
+
+class _Checkout:
+    """ `ConnectionPool.connection()`の戻り値
+        `with`を抜けるとプールに返却する
+        例外で抜けたときは、コネクションが壊れている可能性もあるので
+        巻き戻しに失敗したら捨てる（`release()`の挙動）
+    """
+    __slots__ = ("_pool", "_conn", "_timeout")
+
+    def __init__(self, pool: ConnectionPool, timeout: Optional[float] = None):
+        self._pool = pool
+        self._conn = None
+        self._timeout = timeout
+
+    def __enter__(self) -> Any:
+        self._conn = self._pool.acquire(self._timeout)
+        return self._conn
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            self._pool.release(conn)
+        return False
+
+def _safe_close(conn: Any) -> None:
+    try:
+        conn.close()
+    except Exception:
+        pass
@@ -1,7 +1,10 @@
+import sqlite3
 from typing import Tuple, List, Dict, Any, Optional, Sequence
 
 from .sqlite_connection import (
-    get_connection
+    get_connection, 
+    get_write_connection, 
+    bump_data_version
 )
 
 SELECT_ALL_QUESTIONS_QUERY = """
@@ -144,6 +147,109 @@ UPDATE_QUESTION_QUERY = """
     ;
 """
 
+# 全問題の正解クエリを取得するクエリ（正解の要約の計算用）
+SELECT_ALL_ANSWER_QUERIES_QUERY = """
+    SELECT
+        q.ChapterNumber
+        , q.SectionNumber
+        , q.QuestionNumber
+        , q.AnswerQuery
+    FROM
+        Questions AS q
+    ORDER BY
+        q.ChapterNumber ASC
+        , q.SectionNumber ASC
+        , q.QuestionNumber ASC
+    ;
+"""
+
+# 正解クエリの結果の要約（`schema.sql`と同じ定義。前からある`practice.db`には書くときに作る）
+CREATE_ANSWER_DIGESTS_TABLE = """
+    CREATE TABLE IF NOT EXISTS AnswerDigests (
+        ChapterNumber INTEGER NOT NULL
+        , SectionNumber INTEGER NOT NULL
+        , QuestionNumber INTEGER NOT NULL
+        , AnswerQueryHash TEXT NOT NULL
+        , DatasetVersion TEXT NOT NULL
+        , Columns TEXT NOT NULL
+        , RowCount INTEGER NOT NULL
+        , OrderedDigest TEXT NOT NULL
+        , MultisetDigest TEXT NOT NULL
+        , ExpectedRows TEXT DEFAULT NULL
+        , ComputedAt REAL NOT NULL
+        , PRIMARY KEY (ChapterNumber, SectionNumber, QuestionNumber)
+        , FOREIGN KEY (ChapterNumber, SectionNumber, QuestionNumber)
+            REFERENCES Questions(ChapterNumber, SectionNumber, QuestionNumber)
+            ON DELETE CASCADE
+    );
+"""
+
+SELECT_ANSWER_DIGEST_QUERY = """
+    SELECT
+        d.AnswerQueryHash
+        , d.DatasetVersion
+        , d.Columns
+        , d.RowCount
+        , d.OrderedDigest
+        , d.MultisetDigest
+        , d.ExpectedRows
+        , d.ComputedAt
+    FROM
+        AnswerDigests AS d
+    WHERE
+        d.ChapterNumber = ?
+        AND d.SectionNumber = ?
+        AND d.QuestionNumber = ?
+    ;
+"""
+
+SELECT_ANSWER_DIGEST_VERSIONS_QUERY = """
+    SELECT
+        d.ChapterNumber
+        , d.SectionNumber
+        , d.QuestionNumber
+        , d.AnswerQueryHash
+        , d.DatasetVersion
+    FROM
+        AnswerDigests AS d
+    ;
+"""
+
+# 計算している間に消された問題の分は書かない
+DELETE_ANSWER_DIGESTS_QUERY = """
+    DELETE FROM AnswerDigests;
+"""
+
+UPSERT_ANSWER_DIGEST_QUERY = """
+    INSERT OR REPLACE INTO AnswerDigests (
+        ChapterNumber
+        , SectionNumber
+        , QuestionNumber
+        , AnswerQueryHash
+        , DatasetVersion
+        , Columns
+        , RowCount
+        , OrderedDigest
+        , MultisetDigest
+        , ExpectedRows
+        , ComputedAt
+    )
+    SELECT
+        ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?
+    WHERE
+        EXISTS (
+            SELECT
+                1
+            FROM
+                Questions AS q
+            WHERE
+                q.ChapterNumber = ?
+                AND q.SectionNumber = ?
+                AND q.QuestionNumber = ?
+        )
+    ;
+"""
+
 def fetch_all(sql_query: str, params: Optional[Sequence[Any]]=None) -> Tuple[List[str], List[Dict[str, Any]]]:
     """ 複数のレコードセットを取得する
     """
@@ -176,7 +282,8 @@ def get_question_data(chapter_number: int, section_number: int, question_number)
     return fetch_one(SELECT_QUESTION_DATA_QUERY, (chapter_number, section_number, question_number))
 
 def update_question(chapter_number:int, section_number: int, question_number: int, question_text: str, answer_query: str, check_mode: str = "strict"):
-    with get_connection() as conn:
+    # 書き込みは専用のコネクションで行う（抜けるとコミットされる）
+    with get_write_connection() as conn:
         cur = conn.cursor()
         cur.execute(
             UPDATE_QUESTION_QUERY, 
@@ -184,7 +291,8 @@ def update_question(chapter_number:int, section_number: int, question_number: in
         )
         if cur.rowcount == 0:
             raise ValueError("指定の問題が存在しません。")
-        conn.commit()
+        # 問題カタログなどのキャッシュを無効化するため、バージョンを上げる
+        bump_data_version(conn)
 
 def get_all_ordered_question_keys():
     """ 全問題の章・節・問題番号のセットを取得
@@ -201,19 +309,61 @@ def get_all_ordered_question_keys():
 def get_next_question_key(current_key):
     """ 現在の問題の章・節・問題番号のタプルを受け取って、
         次の問題の章・節・問題番号のタプルを返す
+        （問題カタログから引く。DBには問い合わせない）
     """
-    all_keys = get_all_ordered_question_keys()
-    try: 
-        idx = all_keys.index(current_key)
-    except ValueError:
-        # 現在の問題が章・節・問題番号リストに存在しない
-        #   -> Noneを返す
+    from .question_catalog import get_catalog
+    return get_catalog().next_key(current_key)
+
+def get_all_answer_queries() -> List[Tuple[Tuple[int, int, int], str]]:
+    """ 全問題の(章・節・問題番号, 正解クエリ)のリストを取得
+    """
+    with get_connection() as conn:
+        rows = conn.execute(SELECT_ALL_ANSWER_QUERIES_QUERY).fetchall()
+    return [((int(r[0]), int(r[1]), int(r[2])), r[3]) for r in rows]
+
+def get_answer_digest(chapter_number: int, section_number: int, question_number: int) -> Optional[Dict[str, Any]]:
+    """ 正解クエリの結果の要約を取得（なければNone）
+        まだ一度も計算していない（テーブルがない）ときもNone
+    """
+    try:
+        return fetch_one(SELECT_ANSWER_DIGEST_QUERY, (chapter_number, section_number, question_number))
+    except sqlite3.OperationalError:
         return None
 
-    # ここに来た -> 次の問題がある
-    if idx + 1 < len(all_keys):
-        return all_keys[idx + 1]
-    
-    # 現在の問題が最後の問題のときはここに来る
-    #   -> Noneを返す
-    return None
\ No newline at end of file
+def get_answer_digest_versions() -> Dict[Tuple[int, int, int], Tuple[str, str]]:
+    """ 保存済みの要約の、章・節・問題番号 -> (正解クエリのハッシュ, データセットのバージョン)
+    """
+    try:
+        _, rows = fetch_all(SELECT_ANSWER_DIGEST_VERSIONS_QUERY)
+    except sqlite3.OperationalError:
+        return {}
+    return {
+        (r["ChapterNumber"], r["SectionNumber"], r["QuestionNumber"]): (r["AnswerQueryHash"], r["DatasetVersion"])
+        for r in rows
+    }
+
+def save_answer_digests(digests: Sequence[Dict[str, Any]]) -> None:
+    """ 正解クエリの結果の要約をまとめて書く（1回のトランザクション）
+        問題データのバージョンは上げない（問題カタログ・ページの中身は変わらないので）
+    """
+    if not digests:
+        return
+    params = [
+        (
+            *d["key"], d["AnswerQueryHash"], d["DatasetVersion"], d["Columns"], d["RowCount"],
+            d["OrderedDigest"], d["MultisetDigest"], d["ExpectedRows"], d["ComputedAt"],
+            *d["key"],
+        )
+        for d in digests
+    ]
+    with get_write_connection() as conn:
+        conn.execute(CREATE_ANSWER_DIGESTS_TABLE)
+        conn.executemany(UPSERT_ANSWER_DIGEST_QUERY, params)
+
+def delete_answer_digests() -> int:
+    """ 正解クエリの結果の要約を全部消す（データセットを入れ替えたとき用、消した件数を返す）
+        まだ一度も計算していない（テーブルがない）ときは0
+    """
+    with get_write_connection() as conn:
+        conn.execute(CREATE_ANSWER_DIGESTS_TABLE)
+        return conn.execute(DELETE_ANSWER_DIGESTS_QUERY).rowcount
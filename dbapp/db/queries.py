@@ -1,8 +1,16 @@
 from dbapp.db.connection import get_connection
+from dbapp import timing
+import heapq
+import itertools
+import math
 import re
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+from functools import lru_cache
 
 from typing import (
-    Any, Dict, Iterable, List, Optional, 
+    Any, Callable, Dict, Iterable, Iterator, List, Optional, 
     Sequence, Tuple
 )
 import pyodbc
@@ -10,7 +18,10 @@ import pyodbc
 from .exceptions import (
     DatabaseExecutionError, 
     QuerySyntaxError, 
-    QueryRuntimeError
+    QueryRuntimeError, 
+    QueryCancelledError, 
+    QueryTimeoutError, 
+    PoolTimeoutError
 )
 
 TEST_QUERY = """
@@ -29,6 +40,9 @@ TEST_QUERY_2 = """
 DESC Employees;
 """
 
+# カーソルから少しずつ取り出すときの1回あたりの行数
+FETCH_CHUNK_SIZE = 1000
+
 TABLE_NAMES = [
     "BelongTo", "Categories", "CustomerClasses", "Customers", 
     "Departments", "Employees", "Prefecturals", "Products", 
@@ -43,6 +57,123 @@ FORBIDDEN_KEYWORDS = {
     "CREATE", "TRUNCATE", "GRANT", "REVOKE", "MERGE", 
     "REPLACE"
 }
+# 実行するたびに結果が変わりうる関数（これを使うクエリの結果はキャッシュしない）
+NONDETERMINISTIC_FUNCTIONS = {
+    "NOW", "CURDATE", "CURTIME", "CURRENT_DATE", "CURRENT_TIME", "CURRENT_TIMESTAMP",
+    "LOCALTIME", "LOCALTIMESTAMP", "SYSDATE", "UTC_DATE", "UTC_TIME", "UTC_TIMESTAMP",
+    "UNIX_TIMESTAMP", "RAND", "RANDOM_BYTES", "UUID", "UUID_SHORT", "SLEEP",
+    "CONNECTION_ID", "LAST_INSERT_ID", "FOUND_ROWS", "ROW_COUNT",
+    "USER", "CURRENT_USER", "SESSION_USER", "SYSTEM_USER"
+}
+# 検査結果を覚えておくクエリの数
+SQL_VALIDATION_CACHE_SIZE = 1024
+
+class Deadline:
+    """ クエリの実行期限
+        ルートで作って`exec_query()`/`compare_queries()`からカーソルまで引き回す
+    """
+    __slots__ = ("seconds", "expires_at")
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        """ 残り秒数（過ぎていたら0）
+        """
+        return max(self.expires_at - time.monotonic(), 0.0)
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+class QueryCanceller:
+    """ 実行中のクエリを別スレッドから中断するためのもの
+        `fetch_all(..., canceller=...)`に渡しておき、`cancel()`を呼ぶと
+        実行中のカーソルに`cancel()`を送る（実行前なら実行させない）
+        期限切れで中断したとき（`expire()`）は`timed_out`も立つ
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cursor = None
+        self.cancelled = False
+        self.timed_out = False
+
+    def bind(self, cursor) -> None:
+        with self._lock:
+            if self.cancelled:
+                raise QueryCancelledError("クエリは中断されました。")
+            self._cursor = cursor
+
+    def unbind(self) -> None:
+        with self._lock:
+            self._cursor = None
+
+    def cancel(self) -> None:
+        # 返却後のコネクションで別のクエリを止めないよう、ロックを持ったまま送る
+        with self._lock:
+            self.cancelled = True
+            if self._cursor is not None:
+                try:
+                    self._cursor.cancel()
+                except pyodbc.Error:
+                    pass
+
+    def expire(self) -> None:
+        """ 期限切れとして中断する
+        """
+        self.timed_out = True
+        self.cancel()
+
+class _Watchdog:
+    """ 期限の来たクエリを中断するスレッド（プロセスで1本）
+        クエリごとにタイマースレッドを作らず、期限の早い順にヒープで待つ
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        # [期限, 通し番号, canceller]（終わったものはcancellerをNoneにして後で捨てる）
+        self._heap: List[list] = []
+        self._seq = itertools.count()
+        self._thread: Optional[threading.Thread] = None
+
+    def watch(self, expires_at: float, canceller: QueryCanceller) -> list:
+        entry = [expires_at, next(self._seq), canceller]
+        with self._cond:
+            heapq.heappush(self._heap, entry)
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="query-watchdog", daemon=True)
+                self._thread.start()
+            # 先頭が入れ替わったときだけ起こせばよい
+            if self._heap[0] is entry:
+                self._cond.notify()
+        return entry
+
+    def unwatch(self, entry: list) -> None:
+        with self._cond:
+            entry[2] = None
+            # 先頭なら起こして、終わったものを片づけさせる
+            if self._heap and self._heap[0] is entry:
+                self._cond.notify()
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._heap:
+                    self._cond.wait()
+                expires_at, _, canceller = self._heap[0]
+                if canceller is None:
+                    heapq.heappop(self._heap)
+                    continue
+                delay = expires_at - time.monotonic()
+                if delay > 0:
+                    self._cond.wait(delay)
+                    continue
+                heapq.heappop(self._heap)
+            canceller.expire()
+
+_watchdog = _Watchdog()
 
 def fetch_one(query: str, params: Optional[Sequence[Any]]=None) -> Optional[Dict[str, Any]]:
     if params is None:
@@ -70,31 +201,203 @@ def fetch_one(query: str, params: Optional[Sequence[Any]]=None) -> Optional[Dict
         raise QueryRuntimeError(str(e)) from e
         
 
-def fetch_all(query: str, params: Optional[Sequence[Any]]=None) -> Tuple[List[str], List[pyodbc.Row]]:
+def fetch_all(
+    query: str, 
+    params: Optional[Sequence[Any]]=None, 
+    canceller: Optional[QueryCanceller]=None, 
+    deadline: Optional[Deadline]=None, 
+    on_rows: Optional[Callable[[int], None]]=None
+) -> Tuple[List[str], List[pyodbc.Row]]:
     """ クエリを渡して全件取得する
         カラム名（str）のリスト, Rowオブジェクトのリストを返す
+        `canceller`を渡すと、別スレッドから実行を中断できる
+        `deadline`を渡すと、期限を過ぎた時点で打ち切って`QueryTimeoutError`をスローする
+        `on_rows`を渡すと、`FETCH_CHUNK_SIZE`行読むたびに読んだ行数を渡して呼ぶ（進捗表示用）
+    """
+    with _open_cursor(query, params, canceller, deadline) as cur, timing.phase("fetch"):
+        # カラム名のリストを取得
+        columns = [col[0] for col in cur.description]
+        # レコードセットを取得（`pyodbc.Row`オブジェクトのリスト）
+        if on_rows is None:
+            rows = cur.fetchall()
+        else:
+            rows = []
+            for chunk in iter_chunks(cur):
+                rows.extend(chunk)
+                on_rows(len(chunk))
+    timing.add_rows(len(rows))
+    # カラム名のリストと`Row`オブジェクトのリストを返却
+    return columns, rows
+
+# ドライバ・サーバーがタイムアウトを知らせるときのSQLSTATEとメッセージ
+_TIMEOUT_SQLSTATES = ("HYT00", "HYT01")
+_TIMEOUT_MESSAGE = "maximum statement execution time exceeded"
+
+def _timeout_error(deadline: Optional[Deadline]) -> QueryTimeoutError:
+    if deadline is None:
+        return QueryTimeoutError("クエリの実行時間が上限を超えたため、打ち切りました。")
+    return QueryTimeoutError(f"クエリの実行時間が{deadline.seconds:g}秒を超えたため、打ち切りました。")
+
+def _convert_error(e: pyodbc.Error, canceller: Optional[QueryCanceller], deadline: Optional[Deadline]) -> DatabaseExecutionError:
+    """ `pyodbc`の例外をアプリの例外に変換する
+        中断されたときは、構文エラー等ではなく中断・タイムアウトとして扱う
+    """
+    if (canceller is not None and canceller.timed_out) \
+            or (e.args and e.args[0] in _TIMEOUT_SQLSTATES) \
+            or _TIMEOUT_MESSAGE in str(e):
+        return _timeout_error(deadline)
+    if canceller is not None and canceller.cancelled:
+        return QueryCancelledError(str(e))
+    if isinstance(e, pyodbc.ProgrammingError):
+        # SQLの構文エラー
+        return QuerySyntaxError(str(e))
+    return QueryRuntimeError(str(e))
+
+def _set_driver_timeout(conn, deadline: Optional[Deadline]) -> None:
+    """ ドライバのクエリタイムアウト（秒、0で無制限）を設定する
+        `pyodbc.Connection`以外（サンドボックス）は中断だけで期限を守る
+    """
+    if not hasattr(conn, "timeout"):
+        return
+    conn.timeout = 0 if deadline is None else max(int(math.ceil(deadline.remaining())), 1)
+
+@contextmanager
+def _open_cursor(
+    query: str, 
+    params: Optional[Sequence[Any]]=None, 
+    canceller: Optional[QueryCanceller]=None, 
+    deadline: Optional[Deadline]=None
+) -> Iterator[Any]:
+    """ クエリを実行したカーソルを返す（`with`を抜けるまでコネクションを借りたまま）
+        DB由来の例外はアプリの例外に変換する
+        `deadline`があるときは、次の3段構えで期限を守る
+            - コネクションの空き待ちは期限まで
+            - ドライバのクエリタイムアウト（`conn.timeout`）
+            - 期限が来たら見張りスレッドがカーソルに`cancel()`を送る
     """
     if params is None:
         params = ()
-    
+    if deadline is not None and canceller is None:
+        canceller = QueryCanceller()
+
     try:
-        with get_connection() as conn:
+        if deadline is not None and deadline.expired():
+            raise _timeout_error(deadline)
+        checkout_timeout = deadline.remaining() if deadline is not None else None
+        with ExitStack() as stack:
+            # 貸出待ち（接続の作り直しを含む）だけを`connect`として測る
+            with timing.phase("connect"):
+                conn = stack.enter_context(get_connection(timeout=checkout_timeout))
             with conn.cursor() as cur:
-                cur.execute(query, params)
-                # カラム名のリストを取得
-                columns = [col[0] for col in cur.description]
-                # レコードセットを取得（`pyodbc.Row`オブジェクトのリスト）
-                rows = cur.fetchall()
-                # カラム名のリストと`Row`オブジェクトのリストを返却
-                return columns, rows
-    
+                if canceller is not None:
+                    canceller.bind(cur)
+                watch = None
+                if deadline is not None:
+                    _set_driver_timeout(conn, deadline)
+                    watch = _watchdog.watch(deadline.expires_at, canceller)
+                try:
+                    with timing.phase("execute"):
+                        cur.execute(query, params)
+                    yield cur
+                finally:
+                    if watch is not None:
+                        _watchdog.unwatch(watch)
+                        _set_driver_timeout(conn, None)
+                    if canceller is not None:
+                        canceller.unbind()
+
+    # 空き待ちが期限で打ち切られた
+    except PoolTimeoutError as e:
+        if deadline is not None and deadline.expired():
+            raise _timeout_error(deadline) from e
+        raise
+    # 中断（サンドボックスは中断をアプリの例外で知らせてくる）
+    except QueryCancelledError as e:
+        if canceller is not None and canceller.timed_out:
+            raise _timeout_error(deadline) from e
+        raise
     # DB由来の例外をキャッチ
-    except pyodbc.ProgrammingError as e:
-        # SQLの構文エラーはここでキャッチ -> スロー
-        raise QuerySyntaxError(str(e)) from e
     except pyodbc.Error as e:
-        raise QueryRuntimeError(str(e)) from e
+        raise _convert_error(e, canceller, deadline) from e
+
+@contextmanager
+def stream_rows(
+    query: str, 
+    params: Optional[Sequence[Any]]=None, 
+    chunk_size: int=FETCH_CHUNK_SIZE, 
+    canceller: Optional[QueryCanceller]=None, 
+    deadline: Optional[Deadline]=None
+) -> Iterator[Tuple[List[str], Iterator[List[pyodbc.Row]]]]:
+    """ クエリを実行し、結果セットを`fetchmany()`で少しずつ取り出す
+        `with stream_rows(query) as (columns, chunks):`の形で使い、
+        `chunks`は`chunk_size`行ずつのリストを順に返す
+        `with`を抜けるまでコネクションを借りたままになる（期限も`with`を抜けるまで有効）
+    """
+    with _open_cursor(query, params, canceller, deadline) as cur:
+        columns = [col[0] for col in cur.description]
+        yield columns, iter_chunks(cur, chunk_size)
+
+def fetch_page(
+    query: str, 
+    params: Optional[Sequence[Any]]=None, 
+    page: int=1, 
+    page_size: int=100, 
+    max_rows: Optional[int]=None, 
+    canceller: Optional[QueryCanceller]=None, 
+    deadline: Optional[Deadline]=None, 
+    on_rows: Optional[Callable[[int], None]]=None
+) -> Tuple[List[str], List[pyodbc.Row], bool]:
+    """ 結果セットのうち`page`ページ目（1始まり）の`page_size`行だけを取得する
+        先頭から`max_rows`行より先は読まない
+        カラム名のリスト, Rowオブジェクトのリスト, 続きの行があるかどうか を返す
+        （続きの有無は1行だけ余分に読んで判定する）
+        `on_rows`には読んだ行数（読み飛ばした行も含む）を渡す
+    """
+    offset = (page - 1) * page_size
+    limit = page_size
+    if max_rows is not None:
+        limit = max(min(page_size, max_rows - offset), 0)
+
+    with _open_cursor(query, params, canceller, deadline) as cur, timing.phase("fetch"):
+        columns = [col[0] for col in cur.description]
+        # 前のページの行は読み飛ばす
+        _skip_rows(cur, offset, on_rows)
+        rows = cur.fetchmany(limit + 1)
+        if on_rows is not None:
+            on_rows(len(rows))
+    timing.add_rows(min(len(rows), limit))
 
+    has_more = len(rows) > limit
+    return columns, rows[:limit], has_more
+
+def _skip_rows(cursor, count: int, on_rows: Optional[Callable[[int], None]]=None) -> None:
+    """ カーソルを`count`行進める（Rowオブジェクトは作らない）
+    """
+    if count <= 0:
+        return
+    skip = getattr(cursor, "skip", None)
+    if skip is not None:
+        skip(count)
+        if on_rows is not None:
+            on_rows(count)
+        return
+    # `skip()`のないドライバは読み捨てる
+    while count > 0:
+        chunk = cursor.fetchmany(min(count, FETCH_CHUNK_SIZE))
+        if not chunk:
+            return
+        count -= len(chunk)
+        if on_rows is not None:
+            on_rows(len(chunk))
+
+def iter_chunks(cursor, chunk_size: int=FETCH_CHUNK_SIZE) -> Iterator[List[pyodbc.Row]]:
+    """ カーソルから`chunk_size`行ずつ取り出して返す
+    """
+    while True:
+        chunk = cursor.fetchmany(chunk_size)
+        if not chunk:
+            return
+        yield chunk
 
 def describe_table(table_name: str) -> Tuple[List[str], List[pyodbc.Row]]:
     """ `DESC`コマンドを使ってテーブル構造を取得
@@ -138,11 +441,146 @@ def is_multi_statement(sql_query: str) -> bool:
     statements = [stmt for stmt in sqlparse.split(sql_query) if stmt.strip()]
     return len(statements) > 1
 
+# 1回の走査でクエリを字句に分ける
+#   コメント（削除する）、文字列・引用符つき識別子・`# `コメント（そのまま残す）、
+#   変数、数値、単語、`;`、括弧、空白、その他1文字 の順に試す
+_SQL_TOKEN_PATTERN = re.compile(r"""
+      (?P<block>/\*.*?\*/)
+    | (?P<line>--[^\n]*)
+    | (?P<hash>\#\ [^\n]*)
+    | (?P<quoted>'(?:[^'\\]|\\.|'')*'|"(?:[^"\\]|\\.|"")*"|`[^`]*`)
+    | (?P<variable>(?:[@$:]|\#\#?)\w+)
+    | (?P<number>\d+(?:\.\d+)?[eE]-?\d+|(?:\d+\.\d*|\.\d+|\d+)(?![_A-Za-z]))
+    | (?P<word>\w[$\#\w]*)
+    | (?P<semicolon>;)
+    | (?P<open>\()
+    | (?P<close>\))
+    | (?P<space>\s+)
+    | (?P<other>.)
+""", re.DOTALL | re.VERBOSE)
+# 直後に`.`が続く単語は修飾名（`t .col`のように間に空白があってもよい）
+_QUALIFIER_PATTERN = re.compile(r"\s*\.(?!\d)")
+# ブロックを閉じない`END`（`END IF`などはsqlparseでは1つのキーワード）
+_END_SUFFIX_PATTERN = re.compile(r"\s+(?:IF|LOOP|WHILE|FOR|CASE)\b", re.IGNORECASE)
+
+@lru_cache(maxsize=SQL_VALIDATION_CACHE_SIZE)
+def _scan_sql(sql_query: str) -> Tuple[str, bool, int]:
+    """ クエリを1回だけ走査して、
+        (コメントを除いたクエリ, 禁止キーワードを含むか, 文の数) を返す
+        `sanitize_sql()` -> `contains_forbidden_keywords()` -> `is_multi_statement()`
+        と同じ判定を、sqlparseを使わずに行う
+        - 禁止キーワードとみなさないもの: 文字列・引用符の中、`t.update`のような修飾名、
+          `REPLACE(...)`のように直後に`(`が続く関数呼び出し
+        - 文の区切り: 入れ子の外の`;`
+          （sqlparseと同じく、`(`で1段深く、`)`と`END`で1段浅くなるとみなす）
+        - コメントは文字列の外にあるものだけを削除する
+    """
+    kept = []
+    forbidden = False
+    statements = 0
+    level = 0
+    # 最後の区切りより後に実質的な字句があるか
+    pending = False
+    for m in _SQL_TOKEN_PATTERN.finditer(sql_query):
+        kind = m.lastgroup
+        if kind == "block" or kind == "line":
+            continue
+        text = m.group()
+        kept.append(text)
+        if kind == "space" or kind == "hash":
+            continue
+        if kind == "semicolon" and level <= 0:
+            statements += 1
+            pending = False
+            level = 0
+            continue
+        pending = True
+        if kind == "open":
+            level += 1
+        elif kind == "close":
+            level -= 1
+        elif kind == "word":
+            start, end = m.span()
+            # 関数呼び出し・修飾名は名前として扱う
+            if (sql_query[start - 1:start] == "." or sql_query[end:end + 1] == "(" 
+                    or _QUALIFIER_PATTERN.match(sql_query, end)):
+                continue
+            upper = text.upper()
+            if upper in FORBIDDEN_KEYWORDS:
+                forbidden = True
+            elif upper == "END" and not _END_SUFFIX_PATTERN.match(sql_query, end):
+                level -= 1
+            elif text == "GO":
+                # バッチ区切り（sqlparseに合わせて大文字のときだけ）
+                statements += 1
+                pending = False
+                level = 0
+    if pending:
+        statements += 1
+    return "".join(kept).strip(), forbidden, statements
+
+# 指紋で1つの`?`にまとめる値の並び（`IN (1, 2, 3)`など）
+_FINGERPRINT_LIST_PATTERN = re.compile(r"\?(?: , \?)+")
+_OPERATOR_HEADS = ("<", ">", "!", "|", "&", ":")
+_OPERATOR_TAILS = ("=", ">", "|", "&")
+
+@lru_cache(maxsize=SQL_VALIDATION_CACHE_SIZE)
+def fingerprint_sql(sql_query: str) -> str:
+    """ クエリの指紋（値だけが違うクエリを同じものとしてまとめるための正規形）を返す
+        `normalize_sql()`の形から、さらに文字列・数値を`?`に、値の並びを1つの`?`に置き換えて
+        全体を大文字にする
+    """
+    return _FINGERPRINT_LIST_PATTERN.sub("?", _canonical_sql(sql_query, keep_values=False).upper())
+
+@lru_cache(maxsize=SQL_VALIDATION_CACHE_SIZE)
+def is_deterministic_sql(sql_query: str) -> bool:
+    """ 同じデータセットなら、いつ実行しても同じ結果になるか（結果キャッシュに置いてよいか）
+        `NONDETERMINISTIC_FUNCTIONS`の名前が（文字列・コメントの外に）1つでもあればFalse
+    """
+    return not any(
+        m.lastgroup == "word" and m.group().upper() in NONDETERMINISTIC_FUNCTIONS
+        for m in _SQL_TOKEN_PATTERN.finditer(sql_query)
+    )
+
+@lru_cache(maxsize=SQL_VALIDATION_CACHE_SIZE)
+def normalize_sql(sql_query: str) -> str:
+    """ 同じ結果になるクエリを同じ文字列にそろえる（結果キャッシュのキー用）
+        コメントを除き、字句の間の空白を1つにそろえる（末尾の`;`も除く）
+        大文字・小文字はそのまま（キーワードと同じ綴りの別名`AS Count`も列名になるので）
+    """
+    return _canonical_sql(sql_query, keep_values=True)
+
+def _canonical_sql(sql_query: str, keep_values: bool) -> str:
+    # 字句の分け方は`_scan_sql()`と同じ
+    parts = []
+    last_end = -1
+    for m in _SQL_TOKEN_PATTERN.finditer(sql_query):
+        kind = m.lastgroup
+        if kind in ("block", "line", "hash", "space"):
+            continue
+        text = m.group()
+        adjacent = m.start() == last_end
+        last_end = m.end()
+        # バッククォートは識別子なので値とはみなさない
+        if kind == "number" or (kind == "quoted" and text[0] != "`"):
+            if not keep_values:
+                text = "?"
+        # 修飾名（`t.col`）と、続けて書かれた2文字の演算子（`>=`, `<>`など）は詰めて書く
+        if parts and (text == "." or parts[-1].endswith(".")
+                      or (adjacent and parts[-1] in _OPERATOR_HEADS and text in _OPERATOR_TAILS)):
+            parts[-1] += text
+        else:
+            parts.append(text)
+    while parts and parts[-1] == ";":
+        parts.pop()
+    return " ".join(parts)
+
 def _validate_sql_core(sql_query: str, allowed_start=("SELECT", )) -> Tuple[bool, str, str]:
     """ 検査結果とエラーメッセージ、サニタイズ済みクエリを返す
         合格時はTrueとNone、サニタイズ済みクエリを返す
+        字句の走査は`_scan_sql()`で1回だけ行う（同じクエリの結果はキャッシュされる）
     """
-    clean_sql = sanitize_sql(sql_query)
+    clean_sql, forbidden, statements = _scan_sql(sql_query)
 
     if not clean_sql:
         return False, "有効なクエリがありません。", clean_sql
@@ -151,10 +589,10 @@ def _validate_sql_core(sql_query: str, allowed_start=("SELECT", )) -> Tuple[bool
     if not any(upper.startswith(kw) for kw in allowed_start):
         return False, f"{', '.join(allowed_start)}文のみ実行可能です。", clean_sql
     
-    if contains_forbidden_keywords(clean_sql):
+    if forbidden:
         return False, "書き込み系・DDL文は使用禁止です。", clean_sql
     
-    if is_multi_statement(sql_query=clean_sql):
+    if statements > 1:
         return False, "マルチステートメントは使用禁止です。", clean_sql 
 
     return True, None, clean_sql
@@ -172,7 +610,8 @@ def sanitize_and_validate_sql(sql_query: str, allowed_start=("SELECT", )) -> str
     """ サニタイズとバリデーションをまとめて行う
         不正があれば例外をスロー
     """
-    ok, message, clean_sql = _validate_sql_core(sql_query=sql_query, allowed_start=allowed_start)
+    with timing.phase("validate"):
+        ok, message, clean_sql = _validate_sql_core(sql_query=sql_query, allowed_start=allowed_start)
     
     if not ok:
         raise ValueError(message)
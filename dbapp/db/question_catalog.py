@@ -0,0 +1,119 @@
+# 問題カタログ（全問題のメタデータをメモリに保持する）
+import threading
+from itertools import groupby
+from operator import itemgetter
+
+from typing import List, Dict, Any, Optional, Tuple
+
+from .practice_queries import (
+    PRACTICES_LIST_QUERY,
+    fetch_all
+)
+from .sqlite_connection import get_data_version
+
+# 章・節・問題番号のタプル
+QuestionKey = Tuple[int, int, int]
+
+class QuestionCatalog:
+    """ 全問題のデータを1回だけ読み込んで保持する
+        - `keys`: 章 > 節 > 問題の順に並べた問題キーのリスト
+        - `chapters`: 章 -> 節 -> 問題 のネスト構造（練習問題一覧用）
+        問題キーから位置を引く辞書を持っているので、前後の問題はO(1)で引ける
+    """
+
+    def __init__(self, version: int, rows: List[Dict[str, Any]]):
+        self.version = version
+        self.keys: List[QuestionKey] = []
+        self._positions: Dict[QuestionKey, int] = {}
+        self._questions: Dict[QuestionKey, Dict[str, Any]] = {}
+
+        for row in rows:
+            key = (
+                int(row["ChapterNumber"]),
+                int(row["SectionNumber"]),
+                int(row["QuestionNumber"])
+            )
+            self._positions[key] = len(self.keys)
+            self.keys.append(key)
+            self._questions[key] = row
+
+        self.chapters = _build_tree(rows)
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def get(self, key: QuestionKey) -> Optional[Dict[str, Any]]:
+        """ 問題のメタデータを返す（なければNone）
+        """
+        return self._questions.get(key)
+
+    def next_key(self, key: QuestionKey) -> Optional[QuestionKey]:
+        """ 次の問題のキーを返す
+            現在の問題が存在しない、または最後の問題ならNone
+        """
+        idx = self._positions.get(key)
+        if idx is None or idx + 1 >= len(self.keys):
+            return None
+        return self.keys[idx + 1]
+
+    def previous_key(self, key: QuestionKey) -> Optional[QuestionKey]:
+        """ 前の問題のキーを返す
+            現在の問題が存在しない、または最初の問題ならNone
+        """
+        idx = self._positions.get(key)
+        if idx is None or idx == 0:
+            return None
+        return self.keys[idx - 1]
+
+def _build_tree(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """ 章 -> 節 -> 問題 のネスト構造を構築
+        `rows`は章・節・問題番号の順に並んでいること
+    """
+    chapters = []
+    # 章番号グループをループ
+    for chapter_number, chapter_group in groupby(rows, key=itemgetter("ChapterNumber")):
+        chapter_rows = list(chapter_group)
+        # タイトルは、同じ章の中で共通なので、先頭レコードの値を採る
+        chapter_title = chapter_rows[0]["ChapterTitle"]
+        sections = []
+        # 章内の節グループをループ
+        for section_number, section_group in groupby(chapter_rows, key=itemgetter("SectionNumber")):
+            section_rows = list(section_group)
+            section_title = section_rows[0]["SectionTitle"]
+            sections.append({
+                "section_number": section_number,
+                "section_title": section_title,
+                "questions": section_rows
+            })
+        chapters.append({
+            "chapter_number": chapter_number,
+            "chapter_title": chapter_title,
+            "sections": sections
+        })
+    return chapters
+
+_catalog: Optional[QuestionCatalog] = None
+_lock = threading.Lock()
+
+def get_catalog() -> QuestionCatalog:
+    """ プロセス共通の問題カタログを返す
+        データバージョンが変わっていたら作り直す
+    """
+    global _catalog
+    version = get_data_version()
+    catalog = _catalog
+    if catalog is not None and catalog.version == version:
+        return catalog
+
+    with _lock:
+        if _catalog is None or _catalog.version != version:
+            _, rows = fetch_all(sql_query=PRACTICES_LIST_QUERY)
+            _catalog = QuestionCatalog(version=version, rows=rows)
+        return _catalog
+
+def invalidate() -> None:
+    """ 問題カタログを破棄する（次回の`get_catalog()`で作り直す）
+    """
+    global _catalog
+    with _lock:
+        _catalog = None
@@ -0,0 +1,510 @@
+# 練習用データセットをプロセス内で実行するサンドボックス（SQLite）
+#   - `data/snapshot_sandbox.py`でMySQLの`TABLE_NAMES`をSQLiteファイルに写しておく
+#   - `DB_BACKEND=sandbox`のとき、`db.connection`がこちらのコネクションを貸し出す
+#   - MySQLの書き方（`LIMIT a, b`、`DESC テーブル`、日付関数など）はここで読み替える
+import os
+import re
+import sqlite3
+from calendar import monthrange
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+from typing import Any, List, Optional, Sequence, Tuple
+
+from .exceptions import QuerySyntaxError, QueryRuntimeError, QueryCancelledError
+
+_CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+BASE_DIR = os.path.dirname(_CURRENT_DIR)
+SANDBOX_DB_PATH = os.getenv(
+    "SANDBOX_DB_PATH", os.path.join(BASE_DIR, "data", "sandbox.db"))
+
+# `DESC テーブル`の結果（MySQLで取ったもの）を入れておくテーブル
+DESCRIBE_TABLE = "_sandbox_describe"
+# スナップショットの形式（`PRAGMA user_version`、これより古いものは作り直してもらう）
+#   2: 文字列の列を`COLLATE NOCASE`にした（MySQLの照合順序と同じく大文字・小文字を区別しない）
+SNAPSHOT_FORMAT = 2
+
+# SQLiteの構文エラー・名前解決エラーのメッセージ
+_SYNTAX_ERROR_PATTERN = re.compile(
+    r"syntax error|no such (column|table|function)|incomplete input|"
+    r"ambiguous column|wrong number of arguments|misuse of aggregate|"
+    r"unrecognized token|must appear in the GROUP BY",
+    re.IGNORECASE
+)
+
+# ----------------------------------------------------------------------
+# MySQL方言の読み替え
+# ----------------------------------------------------------------------
+# 文字列リテラル・引用符つき識別子（この中は読み替えない）
+_QUOTED_PATTERN = re.compile(r"('(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.|\"\")*\"|`[^`]*`)")
+_DESC_PATTERN = re.compile(
+    r"^\s*(?:DESC|DESCRIBE)\s+`?(\w+)`?\s*;?\s*$", re.IGNORECASE)
+_LIMIT_PATTERN = re.compile(r"\bLIMIT\s+(\d+|\?)\s*,\s*(\d+|\?)", re.IGNORECASE)
+_IF_PATTERN = re.compile(r"\bIF\s*\(", re.IGNORECASE)
+# `TIMESTAMPDIFF(UNIT, a, b)`の単位
+_TIMESTAMPDIFF_PATTERN = re.compile(
+    r"\bTIMESTAMPDIFF\s*\(\s*(YEAR|MONTH|DAY|HOUR|MINUTE|SECOND)\s*,", re.IGNORECASE)
+
+# 字句（コメント・引用符で囲まれた部分・語・数値・空白・記号）
+_TOKEN_PATTERN = re.compile(
+    r"(?P<comment>/\*.*?\*/|--(?:[ \t][^\n]*)?(?=\n|$)|#[^\n]*)"
+    r"|(?P<quoted>'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.|\"\")*\"|`[^`]*`)"
+    r"|(?P<word>[A-Za-z_][A-Za-z0-9_$]*)"
+    r"|(?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)"
+    r"|(?P<space>\s+)"
+    r"|(?P<op>\|\||<=|>=|<>|!=|.)",
+    re.DOTALL
+)
+# `INTERVAL n UNIT`の単位（`_add_interval()`が扱えるもの）
+_INTERVAL_UNITS = {"YEAR", "QUARTER", "MONTH", "WEEK", "DAY", "HOUR", "MINUTE", "SECOND"}
+# `INTERVAL n UNIT`を引数に取る関数
+_INTERVAL_FUNCTIONS = {"DATE_ADD": "DATE_ADD", "ADDDATE": "DATE_ADD", "DATE_SUB": "DATE_SUB", "SUBDATE": "DATE_SUB"}
+# 読み替えた結果を覚えておくクエリの数（正解クエリは何度も流れる）
+TRANSLATE_CACHE_SIZE = 256
+
+def _untranslatable(message: str) -> QuerySyntaxError:
+    return QuerySyntaxError(f"サンドボックスでは実行できない書き方です: {message}")
+
+@lru_cache(maxsize=TRANSLATE_CACHE_SIZE)
+def translate(sql: str) -> str:
+    """ MySQLの書き方をSQLiteで実行できる形に読み替える
+        文字列リテラルの中は書き換えない
+        - コメントは取り除く
+        - `LIMIT a, b` -> `LIMIT b OFFSET a`
+        - `` `名前` `` -> `"名前"`
+        - `IF(...)` -> `IIF(...)`
+        - `DATE_ADD(d, INTERVAL n UNIT)` -> `DATE_ADD(d, n, 'UNIT')`（`DATE_SUB()`なども同じ）
+        - `d + INTERVAL n UNIT` -> `DATE_ADD(d, n, 'UNIT')`（`-`なら`DATE_SUB()`）
+        - `a / b` -> `a * 1.0 / b`（MySQLの`/`は整数どうしでも小数で割る）、`a DIV b` -> `a / b`
+        同じ結果にならない書き方（読み替えられない`INTERVAL`、`||`）は`QuerySyntaxError`
+        （文字列の大文字・小文字を区別しない比較は、スナップショットの列の`COLLATE NOCASE`で合わせる）
+    """
+    tokens = _tokenize(sql)
+    while True:
+        k = next((i for i, (kind, text) in enumerate(tokens) if kind == "word" and text.upper() == "INTERVAL"), None)
+        if k is None:
+            break
+        tokens = _tokenize(_rewrite_interval(tokens, k))
+
+    out = []
+    for kind, text in tokens:
+        if kind == "comment":
+            out.append(" ")
+        elif kind == "op" and text == "/":
+            out.append(" * 1.0 / ")
+        elif kind == "op" and text == "||":
+            # MySQLでは`OR`、SQLiteでは文字列の連結
+            raise _untranslatable("`||`の代わりに`OR`か`CONCAT()`を使ってください")
+        elif kind == "word" and text.upper() == "DIV":
+            out.append("/")
+        else:
+            out.append(text)
+    return _translate_simple("".join(out))
+
+def _translate_simple(sql: str) -> str:
+    # 正規表現で済む読み替え（文字列リテラルの中は書き換えない）
+    parts = _QUOTED_PATTERN.split(sql)
+    out = []
+    for i, part in enumerate(parts):
+        # 奇数番目が引用符で囲まれた部分
+        if i % 2 == 1:
+            if part.startswith("`"):
+                part = '"' + part[1:-1].replace('"', '""') + '"'
+            out.append(part)
+            continue
+        part = _LIMIT_PATTERN.sub(r"LIMIT \2 OFFSET \1", part)
+        part = _IF_PATTERN.sub("IIF(", part)
+        part = _TIMESTAMPDIFF_PATTERN.sub(lambda m: f"TIMESTAMPDIFF('{m.group(1).upper()}',", part)
+        out.append(part)
+    return "".join(out)
+
+def _tokenize(sql: str) -> List[Tuple[str, str]]:
+    return [(m.lastgroup, m.group()) for m in _TOKEN_PATTERN.finditer(sql)]
+
+def _next_token(tokens: List[Tuple[str, str]], i: int, step: int) -> int:
+    # `i`から`step`の向きに、空白・コメントでない字句の位置を探す（なければ-1か`len(tokens)`）
+    i += step
+    while 0 <= i < len(tokens) and tokens[i][0] in ("space", "comment"):
+        i += step
+    return i
+
+def _matching_paren(tokens: List[Tuple[str, str]], i: int, step: int) -> int:
+    # `i`のかっこと対になるかっこの位置（なければ`_untranslatable`）
+    open_paren, close_paren = ("(", ")") if step > 0 else (")", "(")
+    depth = 0
+    while 0 <= i < len(tokens):
+        kind, text = tokens[i]
+        if kind == "op" and text == open_paren:
+            depth += 1
+        elif kind == "op" and text == close_paren:
+            depth -= 1
+            if depth == 0:
+                return i
+        i += step
+    raise _untranslatable("かっこが閉じていません")
+
+def _operand_end(tokens: List[Tuple[str, str]], i: int) -> int:
+    # `i`から始まる項（名前・`表.列`・リテラル・関数呼び出し・かっこ）の最後の字句の位置
+    kind, text = tokens[i] if i < len(tokens) else ("", "")
+    if kind == "op" and text == "(":
+        return _matching_paren(tokens, i, 1)
+    if kind in ("quoted", "number") or (kind == "op" and text == "?"):
+        return i
+    if kind != "word":
+        raise _untranslatable("`INTERVAL`と足し引きする値を読み取れません")
+    # 関数呼び出し（名前とかっこの間に空白がないもの）
+    if i + 1 < len(tokens) and tokens[i + 1] == ("op", "("):
+        return _matching_paren(tokens, i + 1, 1)
+    # `表.列`
+    while i + 2 < len(tokens) and tokens[i + 1] == ("op", ".") and tokens[i + 2][0] in ("word", "quoted"):
+        i += 2
+    return i
+
+def _operand_start(tokens: List[Tuple[str, str]], i: int) -> int:
+    # `i`で終わる項の最初の字句の位置（`_operand_end()`の逆向き）
+    kind, text = tokens[i] if i >= 0 else ("", "")
+    if kind == "op" and text == ")":
+        i = _matching_paren(tokens, i, -1)
+        # 関数呼び出し（名前とかっこの間に空白がないもの）
+        if i > 0 and tokens[i - 1][0] == "word":
+            i -= 1
+        return i
+    if kind in ("quoted", "number") or (kind == "op" and text == "?"):
+        return i
+    if kind != "word":
+        raise _untranslatable("`INTERVAL`と足し引きする値を読み取れません")
+    while i >= 2 and tokens[i - 1] == ("op", ".") and tokens[i - 2][0] in ("word", "quoted"):
+        i -= 2
+    return i
+
+def _rewrite_interval(tokens: List[Tuple[str, str]], k: int) -> str:
+    """ `tokens[k]`の`INTERVAL n UNIT`を、`DATE_ADD()`・`DATE_SUB()`の引数の形にする
+    """
+    text = lambda start, end: "".join(t for _, t in tokens[start:end + 1])
+    # 量（数値・`?`・列名・かっこ）と単位
+    amount_start = _next_token(tokens, k, 1)
+    if amount_start < len(tokens) and tokens[amount_start] in (("op", "-"), ("op", "+")):
+        amount_end = _operand_end(tokens, _next_token(tokens, amount_start, 1))
+    else:
+        amount_end = _operand_end(tokens, amount_start)
+    unit_index = _next_token(tokens, amount_end, 1)
+    unit = tokens[unit_index][1].upper() if unit_index < len(tokens) else ""
+    if unit not in _INTERVAL_UNITS:
+        raise _untranslatable(f"`INTERVAL`の単位は{'・'.join(sorted(_INTERVAL_UNITS))}のどれかにしてください")
+    amount = text(amount_start, amount_end)
+    interval_args = f"{amount}, '{unit}'"
+
+    before = _next_token(tokens, k, -1)
+    after = _next_token(tokens, unit_index, 1)
+    before_token = tokens[before] if before >= 0 else ("", "")
+    after_token = tokens[after] if after < len(tokens) else ("", "")
+
+    # `DATE_ADD(d, INTERVAL n UNIT)`（ほかの関数の引数なら、下の`INTERVAL n UNIT + d`へ）
+    if before_token == ("op", ","):
+        depth = 0
+        i = before
+        while i >= 0:
+            kind, t = tokens[i]
+            if kind == "op" and t == ")":
+                depth += 1
+            elif kind == "op" and t == "(":
+                if depth == 0:
+                    break
+                depth -= 1
+            i -= 1
+        function = tokens[i - 1][1].upper() if i > 0 and tokens[i - 1][0] == "word" else ""
+        if function in _INTERVAL_FUNCTIONS:
+            head = text(0, i - 2)
+            return f"{head}{_INTERVAL_FUNCTIONS[function]}{text(i, before)} {interval_args}{text(unit_index + 1, len(tokens))}"
+
+    # `d + INTERVAL n UNIT`・`d - INTERVAL n UNIT`
+    if before_token in (("op", "+"), ("op", "-")):
+        operand_end = _next_token(tokens, before, -1)
+        operand_start = _operand_start(tokens, operand_end)
+        # `a * d + INTERVAL ...`などは、どこまでが日付か読み取れない
+        prior = _next_token(tokens, operand_start, -1)
+        if prior >= 0 and tokens[prior][0] == "op" and tokens[prior][1] in ("+", "-", "*", "/", "%"):
+            raise _untranslatable("`INTERVAL`と足し引きする日付は、かっこで囲んでください")
+        function = "DATE_ADD" if before_token[1] == "+" else "DATE_SUB"
+        return (
+            f"{text(0, operand_start - 1)}{function}({text(operand_start, operand_end)}, {interval_args})"
+            f"{text(unit_index + 1, len(tokens))}"
+        )
+
+    # `INTERVAL n UNIT + d`
+    if after_token == ("op", "+"):
+        operand_start = _next_token(tokens, after, 1)
+        operand_end = _operand_end(tokens, operand_start)
+        return (
+            f"{text(0, k - 1)}DATE_ADD({text(operand_start, operand_end)}, {interval_args})"
+            f"{text(operand_end + 1, len(tokens))}"
+        )
+
+    raise _untranslatable("`INTERVAL`は`DATE_ADD()`・`DATE_SUB()`の引数か、日付との足し引きで使ってください")
+
+# ----------------------------------------------------------------------
+# MySQL互換の関数（`create_function()`で登録する）
+# ----------------------------------------------------------------------
+# `DATE_FORMAT()`の書式指定子 -> `strftime()`の書式指定子
+_DATE_FORMAT_CODES = {
+    "Y": "%Y", "y": "%y", "m": "%m", "c": "{month}", "d": "%d", "e": "{day}",
+    "H": "%H", "k": "{hour}", "i": "%M", "s": "%S", "S": "%S", "p": "%p",
+    "M": "%B", "b": "%b", "W": "%A", "a": "%a", "j": "%j", "T": "%H:%M:%S",
+    "%": "%%",
+}
+
+def _to_datetime(value: Any) -> Optional[datetime]:
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return value
+    if isinstance(value, date):
+        return datetime(value.year, value.month, value.day)
+    text = str(value).strip()
+    for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M:%S.%f", "%Y-%m-%d", "%Y-%m-%dT%H:%M:%S"):
+        try:
+            return datetime.strptime(text, fmt)
+        except ValueError:
+            continue
+    return None
+
+def _date_text(value: datetime, with_time: bool) -> str:
+    return value.strftime("%Y-%m-%d %H:%M:%S" if with_time else "%Y-%m-%d")
+
+def _has_time(value: Any) -> bool:
+    return isinstance(value, str) and len(value.strip()) > 10
+
+def _date_part(attr: str):
+    def func(value):
+        d = _to_datetime(value)
+        return None if d is None else getattr(d, attr)
+    return func
+
+def _date_format(value, fmt):
+    d = _to_datetime(value)
+    if d is None or fmt is None:
+        return None
+    out = []
+    chars = iter(fmt)
+    for ch in chars:
+        if ch != "%":
+            out.append(ch.replace("%", "%%").replace("{", "{{").replace("}", "}}"))
+            continue
+        code = next(chars, "")
+        out.append(_DATE_FORMAT_CODES.get(code, code))
+    # ゼロ埋めしない指定子（`%c`, `%e`, `%k`）は後から埋める
+    return d.strftime("".join(out)).format(month=d.month, day=d.day, hour=d.hour)
+
+def _add_interval(value, amount, unit, sign=1):
+    d = _to_datetime(value)
+    if d is None or amount is None or unit is None:
+        return None
+    amount = int(amount) * sign
+    unit = str(unit).upper()
+    if unit in ("YEAR", "QUARTER", "MONTH"):
+        months = d.year * 12 + (d.month - 1) + amount * {"YEAR": 12, "QUARTER": 3, "MONTH": 1}[unit]
+        year, month = divmod(months, 12)
+        month += 1
+        d = d.replace(year=year, month=month, day=min(d.day, monthrange(year, month)[1]))
+    else:
+        d = d + timedelta(**{unit.lower() + "s": amount})
+    return _date_text(d, _has_time(value) or unit in ("HOUR", "MINUTE", "SECOND"))
+
+def _datediff(a, b):
+    da, db = _to_datetime(a), _to_datetime(b)
+    if da is None or db is None:
+        return None
+    return (da.date() - db.date()).days
+
+def _timestampdiff(unit, a, b):
+    da, db = _to_datetime(a), _to_datetime(b)
+    if da is None or db is None:
+        return None
+    unit = str(unit).upper()
+    if unit in ("YEAR", "MONTH"):
+        months = (db.year - da.year) * 12 + (db.month - da.month)
+        # 月の途中までしか進んでいなければ1か月と数えない
+        if months > 0 and (db.day, db.time()) < (da.day, da.time()):
+            months -= 1
+        elif months < 0 and (db.day, db.time()) > (da.day, da.time()):
+            months += 1
+        return int(months / 12) if unit == "YEAR" else months
+    seconds = (db - da).total_seconds()
+    per = {"DAY": 86400, "HOUR": 3600, "MINUTE": 60, "SECOND": 1}[unit]
+    return int(seconds / per)
+
+def _last_day(value):
+    d = _to_datetime(value)
+    if d is None:
+        return None
+    return d.replace(day=monthrange(d.year, d.month)[1]).strftime("%Y-%m-%d")
+
+def _dayofweek(value):
+    d = _to_datetime(value)
+    # MySQLは日曜日が1
+    return None if d is None else (d.isoweekday() % 7) + 1
+
+def _concat(*args):
+    # MySQLと同じく、1つでもNULLならNULL
+    if any(a is None for a in args):
+        return None
+    return "".join(_text(a) for a in args)
+
+def _concat_ws(sep, *args):
+    if sep is None:
+        return None
+    return _text(sep).join(_text(a) for a in args if a is not None)
+
+def _text(value) -> str:
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+_FUNCTIONS = [
+    ("NOW", 0, lambda: datetime.now().strftime("%Y-%m-%d %H:%M:%S")),
+    ("CURDATE", 0, lambda: date.today().strftime("%Y-%m-%d")),
+    ("YEAR", 1, _date_part("year")),
+    ("MONTH", 1, _date_part("month")),
+    ("DAY", 1, _date_part("day")),
+    ("DAYOFMONTH", 1, _date_part("day")),
+    ("HOUR", 1, _date_part("hour")),
+    ("MINUTE", 1, _date_part("minute")),
+    ("SECOND", 1, _date_part("second")),
+    ("DAYOFWEEK", 1, _dayofweek),
+    ("LAST_DAY", 1, _last_day),
+    ("DATE_FORMAT", 2, _date_format),
+    ("DATEDIFF", 2, _datediff),
+    ("DATE_ADD", 3, _add_interval),
+    ("DATE_SUB", 3, lambda value, amount, unit: _add_interval(value, amount, unit, sign=-1)),
+    ("TIMESTAMPDIFF", 3, _timestampdiff),
+    ("CONCAT", -1, _concat),
+    ("CONCAT_WS", -1, _concat_ws),
+]
+
+def _register_functions(conn: sqlite3.Connection) -> None:
+    for name, n_args, func in _FUNCTIONS:
+        conn.create_function(name, n_args, func, deterministic=name not in ("NOW", "CURDATE"))
+
+# ----------------------------------------------------------------------
+# コネクション・カーソル
+# ----------------------------------------------------------------------
+def _convert_error(e: sqlite3.Error) -> Exception:
+    """ `sqlite3`の例外を、アプリの例外に変換する
+    """
+    message = str(e)
+    if isinstance(e, sqlite3.OperationalError):
+        if message == "interrupted":
+            return QueryCancelledError("クエリは中断されました。")
+        if _SYNTAX_ERROR_PATTERN.search(message):
+            return QuerySyntaxError(message)
+    return QueryRuntimeError(message)
+
+class SandboxCursor:
+    """ `pyodbc.Cursor`と同じ使い方ができるカーソル
+        `execute()`でMySQLの書き方を読み替え、例外はアプリの例外にして投げる
+    """
+
+    def __init__(self, conn: "SandboxConnection"):
+        self._conn = conn
+        self._cur = conn.raw.cursor()
+        self._rows: Optional[List[Tuple[Any, ...]]] = None
+        self.description = None
+
+    def execute(self, query: str, params: Optional[Sequence[Any]]=None) -> "SandboxCursor":
+        if params is None:
+            params = ()
+        self._rows = None
+        try:
+            desc = _DESC_PATTERN.match(query)
+            if desc:
+                self._execute_describe(desc.group(1))
+            else:
+                self._cur.execute(translate(query), tuple(params))
+                self.description = self._cur.description
+        except sqlite3.Error as e:
+            raise _convert_error(e) from e
+        return self
+
+    def _execute_describe(self, table_name: str) -> None:
+        # スナップショット時に保存したMySQLの`DESC`の結果を返す
+        self._cur.execute(
+            f'SELECT Field, Type, "Null", "Key", "Default", Extra FROM {DESCRIBE_TABLE} '
+            "WHERE TableName = ? ORDER BY Position",
+            (table_name, )
+        )
+        self.description = self._cur.description
+        self._rows = self._cur.fetchall()
+        if not self._rows:
+            raise QueryRuntimeError(f"Table '{table_name}' doesn't exist")
+
+    def fetchone(self):
+        rows = self.fetchmany(1)
+        return rows[0] if rows else None
+
+    def fetchmany(self, size: int=1) -> List[Tuple[Any, ...]]:
+        if self._rows is not None:
+            rows, self._rows = self._rows[:size], self._rows[size:]
+            return rows
+        try:
+            return self._cur.fetchmany(size)
+        except sqlite3.Error as e:
+            raise _convert_error(e) from e
+
+    def fetchall(self) -> List[Tuple[Any, ...]]:
+        if self._rows is not None:
+            rows, self._rows = self._rows, []
+            return rows
+        try:
+            return self._cur.fetchall()
+        except sqlite3.Error as e:
+            raise _convert_error(e) from e
+
+    def cancel(self) -> None:
+        # 同じコネクションで実行中の処理を中断させる
+        self._conn.raw.interrupt()
+
+    def close(self) -> None:
+        self._cur.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class SandboxConnection:
+    """ サンドボックス用のコネクション（読み取り専用）
+        プールからは`pyodbc.Connection`と同じように扱われる
+    """
+
+    def __init__(self, raw: sqlite3.Connection):
+        self.raw = raw
+
+    def cursor(self) -> SandboxCursor:
+        return SandboxCursor(self)
+
+    def execute(self, query: str, params: Optional[Sequence[Any]]=None) -> SandboxCursor:
+        return self.cursor().execute(query, params)
+
+    def rollback(self) -> None:
+        self.raw.rollback()
+
+    def close(self) -> None:
+        self.raw.close()
+
+def connect() -> SandboxConnection:
+    """ スナップショットを読み取り専用で開く
+    """
+    if not os.path.exists(SANDBOX_DB_PATH):
+        raise QueryRuntimeError(
+            f"サンドボックスのDBがありません: {SANDBOX_DB_PATH}"
+            "（`python -m dbapp.data.snapshot_sandbox`で作成してください）")
+    uri = f"file:{SANDBOX_DB_PATH}?mode=ro"
+    raw = sqlite3.connect(uri, uri=True, check_same_thread=False)
+    raw.execute("PRAGMA query_only = ON;")
+    if raw.execute("PRAGMA user_version;").fetchone()[0] < SNAPSHOT_FORMAT:
+        raw.close()
+        raise QueryRuntimeError(
+            f"サンドボックスのDBが古い形式です: {SANDBOX_DB_PATH}"
+            "（`python -m dbapp.data.snapshot_sandbox`で作り直してください）")
+    _register_functions(raw)
+    return SandboxConnection(raw)
@@ -1,12 +1,208 @@
 import sqlite3
 import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+from .pool import ConnectionPool
 
 _CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
 BASE_DIR = os.path.dirname(_CURRENT_DIR)
-DB_PATH = os.path.join(BASE_DIR, "data", "practice.db")
+# 問題データのDB（`.env`の`PRACTICE_DB_PATH`で差し替え可能）
+DB_PATH = os.getenv("PRACTICE_DB_PATH", os.path.join(BASE_DIR, "data", "practice.db"))
+
+# 読み取り用コネクションの設定（`.env`で上書き可能）
+# `PRACTICE_DB_IN_MEMORY=TRUE`のときは、起動時にDBをメモリに載せて読む
+LOAD_INTO_MEMORY = os.getenv("PRACTICE_DB_IN_MEMORY", "FALSE").upper() == "TRUE"
+READ_POOL_SIZE = int(os.getenv("PRACTICE_DB_READ_POOL_SIZE", "8"))
+MMAP_SIZE = int(os.getenv("PRACTICE_DB_MMAP_SIZE", str(64 * 1024 * 1024)))
+# 他プロセス（YAMLインポータなど）による更新を確認する間隔（秒）
+VERSION_CHECK_INTERVAL = float(os.getenv("PRACTICE_DB_VERSION_CHECK_INTERVAL", "5"))
+
+# メモリ上のDBの名前（世代ごとに変える）
+_MEMORY_URI = "file:practice_catalog_{generation}?mode=memory&cache=shared"
 
-def get_connection() -> sqlite3.Connection:
-    conn = sqlite3.connect(DB_PATH)
+_lock = threading.Lock()
+_init_lock = threading.Lock()
+_writer_lock = threading.Lock()
+_read_pool: Optional[ConnectionPool] = None
+_writer: Optional[sqlite3.Connection] = None
+# メモリDBを生かしておくためのコネクション
+_memory_keeper: Optional[sqlite3.Connection] = None
+_generation = 0
+# メモリDBに載っているデータのバージョン
+_memory_version: Optional[int] = None
+# データバージョンのキャッシュと、最後に確認した時刻
+_data_version: Optional[int] = None
+_version_checked_at = 0.0
+# データバージョンが最後に変わった時刻（UNIX時間、`Last-Modified`用）
+_data_modified_at: Optional[float] = None
+# 書き込み中に上げた（まだコミットしていない）データバージョン
+_pending_version: Optional[int] = None
+
+def _configure(conn: sqlite3.Connection) -> sqlite3.Connection:
     conn.row_factory = sqlite3.Row
     conn.execute("PRAGMA foreign_keys = ON;")
-    return conn
\ No newline at end of file
+    return conn
+
+def _open_disk_reader() -> sqlite3.Connection:
+    conn = _configure(sqlite3.connect(DB_PATH, check_same_thread=False))
+    conn.execute(f"PRAGMA mmap_size = {MMAP_SIZE};")
+    conn.execute("PRAGMA query_only = ON;")
+    return conn
+
+def _open_memory_reader(generation: int) -> sqlite3.Connection:
+    uri = _MEMORY_URI.format(generation=generation)
+    conn = _configure(sqlite3.connect(uri, uri=True, check_same_thread=False))
+    # 同じメモリDBを共有するコネクション同士でのロック待ちを避ける
+    conn.execute("PRAGMA read_uncommitted = ON;")
+    conn.execute("PRAGMA query_only = ON;")
+    return conn
+
+def _new_read_pool(connect) -> ConnectionPool:
+    # ローカルファイル相手なので、生存確認や寿命は実質不要
+    return ConnectionPool(
+        connect=connect,
+        max_size=READ_POOL_SIZE,
+        idle_timeout=float("inf"),
+        max_lifetime=float("inf"),
+        ping_after=float("inf"),
+    )
+
+def _get_writer() -> sqlite3.Connection:
+    # `_writer_lock`取得済みで呼ぶこと
+    global _writer
+    if _writer is None:
+        conn = _configure(sqlite3.connect(DB_PATH, check_same_thread=False))
+        # 読み取りと書き込みが互いに待たないようにWALにしておく
+        conn.execute("PRAGMA journal_mode = WAL;")
+        _writer = conn
+    return _writer
+
+def load_into_memory() -> None:
+    """ ディスク上の`practice.db`をバックアップAPIでメモリに丸ごと載せ、
+        以後の読み取りをメモリDBに切り替える
+        書き込み後の再読み込みにも使う
+    """
+    global _read_pool, _memory_keeper, _generation, _memory_version
+    with _writer_lock:
+        source = _get_writer()
+        version = _read_user_version(source)
+        generation = _generation + 1
+        keeper = sqlite3.connect(
+            _MEMORY_URI.format(generation=generation),
+            uri=True,
+            check_same_thread=False,
+        )
+        source.backup(keeper)
+
+    with _lock:
+        old_pool, old_keeper = _read_pool, _memory_keeper
+        _read_pool = _new_read_pool(lambda: _open_memory_reader(generation))
+        _memory_keeper = keeper
+        _generation = generation
+        _memory_version = version
+
+    # 旧世代は、貸出中のコネクションが返却された時点で閉じられる
+    if old_pool is not None:
+        old_pool.close()
+    if old_keeper is not None:
+        old_keeper.close()
+
+def _get_read_pool() -> ConnectionPool:
+    global _read_pool
+    if _read_pool is None:
+        with _init_lock:
+            if _read_pool is None:
+                if LOAD_INTO_MEMORY:
+                    load_into_memory()
+                else:
+                    _read_pool = _new_read_pool(_open_disk_reader)
+    return _read_pool
+
+def get_connection():
+    """ 読み取り専用コネクションを借りる
+        `with get_connection() as conn:`で使い、抜けると返却される
+    """
+    return _get_read_pool().connection()
+
+@contextmanager
+def get_write_connection() -> Iterator[sqlite3.Connection]:
+    """ 書き込み用のコネクション（プロセスで1本）を借りる
+        正常に抜けたらコミット、例外ならロールバック
+        メモリ読み込みモードのときは、コミット後にメモリDBを作り直す
+        `bump_data_version()`で上げたバージョンは、コミット（とメモリDBの作り直し）が
+        済んでから公開する（先に公開すると、コミット前のデータでカタログが作られてしまう）
+    """
+    global _pending_version
+    with _writer_lock:
+        conn = _get_writer()
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            _pending_version = None
+            raise
+        version, _pending_version = _pending_version, None
+    if LOAD_INTO_MEMORY:
+        load_into_memory()
+    if version is not None:
+        _publish_data_version(version)
+
+def _read_user_version(conn: sqlite3.Connection) -> int:
+    return conn.execute("PRAGMA user_version;").fetchone()[0]
+
+def bump_data_version(conn: sqlite3.Connection) -> int:
+    """ 問題データのバージョン（`PRAGMA user_version`）を1つ上げる
+        問題データを書き換えたときに、`get_write_connection()`のコネクションで呼ぶ
+        新しいバージョンは、`get_write_connection()`を抜けてコミットされてから公開される
+    """
+    global _pending_version
+    version = _read_user_version(conn) + 1
+    conn.execute(f"PRAGMA user_version = {version};")
+    _pending_version = version
+    return version
+
+def _publish_data_version(version: int) -> None:
+    global _data_version, _version_checked_at, _data_modified_at
+    # 他のスレッドがディスクから読んだ、より新しいバージョンは戻さない
+    if _data_version is not None and _data_version > version:
+        return
+    _data_version = version
+    _version_checked_at = time.monotonic()
+    _data_modified_at = time.time()
+
+def get_data_version() -> int:
+    """ 問題データのバージョンを返す
+        ディスク上の値の確認は`VERSION_CHECK_INTERVAL`秒に1回だけ行う
+        メモリ読み込みモードでメモリDBが古くなっていたら読み込み直す
+    """
+    global _data_version, _version_checked_at, _data_modified_at
+    now = time.monotonic()
+    if _data_version is None or now - _version_checked_at > VERSION_CHECK_INTERVAL:
+        with _writer_lock:
+            version = _read_user_version(_get_writer())
+        if _data_version is None:
+            # 起動直後は、DBファイル（WALを含む）の更新時刻を使う
+            _data_modified_at = _file_modified_at()
+        elif version != _data_version:
+            # 他のプロセスが書き換えた -> 気づいた時刻を更新時刻とする
+            _data_modified_at = time.time()
+        _data_version = version
+        _version_checked_at = now
+    if LOAD_INTO_MEMORY and _memory_version is not None and _memory_version != _data_version:
+        load_into_memory()
+    return _data_version
+
+def get_data_modified_at() -> float:
+    """ 問題データが最後に変わった時刻（UNIX時間）を返す
+        HTTPの`Last-Modified`に使う（秒未満は切り捨てて使うこと）
+    """
+    get_data_version()
+    return _data_modified_at
+
+def _file_modified_at() -> float:
+    paths = (DB_PATH, DB_PATH + "-wal")
+    return max((os.path.getmtime(path) for path in paths if os.path.exists(path)), default=time.time())
@@ -0,0 +1,225 @@
+# クエリ実行の受付制御（同時実行数の上限と、セッション間で公平な待ち行列）
+import math
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Deque, Dict, Iterator, Optional
+
+from dbapp.config import (
+    ADMISSION_MAX_ACTIVE,
+    ADMISSION_MAX_PER_SESSION,
+    ADMISSION_MAX_QUEUE,
+    ADMISSION_MAX_WAIT,
+)
+from dbapp import timing
+from dbapp.timing import Histogram
+
+# 待ち時間（秒）のヒストグラムの区切り
+WAIT_TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# 到着時の待ち行列の長さのヒストグラムの区切り
+QUEUE_DEPTH_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+class AdmissionRejectedError(Exception):
+    """ 混雑のため、クエリの実行を受け付けなかった
+        `retry_after`は再試行までの目安（秒）
+    """
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class _Waiter:
+    __slots__ = ("session_id", "cost", "granted", "enqueued_at")
+
+    def __init__(self, session_id: str, cost: int):
+        self.session_id = session_id
+        self.cost = cost
+        self.granted = False
+        self.enqueued_at = time.monotonic()
+
+class AdmissionController:
+    """ DBに同時に流すクエリの数を制限する
+        - `max_active`: 全体で同時に実行できるクエリ数
+        - `max_per_session`: 1セッションが同時に実行できるクエリ数
+        - `max_queue`: 待ち行列の長さの上限（超えたら即座に断る）
+        - `max_wait`: 待ち行列で待つ最大秒数
+        待ち行列はセッションごとに分け、空きが出たらセッションを順番に回して割り当てる
+        （1人が連打しても、他の人の順番は後回しにならない）
+    """
+
+    def __init__(self, max_active: int, max_per_session: int, max_queue: int, max_wait: float):
+        self.max_active = max_active
+        self.max_per_session = max_per_session
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+
+        self._cond = threading.Condition()
+        self._active = 0
+        self._active_by_session: Dict[str, int] = {}
+        # セッションID -> 待ち行列（先頭のセッションから順に割り当てる）
+        self._queues: "OrderedDict[str, Deque[_Waiter]]" = OrderedDict()
+        self._queued = 0
+
+        # 統計情報
+        self._admitted = 0
+        self._rejected = 0
+        self._timed_out = 0
+        self._wait_times = Histogram(WAIT_TIME_BUCKETS)
+        self._queue_depths = Histogram(QUEUE_DEPTH_BUCKETS)
+        # 1回の実行にかかる時間の移動平均（再試行の目安に使う）
+        self._avg_hold = 0.5
+
+    @contextmanager
+    def admit(self, session_id: str, cost: int = 1, timeout: Optional[float] = None) -> Iterator[None]:
+        """ 実行枠を確保して`with`の中を実行する
+            `cost`はその処理で同時に流すクエリ数（正誤判定なら2）
+            待ち行列がいっぱい、または`timeout`秒待っても枠が空かなければ
+            `AdmissionRejectedError`をスローする
+        """
+        cost = max(1, min(cost, self.max_per_session, self.max_active))
+        with timing.phase("queue"):
+            self._acquire(session_id, cost, self.max_wait if timeout is None else min(timeout, self.max_wait))
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._release(session_id, cost, time.monotonic() - started)
+
+    def stats(self) -> dict:
+        """ 統計情報（実行中・待ち行列の数、受付・拒否の回数、待ち時間と行列の長さのヒストグラム）
+        """
+        with self._cond:
+            return {
+                "active": self._active,
+                "queued": self._queued,
+                "sessions_waiting": len(self._queues),
+                "max_active": self.max_active,
+                "max_per_session": self.max_per_session,
+                "max_queue": self.max_queue,
+                "admitted": self._admitted,
+                "rejected": self._rejected,
+                "timed_out": self._timed_out,
+                "wait_seconds": self._wait_times.snapshot(),
+                "queue_depth": self._queue_depths.snapshot(),
+            }
+
+    # ------------------------------------------------------------------
+    # 内部処理
+    # ------------------------------------------------------------------
+    def _acquire(self, session_id: str, cost: int, timeout: float) -> None:
+        with self._cond:
+            self._queue_depths.observe(self._queued)
+            # 誰も待っていなければ、空きがあればすぐ実行
+            if self._queued == 0 and self._can_run(session_id, cost):
+                self._grant(session_id, cost)
+                self._wait_times.observe(0.0)
+                return
+            if self._queued >= self.max_queue:
+                self._rejected += 1
+                raise AdmissionRejectedError(
+                    "混み合っているため、実行を受け付けられませんでした。", self._retry_after())
+
+            waiter = _Waiter(session_id, cost)
+            self._queues.setdefault(session_id, deque()).append(waiter)
+            self._queued += 1
+            self._dispatch()
+
+            end = waiter.enqueued_at + timeout
+            while not waiter.granted:
+                remaining = end - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            waited = time.monotonic() - waiter.enqueued_at
+            if not waiter.granted:
+                self._remove(waiter)
+                self._timed_out += 1
+                self._rejected += 1
+                raise AdmissionRejectedError(
+                    "混み合っているため、待ち時間内に実行できませんでした。", self._retry_after())
+            self._wait_times.observe(waited)
+
+    def _release(self, session_id: str, cost: int, held: float) -> None:
+        with self._cond:
+            self._active -= cost
+            remaining = self._active_by_session[session_id] - cost
+            if remaining:
+                self._active_by_session[session_id] = remaining
+            else:
+                del self._active_by_session[session_id]
+            self._avg_hold = self._avg_hold * 0.9 + held * 0.1
+            self._dispatch()
+
+    def _can_run(self, session_id: str, cost: int) -> bool:
+        return (self._active + cost <= self.max_active
+                and self._active_by_session.get(session_id, 0) + cost <= self.max_per_session)
+
+    def _grant(self, session_id: str, cost: int) -> None:
+        self._active += cost
+        self._active_by_session[session_id] = self._active_by_session.get(session_id, 0) + cost
+        self._admitted += 1
+
+    def _dispatch(self) -> None:
+        """ 空いている枠を、待っているセッションに順番に割り当てる
+            （`_cond`取得済みで呼ぶこと）
+        """
+        granted_any = False
+        progressed = True
+        while progressed and self._queued and self._active < self.max_active:
+            progressed = False
+            for session_id in list(self._queues):
+                queue = self._queues[session_id]
+                waiter = queue[0]
+                if not self._can_run(session_id, waiter.cost):
+                    continue
+                queue.popleft()
+                self._queued -= 1
+                waiter.granted = True
+                self._grant(session_id, waiter.cost)
+                # 割り当てたセッションは後ろに回す
+                if queue:
+                    self._queues.move_to_end(session_id)
+                else:
+                    del self._queues[session_id]
+                granted_any = progressed = True
+                break
+        if granted_any:
+            self._cond.notify_all()
+
+    def _remove(self, waiter: _Waiter) -> None:
+        queue = self._queues.get(waiter.session_id)
+        if queue is None:
+            return
+        try:
+            queue.remove(waiter)
+        except ValueError:
+            return
+        self._queued -= 1
+        if not queue:
+            del self._queues[waiter.session_id]
+
+    def _retry_after(self) -> int:
+        # 待ち行列がはけるまでのおおよその秒数
+        estimate = self._avg_hold * (self._queued + 1) / self.max_active
+        return int(min(max(math.ceil(estimate), 1), 60))
+
+_controller = AdmissionController(
+    max_active=ADMISSION_MAX_ACTIVE,
+    max_per_session=ADMISSION_MAX_PER_SESSION,
+    max_queue=ADMISSION_MAX_QUEUE,
+    max_wait=ADMISSION_MAX_WAIT
+)
+
+def admit(session_id: str, cost: int = 1, timeout: Optional[float] = None):
+    """ プロセス共通の受付制御で実行枠を確保する（`with admit(...):`で使う）
+        services/admission_service
+    """
+    return _controller.admit(session_id=session_id, cost=cost, timeout=timeout)
+
+def get_admission_stats() -> dict:
+    """ 受付制御の統計情報を返す
+        services/admission_service
+    """
+    return _controller.stats()
@@ -0,0 +1,348 @@
+# 正解クエリの結果の要約（正誤判定のたびに正解クエリを流さないための下ごしらえ）
+#   練習用データセットは読み取り専用なので、正解クエリの結果はデータセットが変わらない限り同じ
+#   -> 全問題の正解クエリを並行して流し、列名・行数・順序つきのダイジェスト・順序によらない
+#      ダイジェスト（結果が小さければ行そのものも）を`practice.db`の`AnswerDigests`に書いておく
+#   正誤判定（services/practice_service）では
+#     - 行そのものがあれば、それを正解の結果セットにする（正解クエリは流さない）
+#     - 要約だけなら、ユーザークエリの結果の要約と比べて、一致すれば正解
+#       （食い違ったときだけ、差分を見せるために正解クエリを流す）
+#   正解クエリ・データセットが変わった要約は使わず、裏で計算し直す
+#   MySQLで`.env`に`DATASET_VERSION`がなければ、データセットが変わってもわからないので使わない
+#   （保存済みの要約も使わず、毎回正解クエリを流す）
+#   計算は`python -m dbapp.data.compute_answer_digests`、またはアプリの起動時に裏で行う
+#   踏み台Excelでは使わない（正解クエリをDBに直接流して計算するので）
+import hashlib
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, time as dt_time, timedelta
+from decimal import Decimal
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from dbapp.config import ANSWER_DIGEST_MAX_WORKERS, ANSWER_DIGEST_MAX_ROWS, ANSWER_DIGEST_TIMEOUT
+from dbapp.db import practice_queries as pq
+from dbapp.db import queries as dbq
+from dbapp.db.connection import get_dataset_version, has_dataset_version
+
+QuestionKey = Tuple[int, int, int]
+
+DATASET_VERSION_MISSING = "DATASET_VERSIONが設定されていないので、正解の要約は使いません"
+
+class AnswerDigest:
+    """ 1問分の正解クエリの結果の要約
+        `rows`は行そのもの（保存していなければNone）
+    """
+    __slots__ = ("columns", "row_count", "ordered_digest", "multiset_digest", "rows")
+
+    def __init__(self, columns: List[str], row_count: int, ordered_digest: str, multiset_digest: str,
+                 rows: Optional[List[Tuple[Any, ...]]]=None):
+        self.columns = columns
+        self.row_count = row_count
+        self.ordered_digest = ordered_digest
+        self.multiset_digest = multiset_digest
+        self.rows = rows
+
+    def matches(self, columns: Sequence[str], digest) -> bool:
+        """ 結果セット（列名と`ResultDigest`）が'strict'モードで一致するか
+        """
+        return (
+            list(columns) == self.columns
+            and digest.count == self.row_count
+            and digest.ordered_hexdigest() == self.ordered_digest
+        )
+
+class DigestRefresher:
+    """ 要約の計算を裏で行う（1本のスレッド）
+        同じ問題を重ねて計算しない
+        計算に失敗した問題は、正解クエリかデータセットが変わるまで計算し直さない
+        `invalidate()`より前に始めた計算の結果は書かない
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # 書き込みと`invalidate()`の削除を重ねないためのロック
+        self._save_lock = threading.Lock()
+        # `invalidate()`のたびに増える（計算中に捨てられたかの確認用）
+        self._generation = 0
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._pending: set = set()
+        # 章・節・問題番号 -> 失敗したときの(正解クエリのハッシュ, データセットのバージョン)
+        self._failed: Dict[QuestionKey, Tuple[str, str]] = {}
+        # 統計情報
+        self._hits = 0
+        self._misses = 0
+        self._computed = 0
+        self._failures = 0
+        self._last_error: Optional[str] = None
+        self._last_refreshed_at: Optional[float] = None
+
+    def record_lookup(self, hit: bool) -> None:
+        with self._lock:
+            if hit:
+                self._hits += 1
+            else:
+                self._misses += 1
+
+    def schedule(self, keys: Optional[Iterable[QuestionKey]]=None) -> bool:
+        """ `keys`（省略時は全問題）のうち古い要約の計算を予約する（予約したらTrue）
+        """
+        keys = None if keys is None else tuple(keys)
+        with self._lock:
+            if keys is not None:
+                keys = tuple(key for key in keys if key not in self._pending)
+                if not keys:
+                    return False
+                self._pending.update(keys)
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="answer-digest")
+            self._executor.submit(self._run, keys)
+        return True
+
+    def is_failed(self, key: QuestionKey, version: Tuple[str, str]) -> bool:
+        with self._lock:
+            return self._failed.get(key) == version
+
+    def refresh(self, keys: Optional[Sequence[QuestionKey]]=None, force: bool=False,
+                max_workers: int=ANSWER_DIGEST_MAX_WORKERS) -> Dict[str, Any]:
+        """ 要約を計算して書く（`force`でなければ、古いものだけ）
+            正解クエリは`max_workers`本ずつ並行して流し、書き込みは最後に1回でまとめて行う
+            計算した・飛ばした・失敗した件数と、失敗の内容を返す
+            データセットのバージョンがわからなければRuntimeError
+        """
+        if not has_dataset_version():
+            raise RuntimeError(DATASET_VERSION_MISSING)
+        with self._lock:
+            generation = self._generation
+        dataset_version = get_dataset_version()
+        questions = pq.get_all_answer_queries()
+        if keys is not None:
+            wanted = set(keys)
+            questions = [(key, query) for key, query in questions if key in wanted]
+        total = len(questions)
+        if not force:
+            saved = pq.get_answer_digest_versions()
+            questions = [
+                (key, query) for key, query in questions
+                if saved.get(key) != (answer_query_hash(query), dataset_version)
+            ]
+        skipped = total - len(questions)
+
+        digests = []
+        errors = []
+        if questions:
+            with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="answer-digest-query") as executor:
+                futures = [
+                    (key, query, executor.submit(compute_answer_digest, query, dataset_version))
+                    for key, query in questions
+                ]
+                for key, query, future in futures:
+                    try:
+                        digests.append({"key": key, **future.result()})
+                    except Exception as e:
+                        # 1問の失敗で全体を止めない（正解クエリの誤り・期限切れなど）
+                        errors.append({"question_key": list(key), "error": str(e)})
+                        with self._lock:
+                            self._failed[key] = (answer_query_hash(query), dataset_version)
+            with self._save_lock:
+                if self._generation != generation:
+                    # 計算中に捨てられた（入れ替え前のデータセットの結果かもしれない）
+                    digests = []
+                pq.save_answer_digests(digests)
+
+        with self._lock:
+            for digest in digests:
+                self._failed.pop(digest["key"], None)
+            self._computed += len(digests)
+            self._failures += len(errors)
+            if errors:
+                self._last_error = errors[-1]["error"]
+            self._last_refreshed_at = time.time()
+        return {"computed": len(digests), "skipped": skipped, "failed": len(errors), "errors": errors}
+
+    def invalidate(self) -> int:
+        """ 保存済みの要約を全部消す（データセットを入れ替えたとき用、消した件数を返す）
+            失敗の記録も忘れる
+        """
+        with self._save_lock:
+            with self._lock:
+                self._generation += 1
+                self._failed.clear()
+            return pq.delete_answer_digests()
+
+    def stats(self) -> Dict[str, Any]:
+        """ 統計情報（判定で要約を使えた・使えなかった回数、計算した・失敗した件数など）
+        """
+        with self._lock:
+            total = self._hits + self._misses
+            return {
+                "enabled": has_dataset_version(),
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": self._hits / total if total else None,
+                "computed": self._computed,
+                "failures": self._failures,
+                "pending": len(self._pending),
+                "last_error": self._last_error,
+                "last_refreshed_at": self._last_refreshed_at,
+            }
+
+    def _run(self, keys: Optional[Tuple[QuestionKey, ...]]) -> None:
+        try:
+            self.refresh(keys)
+        except Exception as e:
+            # DB・`practice.db`につながらないなど（次の予約でやり直す）
+            with self._lock:
+                self._failures += 1
+                self._last_error = str(e)
+        finally:
+            if keys is not None:
+                with self._lock:
+                    self._pending.difference_update(keys)
+
+_refresher = DigestRefresher()
+
+def answer_query_hash(answer_query: str) -> str:
+    """ 正解クエリのハッシュ（要約が今の正解クエリのものかの確認用）
+        services/answer_digest_service
+    """
+    return hashlib.blake2b(answer_query.encode("utf-8"), digest_size=16).hexdigest()
+
+def compute_answer_digest(answer_query: str, dataset_version: Optional[str]=None) -> Dict[str, Any]:
+    """ 正解クエリを流して結果の要約を作る（`pq.save_answer_digests()`に渡す形のdict）
+        行数が`ANSWER_DIGEST_MAX_ROWS`以下なら、行そのものも入れる
+        services/answer_digest_service
+    """
+    # NumPyを読み込むので、使うときまでimportしない
+    from dbapp.services.query_compare.strict import ResultDigest
+
+    if dataset_version is None:
+        dataset_version = get_dataset_version()
+    digest = ResultDigest()
+    rows: Optional[List[Any]] = []
+    deadline = dbq.Deadline(ANSWER_DIGEST_TIMEOUT)
+    with dbq.stream_rows(answer_query, deadline=deadline) as (columns, chunks):
+        for chunk in chunks:
+            digest.add_many(chunk)
+            if rows is not None:
+                rows.extend(chunk)
+                if len(rows) > ANSWER_DIGEST_MAX_ROWS:
+                    rows = None
+    return {
+        "AnswerQueryHash": answer_query_hash(answer_query),
+        "DatasetVersion": dataset_version,
+        "Columns": json.dumps(columns, ensure_ascii=False),
+        "RowCount": digest.count,
+        "OrderedDigest": digest.ordered_hexdigest(),
+        "MultisetDigest": digest.multiset_hexdigest(),
+        "ExpectedRows": _encode_rows(rows) if rows is not None else None,
+        "ComputedAt": time.time(),
+    }
+
+def refresh_answer_digests(keys: Optional[Sequence[QuestionKey]]=None, force: bool=False,
+                           max_workers: int=ANSWER_DIGEST_MAX_WORKERS) -> Dict[str, Any]:
+    """ 要約を計算して`practice.db`に書く（`keys`省略時は全問題、`force`でなければ古いものだけ）
+        services/answer_digest_service
+    """
+    return _refresher.refresh(keys, force=force, max_workers=max_workers)
+
+def start_digest_refresher() -> None:
+    """ 全問題の古い要約の計算を裏で始める（`create_app()`から呼ぶ）
+        データセットのバージョンがわからなければ何もしない
+        services/answer_digest_service
+    """
+    if has_dataset_version():
+        _refresher.schedule()
+
+def schedule_digest_refresh(key: QuestionKey) -> bool:
+    """ 1問分の要約の計算を裏で予約する（問題を更新したとき用）
+        services/answer_digest_service
+    """
+    if not has_dataset_version():
+        return False
+    return _refresher.schedule([tuple(key)])
+
+def invalidate_answer_digests() -> int:
+    """ 保存済みの要約を全部消す（データセットを入れ替えたとき用、消した件数を返す）
+        次に判定で使うときに、裏で計算し直す
+        services/answer_digest_service
+    """
+    return _refresher.invalidate()
+
+def get_fresh_digest(key: QuestionKey, answer_query: str) -> Optional[AnswerDigest]:
+    """ 今の正解クエリ・データセットの要約を返す
+        なければNoneを返し、裏で計算を予約する（失敗済みのものは予約しない）
+        データセットのバージョンがわからなければ、保存済みの要約があってもNone
+        services/answer_digest_service
+    """
+    if not has_dataset_version():
+        return None
+    key = tuple(key)
+    version = (answer_query_hash(answer_query), get_dataset_version())
+    row = pq.get_answer_digest(*key)
+    if row is None or (row["AnswerQueryHash"], row["DatasetVersion"]) != version:
+        _refresher.record_lookup(hit=False)
+        if not _refresher.is_failed(key, version):
+            _refresher.schedule([key])
+        return None
+    _refresher.record_lookup(hit=True)
+    return AnswerDigest(
+        columns=json.loads(row["Columns"]),
+        row_count=row["RowCount"],
+        ordered_digest=row["OrderedDigest"],
+        multiset_digest=row["MultisetDigest"],
+        rows=_decode_rows(row["ExpectedRows"]) if row["ExpectedRows"] is not None else None
+    )
+
+def get_answer_digest_stats() -> Dict[str, Any]:
+    """ 正解の要約の統計情報を返す
+        services/answer_digest_service
+    """
+    return _refresher.stats()
+
+# ----------------------------------------------------------------------
+# 行そのものの保存（JSON）
+#   JSONにない型は印つきのdictにして、読み戻したときに同じ型・同じ値に戻す
+#   （比較器は型が違うと別の値とみなすので）
+# ----------------------------------------------------------------------
+def _encode_rows(rows: Sequence[Sequence[Any]]) -> Optional[str]:
+    # 戻せない型を含む結果セットは保存しない（要約だけで判定する）
+    try:
+        return json.dumps([[_encode_value(value) for value in row] for row in rows], ensure_ascii=False)
+    except TypeError:
+        return None
+
+def _encode_value(value: Any) -> Any:
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, Decimal):
+        return {"d": str(value)}
+    if isinstance(value, datetime):
+        return {"t": value.isoformat()}
+    if isinstance(value, date):
+        return {"D": value.isoformat()}
+    if isinstance(value, dt_time):
+        return {"T": value.isoformat()}
+    if isinstance(value, timedelta):
+        return {"S": [value.days, value.seconds, value.microseconds]}
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return {"b": bytes(value).hex()}
+    raise TypeError(f"unsupported type: {type(value).__name__}")
+
+_DECODERS = {
+    "d": Decimal,
+    "t": datetime.fromisoformat,
+    "D": date.fromisoformat,
+    "T": dt_time.fromisoformat,
+    "S": lambda parts: timedelta(days=parts[0], seconds=parts[1], microseconds=parts[2]),
+    "b": bytes.fromhex,
+}
+
+def _decode_rows(text: str) -> List[Tuple[Any, ...]]:
+    return [tuple(_decode_value(value) for value in row) for row in json.loads(text)]
+
+def _decode_value(value: Any) -> Any:
+    if isinstance(value, dict):
+        (tag, text), = value.items()
+        return _DECODERS[tag](text)
+    return value
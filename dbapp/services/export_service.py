@@ -0,0 +1,100 @@
+# クエリ結果のエクスポート（CSV / NDJSON）
+#   カーソルから`fetchmany()`で少しずつ読み、そのままレスポンスに流す
+#   （結果セット全体をメモリに載せない）
+import csv
+import io
+import json
+from contextlib import ExitStack
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from dbapp.config import EXPORT_MAX_ROWS, EXPORT_TIMEOUT
+from dbapp.db import queries as dbq
+from dbapp.db.import_from_excel import fetch_all_excel
+from dbapp.services.admission_service import admit
+from dbapp.services.query_service import excel_timeout
+
+# 形式 -> Content-Type
+EXPORT_FORMATS = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson; charset=utf-8",
+}
+
+# Excelが UTF-8 と判断するための BOM
+UTF8_BOM = "\ufeff"
+
+def iter_csv(columns: List[str], chunks: Iterable[list], bom: bool=False) -> Iterator[bytes]:
+    """ 列名の行と、`chunks`（行のリストの列）をCSV（UTF-8）にして少しずつ返す
+        `bom`がTrueなら先頭にBOMをつける（Excelで日本語の列名が化けないように）
+        services/export_service
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\r\n")
+    if bom:
+        buffer.write(UTF8_BOM)
+    writer.writerow(columns)
+    yield _drain(buffer)
+    for chunk in chunks:
+        writer.writerows(chunk)
+        yield _drain(buffer)
+
+def iter_ndjson(columns: List[str], chunks: Iterable[list]) -> Iterator[bytes]:
+    """ 1行を1つのJSONオブジェクト（列名 -> 値）にして、改行区切りで少しずつ返す
+        日付・Decimalなどは文字列にする
+        services/export_service
+    """
+    for chunk in chunks:
+        lines = [
+            json.dumps(dict(zip(columns, row)), ensure_ascii=False, default=str)
+            for row in chunk
+        ]
+        yield ("\n".join(lines) + "\n").encode("utf-8")
+
+def open_export(sql_query: str, session_id: str, use_excel: bool=False,
+                max_rows: int=EXPORT_MAX_ROWS) -> Tuple[List[str], Iterator[list], ExitStack]:
+    """ エクスポートするクエリを検証・実行し、(列名, 行のチャンク, 後始末用のExitStack)を返す
+        実行枠とコネクションは`ExitStack`を閉じるまで借りたままになるので、
+        レスポンスを送り終えたら（`Response.call_on_close()`で）閉じること
+        構文エラーは`ValueError`、混雑は`AdmissionRejectedError`、
+        DBのエラーは`DatabaseExecutionError`の仲間をレスポンスを返す前にスローする
+        services/export_service
+    """
+    safe_query = dbq.sanitize_and_validate_sql(
+        sql_query=sql_query,
+        allowed_start=("SELECT", "WITH")
+    )
+    deadline = dbq.Deadline(EXPORT_TIMEOUT)
+    stack = ExitStack()
+    try:
+        stack.enter_context(admit(session_id, timeout=deadline.remaining()))
+        if use_excel:
+            # 踏み台Excelは全件まとめて返ってくる -> 切り分けて流すだけ
+            columns, rows = fetch_all_excel(safe_query, (), timeout=excel_timeout(deadline))
+            chunks = _split(rows, dbq.FETCH_CHUNK_SIZE)
+        else:
+            columns, chunks = stack.enter_context(
+                dbq.stream_rows(safe_query, deadline=deadline))
+    except BaseException:
+        stack.close()
+        raise
+    return columns, _limit(chunks, max_rows), stack
+
+def _drain(buffer: io.StringIO) -> bytes:
+    data = buffer.getvalue().encode("utf-8")
+    buffer.seek(0)
+    buffer.truncate()
+    return data
+
+def _split(rows: list, size: int) -> Iterator[list]:
+    for i in range(0, len(rows), size):
+        yield rows[i:i + size]
+
+def _limit(chunks: Iterable[list], max_rows: Optional[int]) -> Iterator[list]:
+    # 先頭から`max_rows`行で打ち切る
+    remaining = max_rows
+    for chunk in chunks:
+        if remaining is not None:
+            if remaining <= 0:
+                return
+            chunk = chunk[:remaining]
+            remaining -= len(chunk)
+        yield chunk
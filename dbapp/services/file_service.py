@@ -1,15 +1,48 @@
 import os
 import re
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime
 import pyodbc
 from typing import List, Tuple, Optional, Any
 from pathlib import Path
-import uuid
-import json
+
+from dbapp.config import (
+    TEMP_RESULT_MAX_BYTES, TEMP_RESULT_TTL, TEMP_RESULT_JANITOR_INTERVAL, 
+    RESULT_WINDOW_CACHE_SIZE, RESULT_WINDOW_CACHE_TTL)
+from dbapp.services.result_store import ResultStore
 
 # 結果セット一時保存用
-TMP_DIR = Path(__file__).resolve().parent.parent / "storage" / "tmp"
-TMP_DIR.mkdir(parents=True, exist_ok=True)
+#   （`.env`の`TEMP_RESULT_DIR`で置き場所を差し替え可能）
+TMP_DIR = Path(os.getenv(
+    "TEMP_RESULT_DIR", Path(__file__).resolve().parent.parent / "storage" / "tmp"))
+
+# 一時保存の置き場（容量上限・有効期限つき）
+#   ディレクトリの走査と掃除スレッドの起動は、最初に使うときまで遅らせる
+_result_store: Optional[ResultStore] = None
+_result_store_lock = threading.Lock()
+
+def _get_result_store() -> ResultStore:
+    global _result_store
+    if _result_store is None:
+        with _result_store_lock:
+            if _result_store is None:
+                store = ResultStore(
+                    directory=TMP_DIR,
+                    max_bytes=TEMP_RESULT_MAX_BYTES,
+                    ttl=TEMP_RESULT_TTL,
+                    janitor_interval=TEMP_RESULT_JANITOR_INTERVAL
+                )
+                store.start_janitor()
+                _result_store = store
+    return _result_store
+
+# 結果グリッドのスクロール用：読み込んだ結果セットを少しの間メモリに置いておく
+#   （スクロールのたびにJSONファイル全体を読み直さないように）
+#   結果IDごとに内容は変わらないので、削除されたときだけ捨てればよい
+_window_cache: "OrderedDict[str, Tuple[float, List[str], List[List[Any]]]]" = OrderedDict()
+_window_cache_lock = threading.Lock()
 
 def save_query_to_file(sql_query: str, user_filename: str, storage_dir: str) -> Tuple[Optional[str], str, str]:
     """ SQLクエリを`.sql`ファイルとして保存する
@@ -67,6 +100,7 @@ def save_temp_result(columns: List[str], rows: List[pyodbc.Row]) -> str:
     :rtype: str
     .. note::
         - 保存先ディレクトリは`storage/tmp`
+        - 合計サイズが`TEMP_RESULT_MAX_BYTES`を超えると、古いものから消える
     .. warning::
         - 特になし
     .. hint::
@@ -74,29 +108,24 @@ def save_temp_result(columns: List[str], rows: List[pyodbc.Row]) -> str:
     .. important::
         - 特になし
     """
-    tmp_id = str(uuid.uuid4())
-    path = TMP_DIR / f"{tmp_id}.json"
-
     # pyodbc.Rowオブジェクトをリスト化
     safe_rows = [list(r) for r in rows]
 
-    with path.open("w", encoding="utf-8") as f:
-        # "columns"、"rows"をキーとし、
-        # リスト`columns`、`safe_rows`をそれぞれバリューとする
-        # dictをJSON形式にエンコードしてファイルに書き込む
-        json.dump({"columns": columns, "rows": safe_rows}, f)
-
-    return tmp_id
+    # "columns"、"rows"をキーとし、
+    # リスト`columns`、`safe_rows`をそれぞれバリューとする
+    # dictをJSON形式で保存する
+    return _get_result_store().put({"columns": columns, "rows": safe_rows})
 
-def load_temp_result(tmp_id: str) -> Tuple[List[str], List[List[Any]]]:
+def load_temp_result(tmp_id: str) -> (
+        Tuple[List[str], List[List[Any]]] | Tuple[None, None]):
     """ 一時ファイルから結果セットを読み込む
 
     :param tmp_id: 一時ファイルのUUID
     :type tmp_id: str
     :return: カラム名のリストと各行のデータのリストのリスト
-    :rtype: Tuple[List[str], List[List[Any]]]
+    :rtype: Tuple[List[str], List[List[Any]]] or Tuple[None, None]
     .. note::
-        - 特になし
+        - 期限切れ・追い出し済みのときは、(None, None)が返る
     .. warning::
         - 特になし
     .. hint::
@@ -104,11 +133,9 @@ def load_temp_result(tmp_id: str) -> Tuple[List[str], List[List[Any]]]:
     .. important::
         - 特になし
     """
-    # 一時ファイルのパスを構築
-    path = TMP_DIR / f"{tmp_id}.json"
-    # 読み出しモードで開いて変数`f`にぶち込む
-    with path.open("r", encoding="utf-8") as f:
-        data = json.load(f)
+    data = _get_result_store().get(tmp_id)
+    if data is None:
+        return None, None
 
     return data.get("columns"), data.get("rows")
 
@@ -128,6 +155,43 @@ def delete_temp_result(tmp_id: str) -> None:
     .. important::
         - 特になし
     """
-    path = TMP_DIR / f"{tmp_id}.json"
-    if path.exists():
-        path.unlink()
+    with _window_cache_lock:
+        _window_cache.pop(tmp_id, None)
+    _get_result_store().delete(tmp_id)
+
+def load_temp_result_window(tmp_id: str, offset: int, limit: int) -> Optional[dict]:
+    """ 一時保存した結果セットのうち、`offset`行目（0始まり）から`limit`行を返す
+        {"columns", "rows", "offset", "total"}のdict、結果がないときはNone
+        直近に読んだ結果セットは`RESULT_WINDOW_CACHE_TTL`秒だけメモリに置いておく
+        services/file_service
+    """
+    now = time.monotonic()
+    with _window_cache_lock:
+        cached = _window_cache.get(tmp_id)
+        if cached is not None and cached[0] > now:
+            _window_cache.move_to_end(tmp_id)
+            _, columns, rows = cached
+        else:
+            cached = None
+    if cached is None:
+        columns, rows = load_temp_result(tmp_id)
+        if columns is None:
+            return None
+        with _window_cache_lock:
+            _window_cache[tmp_id] = (now + RESULT_WINDOW_CACHE_TTL, columns, rows)
+            _window_cache.move_to_end(tmp_id)
+            while len(_window_cache) > RESULT_WINDOW_CACHE_SIZE:
+                _window_cache.popitem(last=False)
+
+    return {
+        "columns": columns, 
+        "rows": rows[offset:offset + limit], 
+        "offset": offset, 
+        "total": len(rows), 
+    }
+
+def get_temp_result_stats() -> dict:
+    """ 一時保存の統計情報（ヒット・ミス・追い出しの回数など）を返す
+        services/file_service
+    """
+    return _get_result_store().stats()
@@ -0,0 +1,385 @@
+# クエリ実行・正誤判定を非同期ジョブとして動かす
+#   リクエストのスレッドとは別のワーカーで実行し、進捗（経過時間・読んだ行数・段階）を
+#   Server-Sent Eventsで流す。結果はジョブIDで取り出す
+#   ジョブはプロセスのメモリに置くので、複数プロセスで動かすときは同じプロセスに振り分けること
+import json
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterator, List, Literal, Optional
+
+from dbapp.config import (
+    JOB_MAX_WORKERS,
+    JOB_MAX_PER_SESSION,
+    JOB_RESULT_TTL,
+    JOB_PROGRESS_INTERVAL,
+    QUERY_TIMEOUT,
+    RESULT_PAGE_SIZE,
+)
+from dbapp import timing
+from dbapp.db import queries as dbq
+from dbapp.services.admission_service import admit, AdmissionRejectedError
+from dbapp.services.practice_service import compare_queries
+from dbapp.services.query_service import exec_query_page
+
+# ジョブの段階
+PHASE_QUEUED = "queued"         # ワーカーの空き待ち
+PHASE_WAITING = "waiting"       # 受付制御の実行枠待ち
+PHASE_EXECUTING = "executing"   # クエリ実行中（まだ1行も読んでいない）
+PHASE_FETCHING = "fetching"     # 結果セットを読んでいる
+PHASE_DONE = "done"
+PHASE_FAILED = "failed"
+PHASE_CANCELLED = "cancelled"
+
+FINISHED_PHASES = (PHASE_DONE, PHASE_FAILED, PHASE_CANCELLED)
+
+class JobCancelledError(Exception):
+    """ ジョブが中断を要求された
+    """
+
+class Job:
+    """ 1件の非同期ジョブ
+        進捗が変わるたびに`version`を進め、待っている側（SSE）を起こす
+    """
+
+    def __init__(self, kind: str, session_id: str, params: Dict[str, Any]):
+        self.id = str(uuid.uuid4())
+        self.kind = kind
+        self.session_id = session_id
+        # 結果の表示に使う情報（ページ名・問題番号など）
+        self.params = params
+
+        self._cond = threading.Condition()
+        self.version = 0
+        self.phase = PHASE_QUEUED
+        self.created_at = time.monotonic()
+        self.finished_at: Optional[float] = None
+        self.rows_fetched = 0
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[str] = None
+        self.cancel_requested = False
+        self.future: Optional[Future] = None
+        self._cancellers: List[dbq.QueryCanceller] = []
+
+    @property
+    def finished(self) -> bool:
+        return self.phase in FINISHED_PHASES
+
+    def snapshot(self) -> Dict[str, Any]:
+        """ 進捗（JSONにできるdict）
+        """
+        with self._cond:
+            end = self.finished_at if self.finished_at is not None else time.monotonic()
+            return {
+                "job_id": self.id,
+                "kind": self.kind,
+                "phase": self.phase,
+                "elapsed": round(end - self.created_at, 3),
+                "rows_fetched": self.rows_fetched,
+                "finished": self.finished,
+                "error": self.error,
+            }
+
+    def set_phase(self, phase: str) -> None:
+        with self._cond:
+            if self.finished:
+                return
+            self.phase = phase
+            self._changed()
+
+    def add_rows(self, count: int) -> None:
+        """ 読んだ行数を足す（`fetch_all()`などの`on_rows`に渡す）
+        """
+        with self._cond:
+            self.rows_fetched += count
+            if self.phase == PHASE_EXECUTING:
+                self.phase = PHASE_FETCHING
+            self._changed()
+
+    def new_canceller(self) -> dbq.QueryCanceller:
+        """ このジョブの中断に連動するQueryCancellerを作る
+        """
+        canceller = dbq.QueryCanceller()
+        with self._cond:
+            self._cancellers.append(canceller)
+            cancel_now = self.cancel_requested
+        if cancel_now:
+            canceller.cancel()
+        return canceller
+
+    def check_cancelled(self) -> None:
+        if self.cancel_requested:
+            raise JobCancelledError()
+
+    def cancel(self) -> None:
+        """ 中断を要求する（実行中のクエリにも`cancel()`を送る）
+        """
+        with self._cond:
+            if self.finished or self.cancel_requested:
+                return
+            self.cancel_requested = True
+            cancellers = list(self._cancellers)
+            self._changed()
+        for canceller in cancellers:
+            canceller.cancel()
+
+    def finish(self, phase: str, result: Optional[Dict[str, Any]] = None, error: Optional[str] = None) -> None:
+        with self._cond:
+            if self.finished:
+                return
+            self.phase = phase
+            self.result = result
+            self.error = error
+            self.finished_at = time.monotonic()
+            self._changed()
+
+    def wait_for_change(self, version: int, timeout: float) -> int:
+        """ `version`から進捗が変わるか`timeout`秒たつまで待ち、最新の`version`を返す
+        """
+        with self._cond:
+            if self.version == version and not self.finished:
+                self._cond.wait(timeout)
+            return self.version
+
+    def _changed(self) -> None:
+        # `_cond`取得済みで呼ぶ
+        self.version += 1
+        self._cond.notify_all()
+
+class JobManager:
+    """ ジョブを専用のワーカーで実行し、IDで引けるように持っておく
+        - 1セッションが同時に持てる未完了のジョブは`max_per_session`件まで
+        - 終わったジョブは`ttl`秒たったら捨てる
+    """
+
+    def __init__(self, max_workers: int, max_per_session: int, ttl: float):
+        self.max_per_session = max_per_session
+        self.ttl = ttl
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._lock = threading.Lock()
+        self._jobs: Dict[str, Job] = {}
+
+        # 統計情報
+        self._submitted = 0
+        self._completed = {phase: 0 for phase in FINISHED_PHASES}
+
+    def submit(self, kind: str, session_id: str, params: Dict[str, Any],
+               runner: Callable[[Job], Dict[str, Any]]) -> Job:
+        """ ジョブを登録してワーカーに渡す
+            未完了のジョブが多すぎるときは`AdmissionRejectedError`をスローする
+        """
+        self.sweep()
+        job = Job(kind=kind, session_id=session_id, params=params)
+        with self._lock:
+            pending = sum(1 for j in self._jobs.values()
+                          if j.session_id == session_id and not j.finished)
+            if pending >= self.max_per_session:
+                raise AdmissionRejectedError(
+                    "実行中のジョブが多すぎるため、受け付けられませんでした。", 1)
+            self._jobs[job.id] = job
+            self._submitted += 1
+        job.future = self._executor.submit(self._run, job, runner)
+        return job
+
+    def get(self, job_id: str, session_id: str) -> Optional[Job]:
+        """ ジョブを返す（ない・別のセッションのものならNone）
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None or job.session_id != session_id:
+            return None
+        return job
+
+    def cancel(self, job_id: str, session_id: str) -> Optional[Job]:
+        """ ジョブの中断を要求する（まだワーカーに渡っていなければその場で取り消す）
+        """
+        job = self.get(job_id, session_id)
+        if job is None:
+            return None
+        job.cancel()
+        if job.future is not None and job.future.cancel():
+            self._finish(job, PHASE_CANCELLED)
+        return job
+
+    def sweep(self) -> None:
+        """ 終わってから`ttl`秒たったジョブを捨てる
+        """
+        now = time.monotonic()
+        with self._lock:
+            expired = [job_id for job_id, job in self._jobs.items()
+                       if job.finished_at is not None and now - job.finished_at > self.ttl]
+            for job_id in expired:
+                del self._jobs[job_id]
+
+    def stats(self) -> Dict[str, Any]:
+        """ 統計情報（登録数、段階ごとのジョブ数、終わり方ごとの件数）
+        """
+        with self._lock:
+            phases: Dict[str, int] = {}
+            for job in self._jobs.values():
+                phases[job.phase] = phases.get(job.phase, 0) + 1
+            return {
+                "submitted": self._submitted,
+                "jobs": len(self._jobs),
+                "phases": phases,
+                "completed": dict(self._completed),
+            }
+
+    def _run(self, job: Job, runner: Callable[[Job], Dict[str, Any]]) -> None:
+        if job.cancel_requested:
+            self._finish(job, PHASE_CANCELLED)
+            return
+        try:
+            # ジョブもリクエストと同じく計測する（`route`は`job.query` / `job.judge`）
+            with timing.measure(f"job.{job.kind}"):
+                result = runner(job)
+        except JobCancelledError:
+            self._finish(job, PHASE_CANCELLED)
+        except Exception as e:
+            # 中断で失敗したものは中断として扱う
+            if job.cancel_requested:
+                self._finish(job, PHASE_CANCELLED)
+            else:
+                self._finish(job, PHASE_FAILED, error=str(e))
+        else:
+            if job.cancel_requested:
+                self._finish(job, PHASE_CANCELLED)
+            else:
+                self._finish(job, PHASE_DONE, result=result)
+
+    def _finish(self, job: Job, phase: str, result: Optional[Dict[str, Any]] = None,
+                error: Optional[str] = None) -> None:
+        if job.finished:
+            return
+        job.finish(phase, result=result, error=error)
+        with self._lock:
+            self._completed[phase] += 1
+
+_manager = JobManager(
+    max_workers=JOB_MAX_WORKERS,
+    max_per_session=JOB_MAX_PER_SESSION,
+    ttl=JOB_RESULT_TTL
+)
+
+def submit_query_job(session_id: str, sql_query: str, page: str,
+                     page_size: int = RESULT_PAGE_SIZE, use_excel: bool = False) -> Job:
+    """ クエリ実行（1ページ目の取得）をジョブとして登録する
+        実行期限は登録した時点から数える
+        services/job_service
+    """
+    deadline = dbq.Deadline(QUERY_TIMEOUT)
+
+    def run(job: Job) -> Dict[str, Any]:
+        canceller = job.new_canceller()
+        job.set_phase(PHASE_WAITING)
+        with admit(session_id, timeout=deadline.remaining()):
+            job.check_cancelled()
+            job.set_phase(PHASE_EXECUTING)
+            columns, rows, message, category, page_info = exec_query_page(
+                sql_query=sql_query,
+                page=1,
+                page_size=page_size,
+                use_excel=use_excel,
+                deadline=deadline,
+                canceller=canceller,
+                on_rows=job.add_rows
+            )
+        return {
+            "columns": columns,
+            "rows": [list(row) for row in rows],
+            "message": message,
+            "category": category,
+            "page_info": page_info,
+        }
+
+    return _manager.submit("query", session_id, {"page": page}, run)
+
+def submit_judge_job(session_id: str, user_query: str, answer_query: str,
+                     check_mode: Literal["strict", "loose", "custom"], question_info: tuple,
+                     use_excel: bool = False) -> Job:
+    """ 正誤判定をジョブとして登録する
+        ユーザークエリと正解クエリを同時に流すので、実行枠は2つ使う
+        services/job_service
+    """
+    deadline = dbq.Deadline(QUERY_TIMEOUT)
+
+    def run(job: Job) -> Dict[str, Any]:
+        cancellers = (job.new_canceller(), job.new_canceller())
+        job.set_phase(PHASE_WAITING)
+        with admit(session_id, cost=2, timeout=deadline.remaining()):
+            job.check_cancelled()
+            job.set_phase(PHASE_EXECUTING)
+            (
+                result, result_enum, message, detail,
+                user_columns, user_rows,
+                answer_columns, answer_rows) = compare_queries(
+                    user_query=user_query,
+                    answer_query=answer_query,
+                    check_mode=check_mode,
+                    rule=None,
+                    use_excel=use_excel,
+                    deadline=deadline,
+                    cancellers=cancellers,
+                    on_rows=job.add_rows,
+                    question_key=tuple(question_info)
+                )
+        return {
+            "result": result,
+            "result_enum": result_enum,
+            "message": message,
+            "detail": detail,
+            "user_columns": user_columns,
+            "user_rows": user_rows,
+            "answer_columns": answer_columns,
+            "answer_rows": answer_rows,
+        }
+
+    params = {"question_info": question_info, "user_query": user_query}
+    return _manager.submit("judge", session_id, params, run)
+
+def get_job(job_id: str, session_id: str) -> Optional[Job]:
+    """ ジョブを返す（ない・別のセッションのものならNone）
+        services/job_service
+    """
+    return _manager.get(job_id, session_id)
+
+def cancel_job(job_id: str, session_id: str) -> Optional[Job]:
+    """ ジョブの中断を要求する
+        services/job_service
+    """
+    return _manager.cancel(job_id, session_id)
+
+def get_job_stats() -> Dict[str, Any]:
+    """ ジョブの統計情報を返す
+        services/job_service
+    """
+    return _manager.stats()
+
+def job_result_json(job: Job) -> Dict[str, Any]:
+    """ ジョブの結果をJSONにできる形にして返す
+        services/job_service
+    """
+    result = dict(job.result or {})
+    if job.kind == "judge":
+        result_enum = result.get("result_enum")
+        result["result_enum"] = result_enum.name if result_enum is not None else None
+        for key in ("user_rows", "answer_rows"):
+            result[key] = [list(row) for row in result.get(key, [])]
+    # 日付・Decimalなどは文字列にする
+    return json.loads(json.dumps(result, ensure_ascii=False, default=str))
+
+def iter_job_events(job: Job) -> Iterator[str]:
+    """ ジョブの進捗をServer-Sent Events形式で返す
+        進捗が変わったとき（変わらなくても`JOB_PROGRESS_INTERVAL`秒ごと）に`progress`を送り、
+        終わったら`done`/`failed`/`cancelled`を送って終わる
+        services/job_service
+    """
+    version = -1
+    while True:
+        version = job.wait_for_change(version, JOB_PROGRESS_INTERVAL)
+        snapshot = job.snapshot()
+        event = snapshot["phase"] if snapshot["finished"] else "progress"
+        yield f"event: {event}\ndata: {json.dumps(snapshot, ensure_ascii=False)}\n\n"
+        if snapshot["finished"]:
+            return
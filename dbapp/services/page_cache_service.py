@@ -0,0 +1,102 @@
+# 練習問題ページのHTTP条件付きキャッシュ
+#   問題データのバージョン（`PRAGMA user_version`）からETag・Last-Modifiedを作り、
+#   ブラウザのキャッシュが最新なら`304 Not Modified`を返す
+#   描画済みのHTML断片も、バージョンをキーにしてメモリに置いておく
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+from flask import request
+
+class FragmentCache:
+    """ 描画済みのHTML断片を問題データのバージョンごとに持っておく（LRU）
+        新しいバージョンが来たら、古いバージョンの断片はまとめて捨てる
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._version: Optional[int] = None
+        self._entries: "OrderedDict[Hashable, str]" = OrderedDict()
+
+        # 統計情報
+        self._hits = 0
+        self._misses = 0
+
+    def get_or_render(self, version: int, key: Hashable, render: Callable[[], str]) -> str:
+        """ `key`の断片を返す（なければ`render()`で描画して保存する）
+        """
+        with self._lock:
+            if version != self._version:
+                self._entries.clear()
+                self._version = version
+            html = self._entries.get(key)
+            if html is not None:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return html
+            self._misses += 1
+
+        # 描画はロックの外で行う（同じ断片を2回描画することがあっても結果は同じ）
+        html = render()
+        with self._lock:
+            if version == self._version:
+                self._entries[key] = html
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return html
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._version = None
+
+    def stats(self) -> Dict[str, Any]:
+        """ 統計情報（バージョン・件数・ヒット率）
+        """
+        with self._lock:
+            total = self._hits + self._misses
+            return {
+                "version": self._version,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": self._hits / total if total else None,
+            }
+
+def make_etag(*parts: Any) -> str:
+    """ `parts`（JSONにできる値）から強いETagの値を作る
+        services/page_cache_service
+    """
+    payload = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32]
+
+def is_not_modified(etag: str, last_modified: Optional[float]=None) -> bool:
+    """ リクエストの`If-None-Match` / `If-Modified-Since`から、キャッシュが最新か判定する
+        `If-None-Match`があればそちらだけで判定する（RFC 9110）
+        セッションで中身が変わるページは`last_modified`にNoneを渡し、ETagだけで判定すること
+        services/page_cache_service
+    """
+    if request.if_none_match:
+        return request.if_none_match.contains(etag)
+    if last_modified is not None and request.if_modified_since is not None:
+        return int(last_modified) <= request.if_modified_since.timestamp()
+    return False
+
+def template_fingerprint(template_dir: str) -> str:
+    """ テンプレートの更新時刻とサイズから作る指紋
+        テンプレートを差し替えたら（再起動後の）ETagが変わるように、ETagに混ぜて使う
+        services/page_cache_service
+    """
+    entries = []
+    for root, _, files in os.walk(template_dir):
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            stat = os.stat(path)
+            entries.append((os.path.relpath(path, template_dir), int(stat.st_mtime), stat.st_size))
+    return make_etag(sorted(entries))
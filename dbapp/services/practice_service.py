@@ -1,24 +1,56 @@
+from dbapp import timing
 from dbapp.db import queries as dbq
 from dbapp.db import import_from_excel as db_excel
-from typing import Tuple, List, Dict, Any, Sequence, Literal, Optional
+from typing import Tuple, List, Dict, Any, Iterator, Sequence, Literal, Optional, Callable
+from concurrent.futures import ThreadPoolExecutor, FIRST_EXCEPTION, wait
+from contextlib import contextmanager, nullcontext
+from queue import Full, Queue
+import threading
 
 from dbapp.db.exceptions import (
     DatabaseExecutionError, 
     QuerySyntaxError, 
-    QueryRuntimeError
+    QueryRuntimeError, 
+    QueryTimeoutError
 )
 
 import pyodbc
 from .query_compare.messages import CompareResult
+from dbapp.config import JUDGE_MAX_WORKERS, MAX_RESULT_ROWS, QUERY_TIMEOUT
+from dbapp.services.answer_digest_service import AnswerDigest, get_fresh_digest
+from dbapp.services.query_service import excel_timeout
+from dbapp.services.slow_query_service import SlowQueryWatch, watch_query
+
+# ユーザークエリと正解クエリを並行実行するためのワーカー
+_judge_executor = ThreadPoolExecutor(
+    max_workers=JUDGE_MAX_WORKERS, 
+    thread_name_prefix="judge"
+)
+# 結果セットを読むワーカーと比べる側の間にためておく、行のまとまりの数
+JUDGE_STREAM_QUEUE_SIZE = 4
 
 def compare_queries(
     user_query: str, 
     answer_query: str, 
     check_mode: Literal["strict", "loose", "custom"] = "strict", 
     rule: Optional[dict] = None, 
-    use_excel: bool=False
+    use_excel: bool=False, 
+    deadline: Optional[dbq.Deadline] = None, 
+    cancellers: Optional[Tuple[dbq.QueryCanceller, dbq.QueryCanceller]] = None, 
+    on_rows: Optional[Callable[[int], None]] = None, 
+    question_key: Optional[Tuple[int, int, int]] = None
 ) -> Tuple[bool, CompareResult, str, dict[str, Any], List[str], List[pyodbc.Row], List[str], List[pyodbc.Row]]:
     """ 2つのクエリを受け取って結果を比較する
+        `deadline`はユーザークエリ・正解クエリの両方に共通の実行期限
+        （省略時は`QUERY_TIMEOUT`秒）
+        `cancellers`は(ユーザークエリ用, 正解クエリ用)のQueryCanceller
+        （外から中断したいときに渡す）、`on_rows`は読んだ行数を知らせるコールバック
+        ユーザークエリが遅ければ、`question_key`（章・節・問題番号）と一緒に記録する
+        `question_key`の正解の要約（services/answer_digest_service）が計算済みなら、
+        正解クエリは差分を見せるときだけ流す
+        'strict'モードでは両方の結果セットを`fetchmany()`のまとまりごとに読みながら比べ、
+        返す行（画面表示用）はそれぞれ先頭の`MAX_RESULT_ROWS`行だけ
+        （'loose'/'custom'モードの比較器は全件を使うので、全件読む）
         Returns:
         result(bool): 正解 / 不正解
         message(str): エラーメッセージ（成功時は空）
@@ -37,6 +69,10 @@ def compare_queries(
     # そもそもクエリがおかしかったらreturn
     query_role_user = "ユーザー投稿クエリ"
     query_role_answer = "正解クエリ"
+    # 計測値（`/metrics`のヒストグラム）はチェックモードごとに分ける
+    timing.set_label("check_mode", check_mode)
+    if deadline is None:
+        deadline = dbq.Deadline(QUERY_TIMEOUT)
     try:
         cleansed_query = dbq.sanitize_and_validate_sql(sql_query=user_query, allowed_start=("SELECT", "WITH"))
     except ValueError as e:
@@ -48,17 +84,66 @@ def compare_queries(
     #   -> 例外発生時はキャッチしてRuntimeErrorをスロー
     #   -> 例外発生時、`result_enum`は`None`のままで良い
 
-    # 踏み台Excel使用時
+    # ユーザークエリの実行時間を測る（遅ければ記録する）
+    user_watch = watch_query(cleansed_query, source="judge", question_key=question_key)
+
+    # 正解の要約（行そのもの、または'strict'モードなら要約だけでも使える）
+    answer_digest = None
+    if question_key is not None and not use_excel:
+        answer_digest = get_fresh_digest(question_key, answer_query)
+        if answer_digest is not None and answer_digest.rows is None and check_mode != "strict":
+            answer_digest = None
+
+    # 踏み台Excel使用時（正解クエリと1回で流すので、両方の合計を測る）
     if use_excel:
         try: 
-            user_columns, user_rows, answer_columns, answer_rows = db_excel.fetch_both_with_single_excel(user_query=cleansed_query, answer_query=answer_query, timeout=30)
+            with timing.phase("excel"), user_watch:
+                user_columns, user_rows, answer_columns, answer_rows = db_excel.fetch_both_with_single_excel(user_query=cleansed_query, answer_query=answer_query, timeout=excel_timeout(deadline))
+                user_watch.rows = len(user_rows)
+            timing.add_rows(len(user_rows) + len(answer_rows))
         except RuntimeError as e:
             return False, result_enum, str(e), {}, user_columns, user_rows, answer_columns, answer_rows
+    # 'strict'モード（読みながら比べる）
+    elif check_mode == "strict":
+        try:
+            result_enum, detail, (user_columns, user_rows), (answer_columns, answer_rows) = _judge_strict_streaming(
+                user_query=cleansed_query, 
+                answer_query=answer_query, 
+                answer_digest=answer_digest, 
+                role_user=query_role_user, 
+                role_answer=query_role_answer, 
+                deadline=deadline, 
+                cancellers=cancellers, 
+                on_rows=on_rows, 
+                user_watch=user_watch
+            )
+        except RuntimeError as e:
+            return False, result_enum, str(e), {}, user_columns, user_rows, answer_columns, answer_rows
+        result = (result_enum == CompareResult.OK)
+        return result, result_enum, COMPARE_RESULT_MESSAGES[result_enum], detail, user_columns, user_rows, answer_columns, answer_rows
+    # 正解の行そのものがあるとき（正解クエリは流さない）
+    elif answer_digest is not None:
+        try:
+            user_columns, user_rows = _safe_fetch_all(
+                query=cleansed_query, role=query_role_user, 
+                canceller=cancellers[0] if cancellers else None, deadline=deadline, 
+                on_rows=on_rows, scope="user", watch=user_watch)
+        except RuntimeError as e:
+            return False, result_enum, str(e), {}, user_columns, user_rows, answer_columns, answer_rows
+        answer_columns, answer_rows = answer_digest.columns, answer_digest.rows
     # 通常時
     else:
         try:
-            user_columns, user_rows = _safe_fetch_all(query=cleansed_query, role=query_role_user, params=None, use_excel=use_excel)
-            answer_columns, answer_rows = _safe_fetch_all(query=answer_query, role=query_role_answer, params=None, use_excel=use_excel)
+            (user_columns, user_rows), (answer_columns, answer_rows) = _fetch_both_concurrently(
+                user_query=cleansed_query, 
+                answer_query=answer_query, 
+                role_user=query_role_user, 
+                role_answer=query_role_answer, 
+                deadline=deadline, 
+                cancellers=cancellers, 
+                on_rows=on_rows, 
+                user_watch=user_watch
+            )
         except RuntimeError as e:
             return False, result_enum, str(e), {}, user_columns, user_rows, answer_columns, answer_rows
     
@@ -66,20 +151,327 @@ def compare_queries(
     user_result = (user_columns, user_rows)
     answer_result = (answer_columns, answer_rows)
 
-    if check_mode == "strict":
-        result, result_enum, message, detail = _compare_result_strict(
-            user_result=user_result, 
-            answer_result=answer_result
-        )
-    elif check_mode == "loose":
-        pass
-    else:
-        pass
+    with timing.phase("compare"):
+        if check_mode == "strict":
+            result, result_enum, message, detail = _compare_result_strict(
+                user_result=user_result, 
+                answer_result=answer_result
+            )
+        else:
+            # "loose"と"custom"はlooseの比較器で判定する
+            # "custom"のときは`rule`で比べる桁数を指定できる
+            decimals = (rule or {}).get("decimals", LOOSE_COMPARE_DECIMALS)
+            result, result_enum, message, detail = _compare_result_loose(
+                user_result=user_result, 
+                answer_result=answer_result, 
+                decimals=decimals
+            )
     return result, result_enum, message, detail, user_columns, user_rows, answer_columns, answer_rows
 
-def _safe_fetch_all(query: str, role: str, params: Optional[Sequence[Any]]=None, use_excel=False) -> Tuple[List[str], List[pyodbc.Row]]:
+def _fetch_both_concurrently(
+        user_query: str, 
+        answer_query: str, 
+        role_user: str, 
+        role_answer: str, 
+        deadline: Optional[dbq.Deadline] = None, 
+        cancellers: Optional[Tuple[dbq.QueryCanceller, dbq.QueryCanceller]] = None, 
+        on_rows: Optional[Callable[[int], None]] = None, 
+        user_watch: Optional[SlowQueryWatch] = None
+        ) -> Tuple[Tuple[List[str], List[pyodbc.Row]], Tuple[List[str], List[pyodbc.Row]]]:
+    """ ユーザークエリと正解クエリを並行して実行し、両方の結果を返す
+        どちらかが失敗したら、もう片方はすぐに中断して
+        失敗した側の役割名つきのRuntimeErrorをスローする
+        （そのときすでに両方失敗していたら、ユーザークエリの側）
+        期限（`deadline`）は両方のクエリに共通
+        `user_watch`を渡すと、ユーザークエリの実行時間を測る
+    """
+    if cancellers is None:
+        cancellers = (dbq.QueryCanceller(), dbq.QueryCanceller())
+    user_canceller, answer_canceller = cancellers
+    # ワーカーにも計測を引き継ぐ（並行して流すので、段階名は`user.` / `answer.`で分ける）
+    user_future = _judge_executor.submit(
+        timing.wrap(_safe_fetch_all), query=user_query, role=role_user, 
+        canceller=user_canceller, deadline=deadline, on_rows=on_rows, scope="user", watch=user_watch)
+    answer_future = _judge_executor.submit(
+        timing.wrap(_safe_fetch_all), query=answer_query, role=role_answer, 
+        canceller=answer_canceller, deadline=deadline, on_rows=on_rows, scope="answer")
+
+    wait([user_future, answer_future], return_when=FIRST_EXCEPTION)
+    # 失敗した側を探す（両方成功ならNone、両方失敗していたらユーザークエリの側）
+    failed = next((f for f in (user_future, answer_future) if f.done() and f.exception() is not None), None)
+    if failed is not None:
+        # 相方はまだ始まっていなければ取り消し、実行中なら中断
+        for future, canceller in ((user_future, user_canceller), (answer_future, answer_canceller)):
+            if future is not failed:
+                future.cancel()
+                canceller.cancel()
+        raise failed.exception()
+
+    return user_future.result(), answer_future.result()
+
+def _judge_strict_streaming(
+        user_query: str, 
+        answer_query: str, 
+        answer_digest: Optional[AnswerDigest], 
+        role_user: str, 
+        role_answer: str, 
+        deadline: Optional[dbq.Deadline] = None, 
+        cancellers: Optional[Tuple[dbq.QueryCanceller, dbq.QueryCanceller]] = None, 
+        on_rows: Optional[Callable[[int], None]] = None, 
+        user_watch: Optional[SlowQueryWatch] = None
+        ) -> Tuple[CompareResult, Dict[str, Any], Tuple[List[str], List[Any]], Tuple[List[str], List[Any]]]:
+    """ 'strict'モードで判定する（結果セットを`fetchmany()`のまとまりごとに読みながら比べる）
+        ユーザークエリと正解クエリはそれぞれワーカーで並行して流し、このスレッドで比べる
+        列が食い違ったら、表示用の行を読んだところで両方を中断する
+        表示用に残すのは、それぞれ先頭の`MAX_RESULT_ROWS`行だけ（全件は持たない）
+        `answer_digest`（正解の要約）があるとき
+          - 行そのものがあれば、正解クエリは流さずにそれと比べる
+          - 要約だけなら、ユーザークエリだけを流して要約と比べ、一致すれば正解
+            食い違ったら、正解クエリを流して比べる
+            （ユーザークエリの結果が表示用の行数に収まらなければ、ユーザークエリも流し直す）
+        CompareResult, detail, (ユーザーの列名, 行), (正解の列名, 行) を返す
+        失敗したら、もう片方はすぐに中断して、失敗した側の役割名つきのRuntimeErrorをスローする
+        （中断させたのではなく両方失敗したら、ユーザークエリの側）
+    """
+    # NumPyを読み込むので、使うときまでimportしない
+    from .query_compare.strict import ResultDigest, compare_strict_stream
+
+    if cancellers is None:
+        cancellers = (dbq.QueryCanceller(), dbq.QueryCanceller())
+    user_canceller, answer_canceller = cancellers
+    user_source = answer_source = None
+    if answer_digest is not None and answer_digest.rows is not None:
+        answer_source = _StoredRows(answer_digest.columns, answer_digest.rows)
+    elif answer_digest is not None:
+        user_digest = ResultDigest()
+        with _start_stream(user_query, role_user, user_canceller, deadline, on_rows, "user", user_watch) as stream:
+            columns = stream.read_columns()
+            for chunk in stream.chunks():
+                user_digest.add_many(chunk)
+        user_result = (columns, stream.rows)
+        with timing.phase("compare"):
+            if answer_digest.matches(columns, user_digest):
+                return CompareResult.OK, {}, user_result, user_result
+        if stream.complete:
+            user_source = _StoredRows(*user_result)
+        else:
+            # 流し直す分は、遅いクエリとして重ねて記録しない
+            user_watch = None
+
+    # 先に失敗した方が、もう片方を中断する
+    failures = _StreamFailures(user=user_canceller, answer=answer_canceller)
+    if user_source is None:
+        user_source = _start_stream(user_query, role_user, user_canceller, deadline, on_rows, "user", user_watch, failures)
+    if answer_source is None:
+        answer_source = _start_stream(answer_query, role_answer, answer_canceller, deadline, on_rows, "answer", failures=failures)
+    with user_source, answer_source:
+        try:
+            user_columns = user_source.read_columns()
+            answer_columns = answer_source.read_columns()
+            # 読むのと比べるのを交互に行うので、`compare`には結果セットを待つ時間も入る
+            with timing.phase("compare"):
+                result_enum, detail = compare_strict_stream(
+                    user_columns=user_columns, 
+                    user_chunks=user_source.chunks(), 
+                    answer_columns=answer_columns, 
+                    answer_chunks=answer_source.chunks()
+                )
+            # 途中でやめたとき（列の食い違い）も、表示用の行だけは読んでおく
+            user_source.fill_display()
+            answer_source.fill_display()
+        except Exception as e:
+            # 相方の失敗で中断させられた側の例外なら、相方の例外を知らせる
+            raise failures.error() or e
+    return result_enum, detail, (user_columns, user_source.rows), (answer_columns, answer_source.rows)
+
+class _StoredRows:
+    """ 手元にある結果セット（`_RowStream`と同じ形で読む）
+    """
+
+    def __init__(self, columns: List[str], rows: List[Any]):
+        self.columns = columns
+        self.rows = rows[:MAX_RESULT_ROWS]
+        self._all_rows = rows
+
+    def read_columns(self) -> List[str]:
+        return self.columns
+
+    def chunks(self) -> Iterator[List[Any]]:
+        if self._all_rows:
+            yield self._all_rows
+
+    def fill_display(self) -> None:
+        pass
+
+    def __enter__(self) -> "_StoredRows":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        return False
+
+class _StreamFailures:
+    """ 並行して流すクエリの失敗を覚える
+        失敗したら、ほかのクエリはすぐに中断する
+        中断させられて失敗したものは覚えない（知らせるのは、先に失敗した方）
+    """
+
+    def __init__(self, **cancellers: dbq.QueryCanceller):
+        self._lock = threading.Lock()
+        # 段階名（`user` / `answer`）-> キャンセラー
+        self._cancellers = cancellers
+        self._errors: Dict[str, BaseException] = {}
+
+    def fail(self, scope: str, error: BaseException) -> None:
+        with self._lock:
+            if self._cancellers[scope].cancelled:
+                return
+            self._errors[scope] = error
+        for other, canceller in self._cancellers.items():
+            if other != scope:
+                canceller.cancel()
+
+    def error(self) -> Optional[BaseException]:
+        """ 知らせる例外（なければNone、両方あればユーザークエリの側）
+        """
+        with self._lock:
+            return self._errors.get("user") or self._errors.get("answer")
+
+class _RowStream:
+    """ ワーカーで流しているクエリの結果セットを、まとまりごとに受け取る
+        ワーカーは列名・行のまとまり・終わりの印（または例外）を順にキューに入れ、
+        比べる側は`read_columns()`・`chunks()`で順に取り出す
+        キューの大きさは`JUDGE_STREAM_QUEUE_SIZE`まで（比べる側が遅ければ、ワーカーが待つ）
+        先頭の`MAX_RESULT_ROWS`行だけを表示用に`rows`に残す
+        `with`を抜けると、読み終わっていなければワーカーを止めてクエリを中断する
+    """
+    _END = object()
+
+    def __init__(self, canceller: dbq.QueryCanceller):
+        self._queue: Queue = Queue(maxsize=JUDGE_STREAM_QUEUE_SIZE)
+        self._stopped = threading.Event()
+        self._canceller = canceller
+        self._finished = False
+        self.columns: Optional[List[str]] = None
+        self.rows: List[Any] = []
+        self.count = 0
+
+    @property
+    def complete(self) -> bool:
+        """ 最後まで読み、全部の行が`rows`に残っているか
+        """
+        return self._finished and self.count == len(self.rows)
+
+    @property
+    def stopped(self) -> bool:
+        return self._stopped.is_set()
+
+    # ワーカー側
+    def put(self, item: Any) -> bool:
+        """ キューに入れる（比べる側がやめていたらFalse）
+        """
+        while not self._stopped.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except Full:
+                continue
+        return False
+
+    def put_end(self) -> bool:
+        return self.put(self._END)
+
+    # 比べる側
+    def _get(self) -> Any:
+        item = self._queue.get()
+        if isinstance(item, BaseException):
+            self._finished = True
+            raise item
+        return item
+
+    def read_columns(self) -> List[str]:
+        if self.columns is None:
+            self.columns = self._get()
+        return self.columns
+
+    def chunks(self) -> Iterator[List[Any]]:
+        while not self._finished:
+            chunk = self._get()
+            if chunk is self._END:
+                self._finished = True
+                return
+            self.count += len(chunk)
+            keep = MAX_RESULT_ROWS - len(self.rows)
+            if keep > 0:
+                self.rows.extend(chunk[:keep])
+            yield chunk
+
+    def fill_display(self) -> None:
+        """ 表示用の行がそろうまで読む（それより先は読まない）
+        """
+        if len(self.rows) >= MAX_RESULT_ROWS:
+            return
+        for _ in self.chunks():
+            if len(self.rows) >= MAX_RESULT_ROWS:
+                return
+
+    def __enter__(self) -> "_RowStream":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        self._stopped.set()
+        if not self._finished:
+            self._canceller.cancel()
+        return False
+
+def _start_stream(query: str, role: str, canceller: dbq.QueryCanceller, deadline: Optional[dbq.Deadline], on_rows: Optional[Callable[[int], None]], scope: str, watch: Optional[SlowQueryWatch]=None, failures: Optional[_StreamFailures]=None) -> _RowStream:
+    # ワーカーにも計測を引き継ぐ（並行して流すので、段階名は`user.` / `answer.`で分ける）
+    stream = _RowStream(canceller)
+    _judge_executor.submit(
+        timing.wrap(_produce_rows), stream=stream, query=query, role=role, 
+        canceller=canceller, deadline=deadline, on_rows=on_rows, scope=scope, watch=watch, failures=failures)
+    return stream
+
+def _produce_rows(stream: _RowStream, query: str, role: str, canceller: dbq.QueryCanceller, deadline: Optional[dbq.Deadline], on_rows: Optional[Callable[[int], None]], scope: str, watch: Optional[SlowQueryWatch], failures: Optional[_StreamFailures]) -> None:
+    # ワーカーで動く: クエリを流し、列名と行のまとまりを`stream`に入れる
+    if stream.stopped:
+        return
+    try:
+        count = 0
+        with timing.scope(scope), watch or nullcontext(), _role_errors(role):
+            with dbq.stream_rows(query, canceller=canceller, deadline=deadline) as (columns, chunks), timing.phase("fetch"):
+                if not stream.put(columns):
+                    return
+                for chunk in chunks:
+                    count += len(chunk)
+                    if on_rows is not None:
+                        on_rows(len(chunk))
+                    # 比べる側がやめた -> `with`を抜けてコネクションを返す
+                    if not stream.put(chunk):
+                        return
+            timing.add_rows(count)
+            if watch is not None:
+                watch.rows = count
+        stream.put_end()
+    except BaseException as e:
+        # 比べる側が受け取る前に、相方を中断する
+        if failures is not None:
+            failures.fail(scope, e)
+        stream.put(e)
+
+def _safe_fetch_all(query: str, role: str, params: Optional[Sequence[Any]]=None, use_excel=False, canceller: Optional[dbq.QueryCanceller]=None, deadline: Optional[dbq.Deadline]=None, on_rows: Optional[Callable[[int], None]]=None, scope: str="", watch: Optional[SlowQueryWatch]=None) -> Tuple[List[str], List[pyodbc.Row]]:
+    with timing.scope(scope) if scope else nullcontext(), watch or nullcontext(), _role_errors(role):
+        columns, rows = dbq.fetch_all(query=query, params=params, canceller=canceller, deadline=deadline, on_rows=on_rows)
+        if watch is not None:
+            watch.rows = len(rows)
+        return columns, rows
+
+@contextmanager
+def _role_errors(role: str) -> Iterator[None]:
+    # DBの例外を、役割名（ユーザー投稿クエリ / 正解クエリ）つきのRuntimeErrorにする
     try:
-        return dbq.fetch_all(query=query, params=params)
+        yield
+    except QueryTimeoutError as e:
+        raise RuntimeError(f"{role}（タイムアウト）: {e}") from e
     except QuerySyntaxError as e:
         raise RuntimeError(f"{role}（SQL構文エラー）: {e}") from e
     except QueryRuntimeError as e:
@@ -91,14 +483,30 @@ from .query_compare.messages import (
     CompareResult, 
     COMPARE_RESULT_MESSAGES
 )
-from .query_compare.strict import compare_strict
+from dbapp.config import LOOSE_COMPARE_DECIMALS
+
+# 比較処理（`query_compare.strict` / `loose`）はNumPyを読み込むので、
+# 起動を軽くするため、最初に判定するときまでimportしない
 
 def _compare_result_strict(
         user_result: Tuple[List[str], List[pyodbc.Row]], 
         answer_result: Tuple[List[str], List[pyodbc.Row]]
         ) -> Tuple[bool, str, Dict[str, Any]]:
+    from .query_compare.strict import compare_strict
     result_enum, detail = compare_strict(user_result=user_result, answer_result=answer_result)
     message = COMPARE_RESULT_MESSAGES[result_enum]
 
     result = (result_enum == CompareResult.OK)
-    return result, result_enum, message, detail
\ No newline at end of file
+    return result, result_enum, message, detail
+
+def _compare_result_loose(
+        user_result: Tuple[List[str], List[pyodbc.Row]], 
+        answer_result: Tuple[List[str], List[pyodbc.Row]], 
+        decimals: int = LOOSE_COMPARE_DECIMALS
+        ) -> Tuple[bool, str, Dict[str, Any]]:
+    from .query_compare.loose import compare_loose
+    result_enum, detail = compare_loose(user_result=user_result, answer_result=answer_result, decimals=decimals)
+    message = COMPARE_RESULT_MESSAGES[result_enum]
+
+    result = (result_enum == CompareResult.OK)
+    return result, result_enum, message, detail
@@ -0,0 +1,220 @@
+from typing import List, Tuple, Dict, Any, Sequence
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+import numpy as np
+import pyodbc
+
+from .messages import CompareResult
+
+# 不一致の例として返す行数
+SAMPLE_ROWS = 3
+
+# 数値として比較する型
+_NUMBER_TYPES = {int, float, Decimal, bool}
+_INTEGER_TYPES = {int, bool}
+
+def compare_loose(
+    user_result: Tuple[List[str], List[pyodbc.Row]],
+    answer_result: Tuple[List[str], List[pyodbc.Row]],
+    decimals: int = 2
+) -> Tuple[CompareResult, Dict[str, Any]]:
+    """ 'loose'モードでの比較
+        - 行の順序は問わない
+        - 列名（別名）は問わない（列の並びと数は見る）
+        - 数値はDecimal/float/intを区別せず、差が`decimals`桁目の半分以下なら一致とする
+          （整数だけの列は、丸めずに整数として比較）
+        - 日時は文字列表現に揃え、NULLはNULL同士でのみ一致とする
+        差分を調べ、CompareResultとdetail（dict）で返す
+    """
+    user_columns, user_rows = user_result
+    answer_columns, answer_rows = answer_result
+
+    # 列数チェック
+    if len(user_columns) != len(answer_columns):
+        return CompareResult.COLUMN_COUNT_MISMATCH, {
+            "user_columns": user_columns,
+            "answer_columns": answer_columns,
+        }
+
+    n_user = len(user_rows)
+    n_answer = len(answer_rows)
+    if n_user == 0 and n_answer == 0:
+        return CompareResult.OK, {}
+
+    # 両方の結果セットをまとめて列ごとの整数コードに変換し、
+    # 1行 = 整数の並び としてまとめて扱う
+    codes = _encode_rows(list(user_rows) + list(answer_rows), len(user_columns), decimals)
+
+    # 同じ内容の行に同じ番号を振り、ユーザー側・正解側それぞれで数える
+    row_ids = _row_ids(codes)
+    n_kinds = int(row_ids.max()) + 1
+    user_counts = np.bincount(row_ids[:n_user], minlength=n_kinds)
+    answer_counts = np.bincount(row_ids[n_user:], minlength=n_kinds)
+
+    diff = user_counts - answer_counts
+    if not diff.any():
+        # 多重集合として一致 -> 正解
+        return CompareResult.OK, {}
+
+    extra_kinds = np.flatnonzero(diff > 0)
+    missing_kinds = np.flatnonzero(diff < 0)
+    extra = _sample_rows(user_rows, row_ids[:n_user], extra_kinds)
+    missing = _sample_rows(answer_rows, row_ids[n_user:], missing_kinds)
+    detail = {
+        "user_rows": n_user,
+        "answer_rows": n_answer,
+        "missing": missing,
+        "extra": extra,
+        "missing_count": int(-diff[missing_kinds].sum()),
+        "extra_count": int(diff[extra_kinds].sum()),
+    }
+
+    if n_user != n_answer:
+        # 正解の行はすべて含んでいるが、余分な行がある
+        if len(missing_kinds) == 0:
+            return CompareResult.USER_HAS_EXTRA_ROWS, detail
+        # 余分な行はないが、正解の行が足りない
+        if len(extra_kinds) == 0:
+            return CompareResult.USER_MISSING_ROWS, detail
+        return CompareResult.ROW_COUNT_MISMATCH, detail
+
+    return CompareResult.ROW_CONTENT_MISMATCH, detail
+
+def _row_ids(codes: np.ndarray) -> np.ndarray:
+    """ 同じ内容の行に同じ番号（0始まり）を振る
+        列ごとのコードの種類数の積が収まるなら、1つの整数キーにまとめて1次元でuniqueする
+    """
+    n_rows, n_columns = codes.shape
+    if n_columns == 0:
+        return np.zeros(n_rows, dtype=np.int64)
+
+    # NULL（-1）を0にずらす
+    shifted = codes + 1
+    radixes = shifted.max(axis=0) + 1
+    if float(np.prod(radixes.astype(np.float64))) < 2.0 ** 62:
+        keys = np.zeros(n_rows, dtype=np.int64)
+        for j in range(n_columns):
+            keys = keys * radixes[j] + shifted[:, j]
+        _, row_ids = np.unique(keys, return_inverse=True)
+    else:
+        _, row_ids = np.unique(codes, axis=0, return_inverse=True)
+    return row_ids.reshape(-1)
+
+def _encode_rows(rows: Sequence[Sequence[Any]], n_columns: int, decimals: int) -> np.ndarray:
+    """ 行のリストを、列ごとに正規化した値の整数コードの2次元配列にする
+        同じ列で同じ値なら同じコード、NULLは-1
+    """
+    codes = np.empty((len(rows), n_columns), dtype=np.int64)
+    if not rows:
+        return codes
+    # 行の並びを列の並びに組み替える
+    for j, column in enumerate(zip(*rows)):
+        codes[:, j] = _encode_column(column, decimals)
+    return codes
+
+def _encode_column(values: Sequence[Any], decimals: int) -> np.ndarray:
+    """ 1列分の値を整数コードの配列にする
+        全部が数値（またはNULL）なら数値として比較し、
+        そうでなければ正規化した文字列として比較する
+    """
+    is_null = np.fromiter((v is None for v in values), dtype=bool, count=len(values))
+    non_null = [v for v in values if v is not None]
+    codes = np.full(len(values), -1, dtype=np.int64)
+    if not non_null:
+        return codes
+
+    types = {type(v) for v in non_null}
+    if types <= _NUMBER_TYPES:
+        if decimals >= 0 and (types <= _INTEGER_TYPES or all(map(_is_integral, non_null))):
+            codes[~is_null] = _encode_integers(non_null)
+        else:
+            codes[~is_null] = _encode_numbers(
+                np.array(non_null, dtype=np.float64), 0.5 * 10.0 ** -decimals)
+    else:
+        codes[~is_null] = _encode_texts(non_null)
+    return codes
+
+def _is_integral(v: Any) -> bool:
+    if isinstance(v, (int, bool)):
+        return True
+    if isinstance(v, Decimal):
+        return v.is_finite() and v == v.to_integral_value()
+    return v.is_integer()
+
+def _encode_integers(values: List[Any]) -> np.ndarray:
+    """ 整数値だけの列を整数コードにする（floatにしないので、2**53を超える値も区別する）
+    """
+    integers = values if {type(v) for v in values} <= _INTEGER_TYPES else [int(v) for v in values]
+    try:
+        numbers = np.array(integers, dtype=np.int64)
+    except OverflowError:
+        # BIGINT UNSIGNEDなど、int64に収まらない値がある
+        seen: Dict[int, int] = {}
+        return np.array([seen.setdefault(v, len(seen)) for v in integers], dtype=np.int64)
+    _, inverse = np.unique(numbers, return_inverse=True)
+    return inverse.reshape(-1)
+
+def _encode_numbers(numbers: np.ndarray, tolerance: float) -> np.ndarray:
+    """ 数値を整数コードにする
+        小さい順に並べ、隣との差が`tolerance`以下の値を同じコードにまとめる
+        （丸めと違い、`0.0049999`と`0.0050001`のように丸めの境目をまたぐ値も一致する）
+    """
+    order = np.argsort(numbers, kind="stable")
+    ordered = numbers[order]
+    previous, current = ordered[:-1], ordered[1:]
+    with np.errstate(invalid="ignore"):
+        same = (
+            (current - previous <= tolerance)
+            # 同じ無限大どうし、NaNどうし
+            | (current == previous)
+            | (np.isnan(current) & np.isnan(previous))
+        )
+    codes = np.empty(len(numbers), dtype=np.int64)
+    codes[order] = np.concatenate(([0], np.cumsum(~same)))
+    return codes
+
+def _encode_texts(values: List[Any]) -> np.ndarray:
+    """ 数値以外の値をハッシュで整数コードにする
+        正規化は異なる値ごとに1回だけ行う
+    """
+    # 元の値 -> コード
+    seen: Dict[Any, int] = {}
+    # 正規化した文字列 -> コード
+    normalized: Dict[str, int] = {}
+    out = []
+    for v in values:
+        code = seen.get(v)
+        if code is None:
+            code = normalized.setdefault(_normalize_text(v), len(normalized))
+            seen[v] = code
+        out.append(code)
+    return np.array(out, dtype=np.int64)
+
+def _normalize_text(v: Any) -> str:
+    """ 数値以外の値を比較用の文字列にする
+    """
+    if isinstance(v, datetime):
+        return v.strftime("%Y-%m-%d %H:%M:%S")
+    if isinstance(v, date):
+        return v.strftime("%Y-%m-%d")
+    if isinstance(v, (time, timedelta)):
+        return str(v)
+    if isinstance(v, Decimal):
+        # 数値と文字列が混ざった列の中の数値
+        return format(v.normalize(), "f")
+    if isinstance(v, (bytes, bytearray)):
+        return v.hex()
+    return str(v)
+
+def _sample_rows(rows: Sequence[Sequence[Any]], row_ids: np.ndarray, kinds: np.ndarray) -> List[Tuple[Any, ...]]:
+    """ 指定した種類の行を、元の値のまま最大`SAMPLE_ROWS`件取り出す
+    """
+    samples = []
+    wanted = set(kinds[:SAMPLE_ROWS].tolist())
+    for row, kind in zip(rows, row_ids.tolist()):
+        if kind in wanted:
+            samples.append(tuple(row))
+            wanted.discard(kind)
+            if not wanted:
+                break
+    return samples
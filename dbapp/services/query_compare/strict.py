@@ -1,76 +1,332 @@
-from typing import List, Tuple, Dict, Any
+from typing import List, Tuple, Dict, Any, Callable, Iterable, Iterator, Optional, Sequence
 from enum import Enum
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+import hashlib
+import numpy as np
 import pyodbc
-from itertools import islice
+from itertools import islice, zip_longest
 
 from .messages import CompareResult, COMPARE_RESULT_MESSAGES
 
+# 比較時にまとめて取り出す行数
+CHUNK_SIZE = 1000
+# 不一致の例として返す行数
+SAMPLE_ROWS = 3
+# 不一致の例を探すために覚えておく行の種類数の上限
+MAX_PENDING_ROWS = 10000
+
+_MASK64 = (1 << 64) - 1
+
 def compare_strict(
-    user_result: Tuple[List[str], List[pyodbc.Row]], 
+    user_result: Tuple[List[str], List[pyodbc.Row]],
     answer_result: Tuple[List[str], List[pyodbc.Row]]
 ) -> Tuple[CompareResult, Dict[str, Any]]:
     """ 'strict'モードでの比較
         差分を調べ、CompareResultとdetail（dict）で返す
         dictは、不一致の詳細
+        （取得済みの結果セットを`compare_strict_stream()`に流す）
     """
     # ユーザが投稿したクエリ、正解クエリそれぞれの結果セットを取得
     user_columns, user_rows = user_result
     answer_columns, answer_rows = answer_result
+    return compare_strict_stream(
+        user_columns=user_columns,
+        user_chunks=_chunked(user_rows),
+        answer_columns=answer_columns,
+        answer_chunks=_chunked(answer_rows)
+    )
+
+def compare_strict_stream(
+    user_columns: List[str],
+    user_chunks: Iterable[Sequence[Any]],
+    answer_columns: List[str],
+    answer_chunks: Iterable[Sequence[Any]],
+    row_hash: Optional[Callable[[Tuple[Any, ...]], int]] = None
+) -> Tuple[CompareResult, Dict[str, Any]]:
+    """ 'strict'モードでの比較（結果セットを少しずつ読みながら比較する）
+        `*_chunks`は行のまとまりを順に返すもの（`cursor.fetchmany()`の繰り返しなど）
 
+        - 先頭から同じ位置の行どうしを比べ、最初に食い違った位置を覚える
+        - 食い違った後は順序の比較をやめ、行の多重集合ハッシュだけを更新する
+          （食い違う前の行は両方で同じなので、ハッシュに加えなくても多重集合の比較は変わらない）
+        - 最後に、行数 -> 順序 -> 中身 の順で結果を決める
+        ソートも全件の保持もしないので、メモリ使用量は結果セットの大きさによらない
+        `row_hash`の省略時は`stable_row_hash()`（`hash()`は`-1`と`-2`が同じ値になるので使わない）
+    """
     # 列数チェック
     if len(user_columns) != len(answer_columns):
         return CompareResult.COLUMN_COUNT_MISMATCH, {
-            "user_columns": user_columns, 
-            "answer_columns": answer_columns, 
+            "user_columns": user_columns,
+            "answer_columns": answer_columns,
         }
-    
+
     # 列名チェック
     if user_columns != answer_columns:
         return CompareResult.COLUMN_NAME_MISMATCH, {
-            "user_columns": user_columns, 
-            "answer_columns": answer_columns, 
+            "user_columns": user_columns,
+            "answer_columns": answer_columns,
         }
-    
+
+    # 食い違った後の行の多重集合ハッシュ
+    user_digest = MultisetDigest(row_hash)
+    answer_digest = MultisetDigest(row_hash)
+    # 食い違った後の行の差分（行 -> ユーザー側の個数 - 正解側の個数）
+    pending = _PendingDiff()
+    first_mismatch: Optional[int] = None
+    user_count = answer_count = 0
+
+    # 両方を同じ行数のまとまりに切り直して、まとまりごとに比べる
+    offset = 0
+    for user_chunk, answer_chunk in zip_longest(
+            _rechunk(user_chunks), _rechunk(answer_chunks), fillvalue=[]):
+        user_count += len(user_chunk)
+        answer_count += len(answer_chunk)
+
+        if first_mismatch is None:
+            if user_chunk == answer_chunk:
+                offset += len(user_chunk)
+                continue
+            # 最初の食い違いの位置を探す
+            start = _first_difference(user_chunk, answer_chunk)
+            first_mismatch = offset + start
+        else:
+            start = 0
+
+        user_rest, answer_rest = user_chunk[start:], answer_chunk[start:]
+        user_digest.add_many(user_rest)
+        answer_digest.add_many(answer_rest)
+        pending.add_many(user_rest, 1)
+        pending.add_many(answer_rest, -1)
+        offset += len(user_chunk)
+
     # 行数チェック
-    if len(user_rows) != len(answer_rows): 
+    if user_count != answer_count:
         return CompareResult.ROW_COUNT_MISMATCH, {
-            "user_rows": len(user_rows), 
-            "answer_rows": len(answer_rows), 
+            "user_rows": user_count,
+            "answer_rows": answer_count,
         }
-    
-    # 行の順序チェック
-    user_list = _rows_to_list(user_rows)
-    answer_list = _rows_to_list(answer_rows)
-
-    if user_list != answer_list:
-        # 順番違いであるかどうか判定
-        #   ソートしたら一致する -> 順番だけが違う
-        if sorted(user_list) == sorted(answer_list):
-            return CompareResult.ROW_ORDER_MISMATCH, {
-                "user_rows": user_list, 
-                "answer_rows": answer_list, 
-            }
-        else:
-            # 順番違いだけが原因ではない
-            #   -> 中身が異なる
-            # Setを用いて差分を取得
-            user_set = set(user_list)
-            answer_set = set(answer_list)
-            # 不足レコードと過剰レコード
-            missing = list(islice(answer_set - user_set, 3))
-            extra = list(islice(user_set - answer_set, 3))
-
-            return CompareResult.ROW_CONTENT_MISMATCH, {
-                "user_rows": user_list, 
-                "answer_rows": answer_list, 
-                "missing": missing, 
-                "extra": extra, 
-            }
-    
-    # ここまでたどり着いたら完全一致 -> 正解
-    return CompareResult.OK, {}
-
-def _rows_to_list(rows: List[pyodbc.Row]) -> List[Tuple[Any, ...]]:
-    """ pyodbc.Rowオブジェクトをタプルに変換して比較可能にする
+
+    # ここまでたどり着いて食い違いがなければ完全一致 -> 正解
+    if first_mismatch is None:
+        return CompareResult.OK, {}
+
+    # 行の多重集合が同じ -> 順番だけが違う
+    #   食い違った後の行を全部数えられていれば、ハッシュによらず差分の有無で決める
+    if pending.exact:
+        same_rows = pending.empty
+    else:
+        same_rows = user_digest == answer_digest
+    if same_rows:
+        return CompareResult.ROW_ORDER_MISMATCH, {
+            "user_rows": user_count,
+            "answer_rows": answer_count,
+            "first_mismatch": first_mismatch,
+        }
+
+    # 順番違いだけが原因ではない
+    #   -> 中身が異なる
+    # 不足レコードと過剰レコード
+    missing, extra = pending.samples(SAMPLE_ROWS)
+    return CompareResult.ROW_CONTENT_MISMATCH, {
+        "user_rows": user_count,
+        "answer_rows": answer_count,
+        "first_mismatch": first_mismatch,
+        "missing": missing,
+        "extra": extra,
+    }
+
+class MultisetDigest:
+    """ 行の並び順に依存しない結果セットのハッシュ
+        各行のハッシュを混ぜてから足し合わせる（足し算なので順序に依らない）
+        `None`を含む行や型の混ざった行でも、ソートせずに扱える
+        `row_hash`は符号付き64bitの範囲の整数を返すこと（省略時は`stable_row_hash()`）
     """
-    return [tuple(row) for row in rows]
\ No newline at end of file
+    __slots__ = ("_row_hash", "count", "_sum", "_mixed_sum")
+
+    def __init__(self, row_hash: Optional[Callable[[Tuple[Any, ...]], int]] = None):
+        self._row_hash = row_hash or stable_row_hash
+        self.count = 0
+        self._sum = 0
+        self._mixed_sum = 0
+
+    def add(self, row: Tuple[Any, ...]) -> None:
+        self.add_many([row])
+
+    def add_many(self, rows: Sequence[Tuple[Any, ...]]) -> None:
+        """ 行をまとめて加える
+            行ハッシュの混ぜ合わせと足し算はNumPyでまとめて行う（64bitで桁あふれさせる）
+        """
+        if not rows:
+            return
+        self.add_hashes(np.fromiter(map(self._row_hash, rows), dtype=np.int64, count=len(rows)))
+
+    def add_hashes(self, hashes: np.ndarray) -> None:
+        """ 計算済みの行ハッシュ（`int64`の配列）をまとめて加える
+        """
+        if not len(hashes):
+            return
+        count = len(hashes)
+        hashes = hashes.view(np.uint64)
+        with np.errstate(over="ignore"):
+            self._sum = (self._sum + int(hashes.sum(dtype=np.uint64))) & _MASK64
+            self._mixed_sum = (self._mixed_sum + int(_mix64(hashes).sum(dtype=np.uint64))) & _MASK64
+        self.count += count
+
+    def value(self) -> Tuple[int, int, int]:
+        return self.count, self._sum, self._mixed_sum
+
+    def hexdigest(self) -> str:
+        """ 保存用の文字列（`行数:和:混ぜた和`、和は16進）
+        """
+        return f"{self.count}:{self._sum:016x}:{self._mixed_sum:016x}"
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, MultisetDigest):
+            return NotImplemented
+        return self.value() == other.value()
+
+class ResultDigest:
+    """ 結果セットの要約（行数、順序つきのダイジェスト、順序によらない`MultisetDigest`）
+        行ハッシュは`stable_row_hash()`（プロセスをまたいでも同じ値）を使うので、
+        保存しておいて後で別のプロセスの結果セットと比べられる
+        `strict`モードで一致する結果セットどうしは、同じ要約になる
+    """
+    __slots__ = ("_ordered", "multiset")
+
+    def __init__(self):
+        self._ordered = hashlib.blake2b(digest_size=16)
+        self.multiset = MultisetDigest(stable_row_hash)
+
+    @property
+    def count(self) -> int:
+        return self.multiset.count
+
+    def add_many(self, rows: Sequence[Any]) -> None:
+        if not rows:
+            return
+        hashes = np.fromiter(
+            (stable_row_hash(tuple(row)) for row in rows), dtype=np.int64, count=len(rows))
+        self._ordered.update(hashes.tobytes())
+        self.multiset.add_hashes(hashes)
+
+    def ordered_hexdigest(self) -> str:
+        return self._ordered.hexdigest()
+
+    def multiset_hexdigest(self) -> str:
+        return self.multiset.hexdigest()
+
+def stable_row_hash(row: Tuple[Any, ...]) -> int:
+    """ 行のハッシュ（符号付き64bit）。`hash()`と違い、プロセスをまたいでも同じ値になる
+        `==`で等しい値（`1`・`1.0`・`Decimal("1.00")`など）は同じハッシュになるようにそろえる
+    """
+    text = "".join(_encode_value(value) for value in row)
+    return int.from_bytes(
+        hashlib.blake2b(text.encode("utf-8", "surrogatepass"), digest_size=8).digest(),
+        "little", signed=True)
+
+def _encode_value(value: Any) -> str:
+    # 型の印 + 長さ + 値（区切り文字を含む値でも取り違えない）
+    if value is None:
+        return "N;"
+    if isinstance(value, (bool, int)):
+        tag, text = "i", str(int(value))
+    elif isinstance(value, (float, Decimal)):
+        tag, text = _encode_number(value)
+    elif isinstance(value, str):
+        tag, text = "s", value
+    elif isinstance(value, datetime):
+        tag, text = "t", value.isoformat()
+    elif isinstance(value, date):
+        tag, text = "D", value.isoformat()
+    elif isinstance(value, time):
+        tag, text = "T", value.isoformat()
+    elif isinstance(value, timedelta):
+        tag, text = "S", repr(value.total_seconds())
+    elif isinstance(value, (bytes, bytearray, memoryview)):
+        tag, text = "b", bytes(value).hex()
+    else:
+        tag, text = "r", repr(value)
+    return f"{tag}{len(text)}:{text}"
+
+def _encode_number(value) -> Tuple[str, str]:
+    # 整数値は`int`と同じに、それ以外は正確な10進表記にそろえる
+    #   （`0.1`と`Decimal("0.1")`は`==`で等しくないので、別の表記になってよい）
+    decimal = value if isinstance(value, Decimal) else Decimal(value)
+    if not decimal.is_finite():
+        return "d", str(decimal)
+    if decimal == decimal.to_integral_value():
+        return "i", str(int(decimal))
+    return "d", str(decimal.normalize())
+
+class _PendingDiff:
+    """ 順序が食い違った後の行の出入りを数え、不一致の例を取り出す
+        覚える行の種類は`MAX_PENDING_ROWS`までで、超えた分は数えない
+        （そのときの判定は`MultisetDigest`で行い、例が欠けるだけ）
+    """
+    __slots__ = ("_counts", "exact")
+
+    def __init__(self):
+        self._counts: Dict[Tuple[Any, ...], int] = {}
+        # 全部の行を数えられているか
+        self.exact = True
+
+    @property
+    def empty(self) -> bool:
+        return not self._counts
+
+    def add_many(self, rows: Sequence[Tuple[Any, ...]], delta: int) -> None:
+        counts = self._counts
+        for row in rows:
+            count = counts.get(row)
+            if count is None:
+                if len(counts) >= MAX_PENDING_ROWS:
+                    self.exact = False
+                    continue
+                count = 0
+            count += delta
+            if count:
+                counts[row] = count
+            else:
+                del counts[row]
+
+    def samples(self, limit: int) -> Tuple[List[Tuple[Any, ...]], List[Tuple[Any, ...]]]:
+        missing = [row for row, count in self._counts.items() if count < 0]
+        extra = [row for row, count in self._counts.items() if count > 0]
+        return missing[:limit], extra[:limit]
+
+def _mix64(h: np.ndarray) -> np.ndarray:
+    """ 64bit整数の配列をかき混ぜる（splitmix64の仕上げ処理）
+    """
+    h = (h ^ (h >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    h = (h ^ (h >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return h ^ (h >> np.uint64(31))
+
+def _first_difference(user_chunk: List[Tuple[Any, ...]], answer_chunk: List[Tuple[Any, ...]]) -> int:
+    """ 2つのまとまりで最初に食い違う位置を返す
+    """
+    for i, (user_row, answer_row) in enumerate(zip(user_chunk, answer_chunk)):
+        if user_row != answer_row:
+            return i
+    return min(len(user_chunk), len(answer_chunk))
+
+def _rechunk(chunks: Iterable[Sequence[Any]], size: int = CHUNK_SIZE) -> Iterator[List[Tuple[Any, ...]]]:
+    """ 大きさがまちまちな行のまとまりを、`size`行ずつのタプルのリストに切り直す
+        （`pyodbc.Row`もここでタプルにする）
+    """
+    buffer: List[Tuple[Any, ...]] = []
+    for chunk in chunks:
+        buffer.extend(map(tuple, chunk))
+        while len(buffer) >= size:
+            yield buffer[:size]
+            del buffer[:size]
+    if buffer:
+        yield buffer
+
+def _chunked(rows: Sequence[Any], size: int = CHUNK_SIZE) -> Iterator[Sequence[Any]]:
+    it = iter(rows)
+    while True:
+        chunk = list(islice(it, size))
+        if not chunk:
+            return
+        yield chunk
@@ -1,37 +1,188 @@
+from typing import Callable, Optional
+
+from dbapp import timing
 from dbapp.db import queries as dbq
 from dbapp.db.import_from_excel import fetch_all_excel
 
+from dbapp.db.exceptions import QueryTimeoutError
+from dbapp.services.slow_query_service import watch_query
+from dbapp.services.result_cache_service import result_cache_key, get_cached_result, cache_result
+
 from dbapp.config import (
     FAILED_COLUMNS, 
     FAILED_ROWS, 
+    RESULT_PAGE_SIZE, 
+    MAX_RESULT_PAGE_SIZE, 
+    MAX_RESULT_ROWS, 
+    QUERY_TIMEOUT, 
 )
 
-def exec_query(sql_query: str, params=None, use_excel: bool=False):
+def exec_query(sql_query: str, params=None, use_excel: bool=False, deadline: Optional[dbq.Deadline]=None):
     """ SQLクエリを安全に実行し、
         (columns, rows, message, category)を返す
+        `deadline`を過ぎたら打ち切る（省略時は`QUERY_TIMEOUT`秒）
+        同じクエリの結果が結果キャッシュにあれば、実行せずにそれを返す
     """
     if params is None:
         params = ()
+    if deadline is None:
+        deadline = dbq.Deadline(QUERY_TIMEOUT)
     try:
         # 構文チェック & 無害化
         safe_query = dbq.sanitize_and_validate_sql(
             sql_query=sql_query, 
             allowed_start=("SELECT", "WITH")
         )
+
+        # 結果キャッシュにあれば実行しない
+        cache_key = result_cache_key(safe_query, params, ("all", ))
+        with timing.phase("cache"):
+            cached = get_cached_result(cache_key)
+        if cached is not None:
+            columns, rows = cached
+            timing.add_rows(len(rows))
+            return columns, list(rows), SUCCESS_MESSAGE, "success"
         
-        # データ取得
-        # Excelを踏み台にする
-        if use_excel:
-            columns, rows = fetch_all_excel(safe_query, params)
-        # 通常のDB接続
-        else:
-            columns, rows = dbq.fetch_all(safe_query, params)
+        # データ取得（遅ければ記録する）
+        with watch_query(safe_query, source="console") as watch:
+            # Excelを踏み台にする
+            if use_excel:
+                with timing.phase("excel"):
+                    columns, rows = fetch_all_excel(safe_query, params, timeout=excel_timeout(deadline))
+                timing.add_rows(len(rows))
+            # 通常のDB接続
+            else:
+                columns, rows = dbq.fetch_all(safe_query, params, deadline=deadline)
+            watch.rows = len(rows)
+        cache_result(cache_key, (columns, rows), columns, rows)
         
         # 成功メッセージ
-        return columns, rows, "クエリは正常に実行されました。", "success"
+        return columns, rows, SUCCESS_MESSAGE, "success"
     except ValueError as e:
         return [], [], f"( ´,_ゝ｀) < {e}", "error"
+    except QueryTimeoutError as e:
+        columns, rows = _timeout_result(e)
+        return columns, rows, TIMEOUT_MESSAGE, "error"
     except Exception as e:
         columns, rows = FAILED_COLUMNS, FAILED_ROWS.copy()
         rows.append(["原因はたぶん……", str(e)[:200] + "..."])
         return columns, rows, "( ´,_ゝ`) < クエリ実行に失敗しました。", "error"
+
+def exec_query_page(
+        sql_query: str, 
+        params=None, 
+        page: int=1, 
+        page_size: int=RESULT_PAGE_SIZE, 
+        max_rows: int=MAX_RESULT_ROWS, 
+        use_excel: bool=False, 
+        deadline: Optional[dbq.Deadline]=None, 
+        canceller: Optional[dbq.QueryCanceller]=None, 
+        on_rows: Optional[Callable[[int], None]]=None):
+    """ SQLクエリを安全に実行し、指定ページの行だけを取得する
+        (columns, rows, message, category, page_info)を返す
+        `page_info`は次のキーを持つdict
+            - page, page_size: 表示しているページと1ページの行数
+            - first_row, last_row: 表示している先頭・末尾の行の番号（1始まり、行がなければNone）
+            - has_prev, has_next: 前後のページがあるかどうか
+            - truncated: 上限（`row_cap`）より先に行があって表示しきれないかどうか
+            - total: 総行数（最後まで読めたときだけ。わからなければNone）
+        `deadline`を過ぎたら打ち切る（省略時は`QUERY_TIMEOUT`秒）
+        `canceller`・`on_rows`は`dbq.fetch_page()`に渡す（踏み台Excelのときは使わない）
+        同じクエリ・同じページの結果が結果キャッシュにあれば、実行せずにそれを返す
+    """
+    if params is None:
+        params = ()
+    if deadline is None:
+        deadline = dbq.Deadline(QUERY_TIMEOUT)
+    page = max(int(page), 1)
+    page_size = min(max(int(page_size), 1), MAX_RESULT_PAGE_SIZE)
+    offset = (page - 1) * page_size
+    try:
+        # 構文チェック & 無害化
+        safe_query = dbq.sanitize_and_validate_sql(
+            sql_query=sql_query, 
+            allowed_start=("SELECT", "WITH")
+        )
+
+        # 結果キャッシュにあれば実行しない
+        cache_key = result_cache_key(safe_query, params, ("page", page, page_size, max_rows))
+        with timing.phase("cache"):
+            cached = get_cached_result(cache_key)
+        if cached is not None:
+            columns, rows, page_info = cached
+            timing.add_rows(len(rows))
+            return columns, list(rows), SUCCESS_MESSAGE, "success", dict(page_info)
+
+        # データ取得（遅ければ記録する）
+        with watch_query(safe_query, source="console") as watch:
+            # Excelを踏み台にする -> 全件取得してから切り出す
+            if use_excel:
+                with timing.phase("excel"):
+                    columns, all_rows = fetch_all_excel(safe_query, params, timeout=excel_timeout(deadline))
+                limit = max(min(page_size, max_rows - offset), 0)
+                rows = all_rows[offset:offset + limit]
+                timing.add_rows(len(rows))
+                has_more = len(all_rows) > offset + limit
+            # 通常のDB接続 -> カーソルから必要な分だけ読む
+            else:
+                columns, rows, has_more = dbq.fetch_page(
+                    safe_query, params, page=page, page_size=page_size, max_rows=max_rows, 
+                    canceller=canceller, deadline=deadline, on_rows=on_rows)
+            watch.rows = len(rows)
+
+        reached_cap = offset + len(rows) >= max_rows
+        page_info = _page_info(
+            page=page, 
+            page_size=page_size, 
+            row_count=len(rows), 
+            has_next=has_more and not reached_cap, 
+            truncated=has_more and reached_cap, 
+            max_rows=max_rows
+        )
+        cache_result(cache_key, (columns, rows, page_info), columns, rows)
+        # 成功メッセージ
+        return columns, rows, SUCCESS_MESSAGE, "success", dict(page_info)
+    except ValueError as e:
+        return [], [], f"( ´,_ゝ｀) < {e}", "error", None
+    except QueryTimeoutError as e:
+        columns, rows = _timeout_result(e)
+        return columns, rows, TIMEOUT_MESSAGE, "error", None
+    except Exception as e:
+        columns, rows = FAILED_COLUMNS, FAILED_ROWS.copy()
+        rows.append(["原因はたぶん……", str(e)[:200] + "..."])
+        return columns, rows, "( ´,_ゝ`) < クエリ実行に失敗しました。", "error", None
+
+# 成功時のメッセージ
+SUCCESS_MESSAGE = "クエリは正常に実行されました。"
+# タイムアウト時のメッセージ
+TIMEOUT_MESSAGE = "( ´,_ゝ`) < クエリがタイムアウトしました。条件を見直してみてね。"
+
+def _timeout_result(e: QueryTimeoutError):
+    columns, rows = FAILED_COLUMNS, FAILED_ROWS.copy()
+    rows.append(["原因はたぶん……", str(e)])
+    return columns, rows
+
+def excel_timeout(deadline: dbq.Deadline) -> int:
+    """ 踏み台Excelのマクロに渡すタイムアウト（秒、1以上の整数）
+    """
+    return max(int(deadline.remaining()), 1)
+
+def _page_info(page: int, page_size: int, row_count: int, has_next: bool, truncated: bool, max_rows: int) -> dict:
+    offset = (page - 1) * page_size
+    # 続きがなければ、ここまでで全件 -> 総行数が確定する
+    # ただし、末尾より先のページ（2ページ目以降で行がない）では総行数はわからない
+    if has_next or truncated or (row_count == 0 and page > 1):
+        total = None
+    else:
+        total = offset + row_count
+    return {
+        "page": page, 
+        "page_size": page_size, 
+        "first_row": offset + 1 if row_count else None, 
+        "last_row": offset + row_count if row_count else None, 
+        "has_prev": page > 1, 
+        "has_next": has_next, 
+        "truncated": truncated, 
+        "row_cap": max_rows, 
+        "total": total, 
+    }
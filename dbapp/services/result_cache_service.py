@@ -0,0 +1,172 @@
+# SQLコンソールの結果キャッシュ
+#   練習用データセットは読み取り専用なので、同じクエリ（`dbq.normalize_sql()`でそろえたもの）は
+#   データセットが変わらない限り同じ結果になる -> 実行せずに前の結果を返す
+#   キーは (データセットのバージョン, 正規化したクエリ, パラメータ, 取り出し方)
+#   合計サイズ（おおよそのバイト数）が上限を超えたら、最近使っていないものから捨てる
+#   データセットを入れ替えたときは`invalidate_result_cache()`で全部捨てる
+#   次のクエリはキャッシュしない（キーがNone）
+#     - `NOW()`・`RAND()`など、実行するたびに結果が変わりうる関数を使うもの
+#     - MySQLで`.env`に`DATASET_VERSION`がないとき（データセットが変わってもわからないので）
+import os
+import sys
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Sequence, Tuple
+
+from dbapp.config import RESULT_CACHE_MAX_BYTES, RESULT_CACHE_MAX_ENTRY_BYTES
+from dbapp.db import queries as dbq
+from dbapp.db.connection import get_dataset_version, has_dataset_version
+
+# 既定で有効にするか（`.env`の`RESULT_CACHE_ENABLED`、管理用のWeb APIで切り替え可能）
+ENABLED = os.getenv("RESULT_CACHE_ENABLED", "TRUE").upper() == "TRUE"
+
+class ResultCache:
+    """ サイズの上限つきのLRUキャッシュ
+        値の大きさは呼び出し側が見積もって渡す
+    """
+
+    def __init__(self, max_bytes: int, max_entry_bytes: int, enabled: bool=True):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        # キー -> (大きさ, 値)
+        self._entries: "OrderedDict[Hashable, Tuple[int, Any]]" = OrderedDict()
+        self._total_bytes = 0
+        # 統計情報
+        self._hits = 0
+        self._misses = 0
+        self._stores = 0
+        self._evictions = 0
+        self._oversized = 0
+        self._invalidations = 0
+        self._bypassed = 0
+
+    def get(self, key: Optional[Hashable]) -> Optional[Any]:
+        """ 値を返す（なければNone、キーがNoneならキャッシュしないクエリとして数える）
+        """
+        if not self.enabled:
+            return None
+        with self._lock:
+            if key is None:
+                self._bypassed += 1
+                return None
+            entry = self._entries.get(key)
+            if entry is None:
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return entry[1]
+
+    def put(self, key: Optional[Hashable], value: Any, size: int) -> bool:
+        """ 値を置く（大きすぎて・キーがNoneで置かなかったらFalse）
+        """
+        if not self.enabled or key is None:
+            return False
+        with self._lock:
+            if size > self.max_entry_bytes:
+                self._oversized += 1
+                return False
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._total_bytes -= old[0]
+            self._entries[key] = (size, value)
+            self._total_bytes += size
+            self._stores += 1
+            while self._total_bytes > self.max_bytes and self._entries:
+                old_size, _ = self._entries.popitem(last=False)[1]
+                self._total_bytes -= old_size
+                self._evictions += 1
+        return True
+
+    def invalidate(self) -> None:
+        """ 全部捨てる
+        """
+        with self._lock:
+            self._entries.clear()
+            self._total_bytes = 0
+            self._invalidations += 1
+
+    def set_enabled(self, enabled: bool) -> None:
+        """ 有効・無効を切り替える（無効にしたら中身は捨てる）
+        """
+        self.enabled = enabled
+        if not enabled:
+            self.invalidate()
+
+    def stats(self) -> Dict[str, Any]:
+        """ 統計情報（ヒット率、件数・合計サイズ、追い出し・破棄の回数）
+        """
+        with self._lock:
+            total = self._hits + self._misses
+            return {
+                "enabled": self.enabled,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": self._hits / total if total else None,
+                "stores": self._stores,
+                "evictions": self._evictions,
+                "oversized": self._oversized,
+                "invalidations": self._invalidations,
+                "bypassed": self._bypassed,
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+_cache = ResultCache(
+    max_bytes=RESULT_CACHE_MAX_BYTES,
+    max_entry_bytes=RESULT_CACHE_MAX_ENTRY_BYTES,
+    enabled=ENABLED
+)
+
+def result_cache_key(safe_query: str, params: Sequence[Any], variant: Tuple) -> Optional[Tuple]:
+    """ 結果キャッシュのキーを作る（キャッシュしないクエリならNone）
+        `variant`は取り出し方（全件・ページ番号と行数など）
+        services/result_cache_service
+    """
+    if not has_dataset_version() or not dbq.is_deterministic_sql(safe_query):
+        return None
+    return (get_dataset_version(), dbq.normalize_sql(safe_query), tuple(params), variant)
+
+def get_cached_result(key: Optional[Tuple]) -> Optional[Any]:
+    """ キャッシュした結果を返す（なければNone）
+        services/result_cache_service
+    """
+    return _cache.get(key)
+
+def cache_result(key: Optional[Tuple], value: Any, columns: Sequence[str], rows: Sequence[Sequence[Any]]) -> bool:
+    """ 結果をキャッシュする（大きさは`columns`・`rows`から見積もる）
+        services/result_cache_service
+    """
+    if not _cache.enabled or key is None:
+        return False
+    return _cache.put(key, value, _estimate_size(columns, rows))
+
+def invalidate_result_cache() -> None:
+    """ キャッシュした結果を全部捨てる（データセットを入れ替えたとき用）
+        services/result_cache_service
+    """
+    _cache.invalidate()
+
+def set_result_cache_enabled(enabled: bool) -> None:
+    """ 結果キャッシュの有効・無効を切り替える
+        services/result_cache_service
+    """
+    _cache.set_enabled(enabled)
+
+def get_result_cache_stats() -> Dict[str, Any]:
+    """ 結果キャッシュの統計情報を返す
+        services/result_cache_service
+    """
+    return _cache.stats()
+
+def _estimate_size(columns: Sequence[str], rows: Sequence[Sequence[Any]]) -> int:
+    # おおよそのバイト数（行・値のオブジェクトの大きさの合計）
+    size = sys.getsizeof(rows) + sum(sys.getsizeof(column) for column in columns)
+    for row in rows:
+        size += sys.getsizeof(row)
+        for value in row:
+            size += sys.getsizeof(value)
+    return size
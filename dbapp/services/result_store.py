@@ -0,0 +1,261 @@
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+# 結果IDとして受け付ける形式（UUID）
+_ID_PATTERN = re.compile(r"^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$")
+
+class _Entry:
+    __slots__ = ("size", "expires_at")
+
+    def __init__(self, size: int, expires_at: float):
+        self.size = size
+        self.expires_at = expires_at
+
+class ResultStore:
+    """ 結果セットをJSONファイルとして一時保存する置き場
+        - 容量の上限（`max_bytes`）を超えたら、最近使われていないものから消す（LRU）
+        - 各エントリには有効期限（`ttl`秒）があり、切れたものは読めない
+        - 書き込みは一時ファイル -> `os.replace()`で行うので、書きかけを読むことはない
+        - `start_janitor()`でバックグラウンドの掃除スレッドを動かす
+        どのエントリを最近使ったかはプロセスごとに管理する
+        （起動時はファイルの更新時刻から復元し、読み出し時に更新時刻を触る）
+    """
+
+    def __init__(self, directory: Path, max_bytes: int, ttl: float, janitor_interval: float = 60.0):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.janitor_interval = janitor_interval
+
+        self._lock = threading.Lock()
+        # 結果ID -> エントリ（先頭ほど長く使われていない）
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._total_bytes = 0
+        self._janitor: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+        # 統計情報
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+
+        self._load_index()
+
+    # ------------------------------------------------------------------
+    # 保存・読み出し・削除
+    # ------------------------------------------------------------------
+    def put(self, data: Dict[str, Any], ttl: Optional[float] = None) -> str:
+        """ データを保存して結果ID（UUID）を返す
+        """
+        result_id = str(uuid.uuid4())
+        payload = json.dumps(data, ensure_ascii=False, default=str).encode("utf-8")
+
+        # 同じディレクトリに一時ファイルを書いてから差し替える
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(payload)
+            os.replace(tmp_path, self._path(result_id))
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._entries[result_id] = _Entry(len(payload), expires_at)
+            self._total_bytes += len(payload)
+            victims = self._over_quota_locked()
+        self._remove_files(victims)
+        return result_id
+
+    def get(self, result_id: str) -> Optional[Dict[str, Any]]:
+        """ 保存したデータを返す
+            ない・期限切れ・壊れているときはNone
+        """
+        if not _ID_PATTERN.match(result_id or ""):
+            self._count_miss()
+            return None
+
+        now = time.time()
+        expired = False
+        with self._lock:
+            entry = self._entries.get(result_id)
+            if entry is not None:
+                if entry.expires_at <= now:
+                    self._drop_locked(result_id)
+                    self._expirations += 1
+                    expired = True
+                else:
+                    self._entries.move_to_end(result_id)
+        if expired:
+            self._remove_files([result_id])
+            self._count_miss()
+            return None
+
+        path = self._path(result_id)
+        try:
+            with path.open("r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            # 別プロセスに消された・壊れている
+            with self._lock:
+                self._drop_locked(result_id)
+            self._count_miss()
+            return None
+
+        if entry is None:
+            # 別プロセスが保存したもの -> こちらでも管理対象にする
+            with self._lock:
+                if result_id not in self._entries:
+                    size = path.stat().st_size if path.exists() else 0
+                    self._entries[result_id] = _Entry(size, now + self.ttl)
+                    self._total_bytes += size
+
+        # 他プロセスから見ても「最近使った」とわかるように更新時刻を触る
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+
+        with self._lock:
+            self._hits += 1
+        return data
+
+    def delete(self, result_id: str) -> None:
+        """ 保存したデータを削除する
+        """
+        if not _ID_PATTERN.match(result_id or ""):
+            return
+        with self._lock:
+            self._drop_locked(result_id)
+        self._remove_files([result_id])
+
+    # ------------------------------------------------------------------
+    # 掃除
+    # ------------------------------------------------------------------
+    def sweep(self) -> None:
+        """ 期限切れのエントリを消し、容量の上限を超えていたら古いものから消す
+        """
+        now = time.time()
+        with self._lock:
+            expired = [rid for rid, entry in self._entries.items() if entry.expires_at <= now]
+            for rid in expired:
+                self._drop_locked(rid)
+            self._expirations += len(expired)
+            victims = self._over_quota_locked()
+        self._remove_files(expired + victims)
+        self._remove_orphans(now)
+
+    def start_janitor(self) -> None:
+        """ 掃除スレッドを開始する（2回目以降の呼び出しは何もしない）
+        """
+        with self._lock:
+            if self._janitor is not None:
+                return
+            self._janitor = threading.Thread(
+                target=self._run_janitor, name="result-store-janitor", daemon=True)
+        self._janitor.start()
+
+    def stop_janitor(self) -> None:
+        self._stop.set()
+
+    def stats(self) -> Dict[str, int]:
+        """ 統計情報（ヒット・ミス・追い出し・期限切れの回数、件数、合計サイズ）を返す
+        """
+        with self._lock:
+            return {
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+                "expirations": self._expirations,
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+    # ------------------------------------------------------------------
+    # 内部処理
+    # ------------------------------------------------------------------
+    def _path(self, result_id: str) -> Path:
+        return self.directory / f"{result_id}.json"
+
+    def _load_index(self) -> None:
+        # 既存のファイルを、更新時刻の古い順に管理対象に加える
+        files = []
+        for path in self.directory.glob("*.json"):
+            if not _ID_PATTERN.match(path.stem):
+                continue
+            try:
+                st = path.stat()
+            except OSError:
+                continue
+            files.append((st.st_mtime, path.stem, st.st_size))
+        files.sort()
+        for mtime, rid, size in files:
+            self._entries[rid] = _Entry(size, mtime + self.ttl)
+            self._total_bytes += size
+
+    def _drop_locked(self, result_id: str) -> None:
+        entry = self._entries.pop(result_id, None)
+        if entry is not None:
+            self._total_bytes -= entry.size
+
+    def _over_quota_locked(self) -> list:
+        # 上限を下回るまで、最近使われていないものから選ぶ
+        victims = []
+        while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+            rid, entry = self._entries.popitem(last=False)
+            self._total_bytes -= entry.size
+            victims.append(rid)
+        self._evictions += len(victims)
+        return victims
+
+    def _remove_files(self, result_ids) -> None:
+        for rid in result_ids:
+            try:
+                self._path(rid).unlink()
+            except FileNotFoundError:
+                pass
+            except OSError:
+                pass
+
+    def _remove_orphans(self, now: float) -> None:
+        # 書き込み途中で落ちた一時ファイル、管理外の期限切れファイルを消す
+        for path in self.directory.iterdir():
+            try:
+                mtime = path.stat().st_mtime
+            except OSError:
+                continue
+            if path.name.startswith(".") and path.suffix == ".tmp":
+                if now - mtime > self.ttl:
+                    path.unlink(missing_ok=True)
+            elif path.suffix == ".json" and now - mtime > self.ttl:
+                with self._lock:
+                    managed = path.stem in self._entries
+                if not managed:
+                    path.unlink(missing_ok=True)
+
+    def _count_miss(self) -> None:
+        with self._lock:
+            self._misses += 1
+
+    def _run_janitor(self) -> None:
+        while not self._stop.wait(self.janitor_interval):
+            try:
+                self.sweep()
+            except Exception:
+                # 掃除の失敗でスレッドを止めない
+                pass
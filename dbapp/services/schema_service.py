@@ -0,0 +1,169 @@
+# テーブル構造（スキーマ）のキャッシュ
+#   `TABLE_NAMES`の全テーブルの構造を1本のクエリでまとめて取り、メモリに置いておく
+#   起動時に読み込み、以降は`SCHEMA_REFRESH_INTERVAL`秒ごとに読み直す
+#   内容から作ったETagを返すので、クライアントは`If-None-Match`で再検証できる
+import hashlib
+import json
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from dbapp.config import QUERY_TIMEOUT, SCHEMA_REFRESH_INTERVAL
+from dbapp.db import queries as dbq
+from dbapp.db import sandbox
+from dbapp.db.connection import DB_BACKEND
+from dbapp.db.import_from_excel import fetch_all_excel
+
+# `DESC テーブル`と同じ列名で返す
+DESCRIBE_COLUMNS = ["Field", "Type", "Null", "Key", "Default", "Extra"]
+
+# MySQL: `INFORMATION_SCHEMA.COLUMNS`から全テーブル分をまとめて取る
+_SCHEMA_QUERY = """
+SELECT
+    TABLE_NAME, COLUMN_NAME, COLUMN_TYPE, IS_NULLABLE, COLUMN_KEY, COLUMN_DEFAULT, EXTRA
+FROM INFORMATION_SCHEMA.COLUMNS
+WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME IN ({placeholders})
+ORDER BY TABLE_NAME, ORDINAL_POSITION;
+"""
+
+# サンドボックス: スナップショット時に保存した`DESC`の結果から取る
+_SANDBOX_SCHEMA_QUERY = f"""
+SELECT TableName, Field, Type, "Null", "Key", "Default", Extra
+FROM {sandbox.DESCRIBE_TABLE}
+WHERE TableName IN ({{placeholders}})
+ORDER BY TableName, Position;
+"""
+
+class SchemaCache:
+    """ テーブル構造のスナップショットを持っておく
+        `refresh()`で読み直し、失敗したときは直前のスナップショットを使い続ける
+    """
+
+    def __init__(self, table_names: List[str], refresh_interval: float, use_excel: bool=False):
+        self.table_names = list(table_names)
+        self.refresh_interval = refresh_interval
+        self.use_excel = use_excel
+
+        self._lock = threading.Lock()
+        # テーブル名 -> {"columns": [...], "rows": [[...], ...]}
+        self._tables: Optional[Dict[str, Dict[str, Any]]] = None
+        self._etags: Dict[str, str] = {}
+        self._etag: Optional[str] = None
+        self._loaded_at: Optional[float] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+        # 統計情報
+        self._refreshes = 0
+        self._failures = 0
+        self._last_error: Optional[str] = None
+
+    def refresh(self) -> None:
+        """ DBから全テーブルの構造を読み直す
+        """
+        try:
+            tables = self._load()
+        except Exception as e:
+            with self._lock:
+                self._failures += 1
+                self._last_error = str(e)
+            raise
+        etags = {name: _etag_of(table) for name, table in tables.items()}
+        with self._lock:
+            self._tables = tables
+            self._etags = etags
+            self._etag = _etag_of(etags)
+            self._loaded_at = time.time()
+            self._refreshes += 1
+            self._last_error = None
+
+    def snapshot(self) -> Dict[str, Any]:
+        """ 全テーブルの構造とETag
+            まだ読み込めていなければ、その場で読み込む
+        """
+        self._ensure_loaded()
+        with self._lock:
+            return {"etag": self._etag, "tables": self._tables}
+
+    def get_table(self, table_name: str) -> Optional[Dict[str, Any]]:
+        """ 1テーブルの構造（{"columns", "rows", "etag"}）、なければNone
+        """
+        self._ensure_loaded()
+        with self._lock:
+            table = self._tables.get(table_name)
+            if table is None:
+                return None
+            return {**table, "etag": self._etags[table_name]}
+
+    def start_refresher(self) -> None:
+        """ 定期的に読み直すスレッドを開始する（2回目以降の呼び出しは何もしない）
+            まだ読み込んでいなければ、最初の読み込みもこのスレッドで行う（起動を待たせない）
+        """
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(
+                target=self._run_refresher, name="schema-refresher", daemon=True)
+        self._thread.start()
+
+    def stop_refresher(self) -> None:
+        self._stop.set()
+
+    def stats(self) -> Dict[str, Any]:
+        """ 統計情報（読み込み回数・失敗回数・最後に読み込んだ時刻など）
+        """
+        with self._lock:
+            return {
+                "etag": self._etag,
+                "tables": len(self._tables or {}),
+                "loaded_at": self._loaded_at,
+                "refreshes": self._refreshes,
+                "failures": self._failures,
+                "last_error": self._last_error,
+            }
+
+    # ------------------------------------------------------------------
+    # 内部処理
+    # ------------------------------------------------------------------
+    def _ensure_loaded(self) -> None:
+        if self._tables is None:
+            self.refresh()
+
+    def _load(self) -> Dict[str, Dict[str, Any]]:
+        placeholders = ", ".join("?" for _ in self.table_names)
+        if self.use_excel:
+            query = _SCHEMA_QUERY.format(placeholders=placeholders)
+            _, rows = fetch_all_excel(query, self.table_names, timeout=QUERY_TIMEOUT)
+        else:
+            template = _SANDBOX_SCHEMA_QUERY if DB_BACKEND == "sandbox" else _SCHEMA_QUERY
+            _, rows = dbq.fetch_all(
+                template.format(placeholders=placeholders), self.table_names,
+                deadline=dbq.Deadline(QUERY_TIMEOUT))
+
+        # `TABLE_NAMES`の順に並べる（構造が取れなかったテーブルは空）
+        tables = {name: {"columns": DESCRIBE_COLUMNS, "rows": []} for name in self.table_names}
+        for row in rows:
+            table_name, *describe = row
+            # 大文字・小文字の違いは`TABLE_NAMES`の表記にそろえる
+            key = next((name for name in self.table_names if name.lower() == str(table_name).lower()), None)
+            if key is not None:
+                tables[key]["rows"].append(list(describe))
+        return tables
+
+    def _run_refresher(self) -> None:
+        if self._tables is None:
+            try:
+                self.refresh()
+            except Exception as e:
+                # DBにつながらなくても動き続ける（最初のリクエストで読み込み直す）
+                print(f"テーブル構造の読み込みに失敗しました。: {e}")
+        while not self._stop.wait(self.refresh_interval):
+            try:
+                self.refresh()
+            except Exception:
+                # 読み直しに失敗しても、直前のスナップショットで動き続ける
+                pass
+
+def _etag_of(data: Any) -> str:
+    payload = json.dumps(data, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32]
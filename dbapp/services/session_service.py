@@ -1,10 +1,21 @@
+import uuid
 from flask import session
 from dbapp.config import DEFAULT_EDITOR_HEIGHT
-from typing import Any, Tuple, List
+from typing import Any, Tuple, List, Optional
 
 from dbapp.services.file_service import (
     load_temp_result, delete_temp_result)
 
+def get_session_id() -> str:
+    """ セッションを識別するID（初回に発行してセッションに保存）
+        services/session_service
+    """
+    session_id = session.get("session_id")
+    if not session_id:
+        session_id = str(uuid.uuid4())
+        session["session_id"] = session_id
+    return session_id
+
 def save_editor_query(sql_query: str, page: str):
     """ エディタのクエリをセッションに保存
         services/session_service
@@ -17,6 +28,12 @@ def get_editor_query(page: str):
     """
     return session.get(f"{page}_last_posted_query", "")
 
+def pop_editor_query(page: str):
+    """ セッションに保存されたクエリを取り出してクリアする
+        services/session_service
+    """
+    return session.pop(f"{page}_last_posted_query", "")
+
 def clear_editor_query(page: str):
     """ セッションに保存したクエリをクリアする
         services/session_service
@@ -57,15 +74,17 @@ def pop_scroll_to_editor(page: str):
     """
     return session.pop(f"{page}_scroll_to_editor", False)
 
-def save_result_to_session(page: str, temp_id: str) -> None:
+def save_result_to_session(page: str, temp_id: str, page_info: Optional[dict]=None) -> None:
     """ クエリの実行結果を保存した一時ファイルのIDをセッションに保存する
 
     :param tmp_id: 一時ファイルのUUID
     :type tmp_id: str
+    :param page_info: 結果セットのページ情報（`exec_query_page()`が返すもの）
+    :type page_info: Optional[dict]
     :return: 返り値なし
     :rtype: None
     .. note::
-        - 特になし
+        - 前回の一時ファイルがあれば、入れ替えるときに削除する
     .. warning::
         - 特になし
     .. hint::
@@ -73,7 +92,11 @@ def save_result_to_session(page: str, temp_id: str) -> None:
     .. important::
         - 特になし
     """
+    old_temp_id = session.get(f"{page}_last_temp_id")
+    if old_temp_id and old_temp_id != temp_id:
+        delete_temp_result(old_temp_id)
     session[f"{page}_last_temp_id"] = temp_id
+    session[f"{page}_last_page_info"] = page_info
     
 
 def get_result_from_session(page: str) -> (
@@ -86,6 +109,7 @@ def get_result_from_session(page: str) -> (
     :rtype: Tuple[List[str]], List[List[Any]]] or Tuple[None, None]
     .. note::
         - 一時ファイルのIDがセッションにないときは、(None, None)が返る
+        - 一時ファイルが期限切れ・追い出し済みのときも、(None, None)が返る
         - file_service.load_temp_result()を呼び出す
     .. warning::
         - 特になし
@@ -99,6 +123,18 @@ def get_result_from_session(page: str) -> (
         return None, None
     return load_temp_result(temp_id)
 
+def get_result_id_from_session(page: str) -> Optional[str]:
+    """ セッションから直近の結果セットの一時ファイルのIDを取り出す
+        services/session_service
+    """
+    return session.get(f"{page}_last_temp_id")
+
+def get_page_info_from_session(page: str) -> Optional[dict]:
+    """ セッションから直近の結果セットのページ情報を取り出す
+        services/session_service
+    """
+    return session.get(f"{page}_last_page_info")
+
 def delete_result_from_session(page: str) -> None:
     """  セッションの一時ファイルのIDを消す
     
@@ -116,5 +152,6 @@ def delete_result_from_session(page: str) -> None:
         - 特になし
     """
     temp_id = session.pop(f"{page}_last_temp_id", None)
+    session.pop(f"{page}_last_page_info", None)
     if temp_id: 
         delete_temp_result(temp_id)
\ No newline at end of file
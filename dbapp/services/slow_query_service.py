@@ -0,0 +1,304 @@
+# 遅いクエリの記録
+#   学習者のクエリ（SQLコンソール・正誤判定）のうち、実行に`SLOW_QUERY_THRESHOLD`秒以上
+#   かかったものを、指紋（`dbq.fingerprint_sql()`）・実行時間・行数・例外の種類・問題番号と
+#   一緒にSQLiteのファイルに書く
+#   書き込みは専用のスレッドが行う（リクエストは待ち行列に積むだけで、いっぱいなら捨てる）
+#   指紋ごとの集計（合計時間・p95）は`SlowQueryFingerprints`ビューで見られる
+#     例: `sqlite3 storage/slow_queries.db "SELECT * FROM SlowQueryFingerprints ORDER BY TotalSeconds DESC LIMIT 10"`
+import hashlib
+import os
+import queue
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from dbapp.config import SLOW_QUERY_THRESHOLD, SLOW_QUERY_QUEUE_SIZE, SLOW_QUERY_MAX_RECORDS
+from dbapp.db import queries as dbq
+
+# 記録先（`.env`の`SLOW_QUERY_LOG_PATH`で差し替え可能）
+LOG_PATH = Path(os.getenv(
+    "SLOW_QUERY_LOG_PATH", Path(__file__).resolve().parent.parent / "storage" / "slow_queries.db"))
+# しきい値（秒、`.env`の`SLOW_QUERY_THRESHOLD`で上書き可能）
+THRESHOLD = float(os.getenv("SLOW_QUERY_THRESHOLD", SLOW_QUERY_THRESHOLD))
+
+# 記録するクエリ文の長さの上限（文字数）
+MAX_QUERY_LENGTH = 4000
+# 1回の書き込みでまとめる件数
+WRITE_BATCH_SIZE = 100
+# 集計で並べ替えに使える列
+ORDER_COLUMNS = {"total": "TotalSeconds", "p95": "P95Seconds", "calls": "Calls", "max": "MaxSeconds"}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS SlowQueries (
+    ID INTEGER PRIMARY KEY,
+    RecordedAt REAL NOT NULL,
+    Source TEXT NOT NULL,
+    FingerprintHash TEXT NOT NULL,
+    Fingerprint TEXT NOT NULL,
+    QueryText TEXT NOT NULL,
+    DurationSeconds REAL NOT NULL,
+    RowCount INTEGER,
+    ErrorClass TEXT,
+    ChapterNumber INTEGER,
+    SectionNumber INTEGER,
+    QuestionNumber INTEGER
+);
+CREATE INDEX IF NOT EXISTS IX_SlowQueries_Fingerprint
+    ON SlowQueries (FingerprintHash, DurationSeconds);
+
+-- 指紋ごとの集計（p95は最近傍順位法: 小さい方から数えて95%の位置の値）
+CREATE VIEW IF NOT EXISTS SlowQueryFingerprints AS
+WITH Ranked AS (
+    SELECT
+        *,
+        ROW_NUMBER() OVER (PARTITION BY FingerprintHash ORDER BY DurationSeconds) AS Position,
+        COUNT(*) OVER (PARTITION BY FingerprintHash) AS Total
+    FROM
+        SlowQueries
+)
+SELECT
+    FingerprintHash,
+    MAX(Fingerprint) AS Fingerprint,
+    COUNT(*) AS Calls,
+    SUM(DurationSeconds) AS TotalSeconds,
+    AVG(DurationSeconds) AS MeanSeconds,
+    MIN(CASE WHEN Position >= 0.95 * Total THEN DurationSeconds END) AS P95Seconds,
+    MAX(DurationSeconds) AS MaxSeconds,
+    SUM(ErrorClass IS NOT NULL) AS Errors,
+    MAX(RecordedAt) AS LastSeenAt
+FROM
+    Ranked
+GROUP BY
+    FingerprintHash;
+"""
+
+_INSERT = """
+INSERT INTO SlowQueries (
+    RecordedAt, Source, FingerprintHash, Fingerprint, QueryText, DurationSeconds,
+    RowCount, ErrorClass, ChapterNumber, SectionNumber, QuestionNumber
+) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?);
+"""
+
+class SlowQueryLog:
+    """ 遅いクエリをSQLiteのファイルに書く
+        `record()`は待ち行列に積むだけで、書き込みは専用のスレッドがまとめて行う
+        （スレッドは最初に積んだときに作る）
+    """
+
+    def __init__(self, path: Path, threshold: float, max_queue: int, max_records: int):
+        self.path = Path(path)
+        self.threshold = threshold
+        self.max_records = max_records
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._recorded = 0
+        self._dropped = 0
+        self._written = 0
+        self._failures = 0
+        self._last_error: Optional[str] = None
+
+    def watch(self, sql_query: str, source: str, question_key: Optional[Tuple[int, int, int]]=None) -> "SlowQueryWatch":
+        """ `with`の中の実行時間を測り、しきい値を超えたら記録する
+        """
+        return SlowQueryWatch(self, sql_query, source, question_key)
+
+    def record(self, sql_query: str, duration: float, source: str, row_count: Optional[int]=None,
+               error_class: Optional[str]=None, question_key: Optional[Tuple[int, int, int]]=None) -> bool:
+        """ しきい値を超えていれば記録する（記録したらTrue）
+            待ち行列がいっぱいのときは捨てる（リクエストを待たせない）
+        """
+        if duration < self.threshold:
+            return False
+        fingerprint = dbq.fingerprint_sql(sql_query)
+        chapter, section, question = question_key or (None, None, None)
+        row = (
+            time.time(), source,
+            hashlib.blake2b(fingerprint.encode("utf-8"), digest_size=8).hexdigest(),
+            fingerprint, sql_query[:MAX_QUERY_LENGTH], duration,
+            row_count, error_class, chapter, section, question,
+        )
+        self._ensure_writer()
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            with self._lock:
+                self._dropped += 1
+            return False
+        with self._lock:
+            self._recorded += 1
+        return True
+
+    def flush(self, timeout: float=1.0) -> bool:
+        """ ここまでに積んだ分が書き終わるまで（最大`timeout`秒）待つ
+        """
+        if self._thread is None:
+            return True
+        done = threading.Event()
+        try:
+            self._queue.put(done, timeout=timeout)
+        except queue.Full:
+            return False
+        return done.wait(timeout)
+
+    def top_fingerprints(self, order: str="total", limit: int=20, questions: int=3) -> List[Dict[str, Any]]:
+        """ 指紋ごとの集計を`order`（`total` / `p95` / `calls` / `max`）の大きい順に返す
+            各指紋には、よく出ている問題番号を`questions`件までつける
+        """
+        column = ORDER_COLUMNS.get(order, ORDER_COLUMNS["total"])
+        if not self.path.exists():
+            return []
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                f"SELECT * FROM SlowQueryFingerprints ORDER BY {column} DESC LIMIT ?;", (limit, )
+            ).fetchall()
+            results = []
+            for row in rows:
+                entry = dict(row)
+                entry["questions"] = [
+                    {"question_key": [r["ChapterNumber"], r["SectionNumber"], r["QuestionNumber"]],
+                     "calls": r["Calls"], "total_seconds": r["TotalSeconds"]}
+                    for r in conn.execute("""
+                        SELECT ChapterNumber, SectionNumber, QuestionNumber,
+                               COUNT(*) AS Calls, SUM(DurationSeconds) AS TotalSeconds
+                        FROM SlowQueries
+                        WHERE FingerprintHash = ? AND QuestionNumber IS NOT NULL
+                        GROUP BY ChapterNumber, SectionNumber, QuestionNumber
+                        ORDER BY TotalSeconds DESC
+                        LIMIT ?;
+                    """, (row["FingerprintHash"], questions))
+                ]
+                results.append(entry)
+            return results
+        finally:
+            conn.close()
+
+    def stats(self) -> Dict[str, Any]:
+        """ 統計情報（記録・破棄・書き込みの件数、書き込み待ちの件数など）
+        """
+        with self._lock:
+            return {
+                "threshold": self.threshold,
+                "recorded": self._recorded,
+                "dropped": self._dropped,
+                "written": self._written,
+                "queued": self._queue.qsize(),
+                "failures": self._failures,
+                "last_error": self._last_error,
+            }
+
+    # ------------------------------------------------------------------
+    # 内部処理
+    # ------------------------------------------------------------------
+    def _connect(self) -> sqlite3.Connection:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=5)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _ensure_writer(self) -> None:
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run_writer, name="slow-query-writer", daemon=True)
+                self._thread.start()
+
+    def _run_writer(self) -> None:
+        conn = None
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < WRITE_BATCH_SIZE:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            rows = [item for item in batch if isinstance(item, tuple)]
+            if rows:
+                try:
+                    if conn is None:
+                        conn = self._connect()
+                        conn.execute("PRAGMA journal_mode = WAL;")
+                        conn.executescript(_SCHEMA)
+                    self._write(conn, rows)
+                except sqlite3.Error as e:
+                    # 書けなかった分は捨てる（次の書き込みで接続し直す）
+                    with self._lock:
+                        self._failures += 1
+                        self._last_error = str(e)
+                    if conn is not None:
+                        conn.close()
+                        conn = None
+            # `flush()`の待ち合わせ
+            for item in batch:
+                if isinstance(item, threading.Event):
+                    item.set()
+
+    def _write(self, conn: sqlite3.Connection, rows: List[tuple]) -> None:
+        with conn:
+            conn.executemany(_INSERT, rows)
+            # 古いものから捨てて、`max_records`件までにする
+            conn.execute(
+                "DELETE FROM SlowQueries WHERE ID <= (SELECT MAX(ID) FROM SlowQueries) - ?;",
+                (self.max_records, ))
+        with self._lock:
+            self._written += len(rows)
+
+class SlowQueryWatch:
+    """ `with`の中の実行時間を測って、抜けるときに`SlowQueryLog.record()`する
+        中で例外が起きたら、その種類を記録する（例外はそのまま投げ直す）
+        行数は`rows`に入れておく
+    """
+    __slots__ = ("log", "sql_query", "source", "question_key", "rows", "started_at")
+
+    def __init__(self, log: SlowQueryLog, sql_query: str, source: str,
+                 question_key: Optional[Tuple[int, int, int]]):
+        self.log = log
+        self.sql_query = sql_query
+        self.source = source
+        self.question_key = question_key
+        self.rows: Optional[int] = None
+
+    def __enter__(self):
+        self.started_at = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.log.record(
+            self.sql_query, time.perf_counter() - self.started_at, self.source,
+            row_count=self.rows,
+            error_class=exc_type.__name__ if exc_type is not None else None,
+            question_key=self.question_key)
+        return False
+
+_log = SlowQueryLog(
+    path=LOG_PATH,
+    threshold=THRESHOLD,
+    max_queue=SLOW_QUERY_QUEUE_SIZE,
+    max_records=SLOW_QUERY_MAX_RECORDS
+)
+
+def watch_query(sql_query: str, source: str, question_key: Optional[Tuple[int, int, int]]=None) -> SlowQueryWatch:
+    """ 学習者のクエリの実行を`with`で囲んで測る（遅ければ記録する）
+        `source`は実行元（`console` / `judge`）
+        services/slow_query_service
+    """
+    return _log.watch(sql_query, source, question_key)
+
+def get_top_fingerprints(order: str="total", limit: int=20) -> List[Dict[str, Any]]:
+    """ 遅いクエリの指紋ごとの集計を、`order`の大きい順に返す
+        書き込み待ちの分を書いてから読む
+        services/slow_query_service
+    """
+    _log.flush()
+    return _log.top_fingerprints(order=order, limit=limit)
+
+def get_slow_query_stats() -> Dict[str, Any]:
+    """ 遅いクエリの記録の統計情報を返す
+        services/slow_query_service
+    """
+    return _log.stats()
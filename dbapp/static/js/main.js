@@ -4,6 +4,48 @@
 
     $(function() {
 
+        /* --------------------------------------------------------------------
+            テーブル構造のキャッシュ
+                `/api/tables`（全テーブル分）をETagつきでローカルストレージに保存し、
+                ページを開くたびに`If-None-Match`で再検証する
+                （変わっていなければ`304`が返るだけなので、本文は転送されない）
+                取得するJSONの形式は次の通り
+                {
+                    etag: <string>,
+                    tables: { <table name>: { columns: [...], rows: [[...], ...] } }
+                }
+        -------------------------------------------------------------------- */
+            const SCHEMA_CACHE_KEY = 'schema';
+            let schema = loadCachedSchema();
+
+            function loadCachedSchema() {
+                try {
+                    return JSON.parse(localStorage.getItem(SCHEMA_CACHE_KEY));
+                } catch (e) {
+                    return null;
+                }
+            }
+
+            // サーバーに再検証し、内容が変わったかどうかを返す（Promise）
+            function revalidateSchema() {
+                const headers = schema ? { 'If-None-Match': `"${schema.etag}"` } : {};
+                return $.ajax({ url: '/api/tables', dataType: 'json', headers: headers })
+                    .then(function(data, textStatus, xhr) {
+                        // 変わっていない
+                        if (xhr.status === 304 || !data) return false;
+                        schema = data;
+                        try {
+                            localStorage.setItem(SCHEMA_CACHE_KEY, JSON.stringify(data));
+                        } catch (e) {
+                            console.warn("localStorageへの保存に失敗しました。: ", e);
+                        }
+                        return true;
+                    }, function() {
+                        // 通信失敗 -> 手元のキャッシュを使い続ける
+                        return $.Deferred().resolve(false);
+                    });
+            }
+
         /* --------------------------------------------------------------------
             ページ読み込み時の処理
         -------------------------------------------------------------------- */
@@ -23,16 +65,21 @@
             // テーブル構造表示領域を描画する
             // 最後に見たテーブルのテーブル名を取得
             const lastViewed = localStorage.getItem("lastViewedTable");
-            // キャッシュデータがあれば、データを取得して描画
-            if (lastViewed) {
-                const cacheKey = `table:${lastViewed}`;
-                const cachedData = localStorage.getItem(cacheKey);
-                if (cachedData) {
-                    const data = JSON.parse(cachedData);
-                    $("#table-structure-wrapper").show();
-                    $("#table-structure-title").text(`${lastViewed} テーブルの構造（キャッシュ）`);
-                    renderTableStructureTable(data);
-                }
+            // キャッシュデータがあれば、すぐに描画
+            if (lastViewed && schema && schema.tables[lastViewed]) {
+                $("#table-structure-wrapper").show();
+                $("#table-structure-title").text(`${lastViewed} テーブルの構造`);
+                renderTableStructureTable(schema.tables[lastViewed]);
+            }
+            // サーバーに再検証して、変わっていたら描画し直す
+            if ($(".pill-list").length) {
+                revalidateSchema().then(function(changed) {
+                    if (changed && lastViewed && schema && schema.tables[lastViewed]) {
+                        $("#table-structure-wrapper").show();
+                        $("#table-structure-title").text(`${lastViewed} テーブルの構造`);
+                        renderTableStructureTable(schema.tables[lastViewed]);
+                    }
+                });
             }
 
             // 煽り画像ズーム
@@ -52,7 +99,10 @@
                 // 表示中のテーブル名を格納するKeyのデータを削除
                 localStorage.removeItem('lastViewedTable');
 
-                // `table:`で始まるKeyのデータ（＝キャッシュ済みテーブルのデータ）削除
+                // テーブル構造のキャッシュを削除
+                localStorage.removeItem(SCHEMA_CACHE_KEY);
+                schema = null;
+                // `table:`で始まるKeyのデータ（＝旧形式のキャッシュ）も削除
                 Object.keys(localStorage).forEach(key => {
                     if (key.startsWith('table:')) {
                         localStorage.removeItem(key);
@@ -88,10 +138,6 @@
                 }
                 // クリックしたピルケースのdata属性からテーブル名を取得
                 const tableName = $(this).data("table");
-                // キャッシュのキーを作成
-                const cacheKey = `table:${tableName}`;
-                // localStorageにキャッシュされたデータを取得
-                const cachedData = localStorage.getItem(cacheKey);
 
                 // 最後に見たテーブルのテーブル名をローカルストレージにキャッシュ
                 localStorage.setItem("lastViewedTable", tableName);
@@ -100,59 +146,25 @@
                 $("#table-structure-wrapper").show();
 
                 // キャッシュがある場合は即描画
-                if (cachedData) {
-                    const data = JSON.parse(cachedData);
-                    $("#table-structure-title").text(`${tableName} テーブルの構造（キャッシュ）`);
+                if (schema && schema.tables[tableName]) {
+                    $("#table-structure-title").text(`${tableName} テーブルの構造`);
                     // theadとtbodyに闘魂注入
-                    renderTableStructureTable(data);
-                    // API呼び出しをスキップ
+                    renderTableStructureTable(schema.tables[tableName]);
                     return;
-                } 
-
-                // キャッシュがないときはAPIを叩く
-                // URL組み立て
-                const url = `/api/table/${tableName}`;
+                }
 
+                // キャッシュがないときは全テーブル分をまとめて取得
                 // ローディング表示
                 $("#table-structure-title").text(`${tableName} テーブル構造を取得中...`);
-
-                // 非同期でWeb APIからJSONを取得
-                // 取得するJSON（`data`）の形式は次の通り
-                // {
-                //      columns: <array of column names>, 
-                //      rows: <array of value arrays>, 
-                // }
-                $.getJSON(url)
-                    // 取得成功
-                    .done(function(data) {
-                        // 通信はできたがエラー
-                        if (data.error) {
-                            $("#table-structure-title").text("( ´,_ゝ`) < エラー");
-                            $("#table-structure thead, #table-structure tbody").empty();
-                            $("#table-structure tbody").append(
-                                `<tr><td colspan="99">${data.error}</td></tr>`
-                            );
-                            return
-                        }
-                        // 正しいデータが返ってきた
-                        // ローカルストレージにデータをキャッシュ
-                        try {
-                            localStorage.setItem(cacheKey, JSON.stringify(data));
-                            console.log(`キャッシュ保存: ${cacheKey}`);
-                        } catch (e) {
-                            console.warn("localStorageへの保存に失敗しました。: ", e);
-                        }
-
-                        $("#table-structure-title").text(`${tableName} テーブルの構造`);
-                        // theadとtbodyに闘魂注入
-                        renderTableStructureTable(data);
-                    })
-                    // 取得失敗
-                    .fail(function() {
+                revalidateSchema().then(function() {
+                    if (!schema || !schema.tables[tableName]) {
                         $("#table-structure-title").text("通信エラー");
                         $("#table-structure thead, #table-structure tbody").empty();
+                        return;
                     }
-                );
+                    $("#table-structure-title").text(`${tableName} テーブルの構造`);
+                    renderTableStructureTable(schema.tables[tableName]);
+                });
             });
 
             // テーブル構造表示テーブル描画用関数
@@ -219,10 +231,17 @@
 
             // フォームサブミット時にCodeMirrorラッパーの高さをinput:hiddenに入れる
             //      -> CodeMirrorの値をtextareaに反映
-            $('#form--submit-query').on('submit', function() {
+            $('#form--submit-query').on('submit', function(e) {
                 const height = $queryWrapper.outerHeight();
                 $('#sql_query_height').val(height);
                 if (sqlEditor) sqlEditor.save(); // textareaの値にコピー
+
+                // 「クエリ実行」はジョブとして投げ、進捗を表示しながら待つ
+                //      -> 「保存」やEventSource非対応ブラウザはそのまま送信
+                const submitter = e.originalEvent && e.originalEvent.submitter;
+                if (!submitter || submitter.name !== 'execute' || !window.EventSource) return;
+                e.preventDefault();
+                submitJob(this);
             });
 
             $queryWrapper?.resizable({
@@ -311,6 +330,275 @@
                 });
             }
         
+        /* --------------------------------------------------------------------
+            ジョブ（非同期のクエリ実行・正誤判定）関係
+        -------------------------------------------------------------------- */
+            // 実行中のジョブ（`/api/jobs`が返したJSON）
+            let currentJob = null;
+
+            // 段階の表示名
+            const JOB_PHASE_LABELS = {
+                queued: '順番待ち',
+                waiting: '実行枠待ち',
+                executing: '実行中',
+                fetching: '結果取得中',
+            };
+
+            // ジョブを登録して、進捗の監視を始める
+            function submitJob(form) {
+                // 実行中は二重に投げない
+                if (currentJob) return;
+                const $form = $(form);
+                const $executeBtn = $form.find('button[name="execute"]');
+
+                const formData = new FormData(form);
+                formData.append('kind', $form.data('job-kind'));
+                formData.append('page', $form.data('job-page'));
+
+                $executeBtn.prop('disabled', true);
+                showJobProgress('受付中...');
+
+                $.ajax({
+                    url: $form.data('job-url'),
+                    method: 'POST',
+                    data: formData,
+                    processData: false,
+                    contentType: false
+                })
+                    .done(function(job) {
+                        currentJob = job;
+                        watchJob(job, $executeBtn);
+                    })
+                    .fail(function(xhr) {
+                        hideJobProgress($executeBtn);
+                        // 混雑で断られた -> 再試行の目安を知らせる
+                        if (xhr.status === 429 && xhr.responseJSON) {
+                            showJobToast(xhr.responseJSON.error);
+                            return;
+                        }
+                        // それ以外はいつもの送信に切り替える
+                        $('<input type="hidden" name="execute">').appendTo(form);
+                        form.submit();
+                    });
+            }
+
+            // Server-Sent Eventsで進捗を受け取り、終わったら結果ページへ
+            function watchJob(job, $executeBtn) {
+                const source = new EventSource(job.events_url);
+                const close = () => {
+                    source.close();
+                    currentJob = null;
+                };
+
+                source.addEventListener('progress', function(e) {
+                    renderJobProgress(JSON.parse(e.data));
+                });
+                // 成功・失敗とも結果ページで表示する
+                source.addEventListener('done', function() {
+                    close();
+                    location.href = job.view_url;
+                });
+                source.addEventListener('failed', function() {
+                    close();
+                    location.href = job.view_url;
+                });
+                // 中断したときはページを移動せず、エディタをそのまま使えるようにする
+                source.addEventListener('cancelled', function() {
+                    close();
+                    hideJobProgress($executeBtn);
+                    showJobToast('( ´,_ゝ`) < クエリの実行を中断しました。');
+                });
+                // 接続が切れた（再接続しない）-> ジョブが見つからない
+                source.onerror = function() {
+                    if (source.readyState === EventSource.CLOSED) {
+                        close();
+                        hideJobProgress($executeBtn);
+                        showJobToast('( ´,_ゝ`) < 実行状況を取得できませんでした。');
+                    }
+                };
+            }
+
+            // 中断ボタン
+            $('#job-cancel-btn').on('click', function() {
+                if (!currentJob) return;
+                $.ajax({
+                    url: currentJob.cancel_url,
+                    method: 'POST',
+                    headers: { 'X-CSRFToken': $('input[name="csrf_token"]').val() }
+                });
+                $('#job-progress-text').text('中断しています...');
+            });
+
+            function renderJobProgress(progress) {
+                const label = JOB_PHASE_LABELS[progress.phase] || progress.phase;
+                let text = `${label}（${progress.elapsed.toFixed(1)}秒）`;
+                if (progress.rows_fetched > 0) {
+                    text += ` ${progress.rows_fetched.toLocaleString()}行取得`;
+                }
+                $('#job-progress-text').text(text);
+            }
+
+            function showJobProgress(text) {
+                $('#job-progress-text').text(text);
+                $('#job-progress').prop('hidden', false);
+            }
+
+            function hideJobProgress($executeBtn) {
+                $('#job-progress').prop('hidden', true);
+                $executeBtn.prop('disabled', false);
+            }
+
+            function showJobToast(msg) {
+                const toast = $('<div class="toast"></div>').text(msg);
+                $('body').append(toast);
+                setTimeout(() => toast.remove(), 2000);
+            }
+
+        /* --------------------------------------------------------------------
+            結果グリッド（仮想スクロール）
+                見えている行（＋前後の少し）だけDOMに描画し、
+                行データは`/api/results/<id>`から`GRID_WINDOW_SIZE`行ずつ取得する
+        -------------------------------------------------------------------- */
+            // 1行の高さ（px、CSSの`--grid-row-height`と合わせる）
+            const GRID_ROW_HEIGHT = 32;
+            // 表示範囲の上下に余分に描画する行数
+            const GRID_OVERSCAN = 10;
+            // 1回のAPI呼び出しで取得する行数
+            const GRID_WINDOW_SIZE = 200;
+            // 列幅を決めるのに見る行数（先頭から）
+            const GRID_SAMPLE_ROWS = 100;
+
+            $('.result-grid').each(function() {
+                initResultGrid($(this));
+            });
+
+            function initResultGrid($grid) {
+                const url = $grid.data('url');
+                const total = parseInt($grid.data('total'), 10) || 0;
+                const columns = $grid.data('columns') || [];
+                const $viewport = $grid.find('.result-grid__viewport');
+                const $header = $grid.find('.result-grid__header');
+                const $spacer = $grid.find('.result-grid__spacer');
+                const $rows = $grid.find('.result-grid__rows');
+                // ブロック番号 -> 行データの配列（取得中はnull）
+                const blocks = new Map();
+                let widthsFixed = false;
+                let frame = null;
+
+                $spacer.css('height', `${Math.max(total, 1) * GRID_ROW_HEIGHT}px`);
+                setColumnWidths([]);
+
+                function loadBlock(index) {
+                    if (blocks.has(index)) return;
+                    blocks.set(index, null);
+                    $.getJSON(url, { offset: index * GRID_WINDOW_SIZE, limit: GRID_WINDOW_SIZE })
+                        .done(function(data) {
+                            blocks.set(index, data.rows);
+                            // 先頭のブロックが来たら、それを見本に列幅を決める
+                            if (index === 0 && !widthsFixed) {
+                                setColumnWidths(data.rows.slice(0, GRID_SAMPLE_ROWS));
+                                widthsFixed = true;
+                            }
+                            scheduleRender();
+                        })
+                        .fail(function() {
+                            // 期限切れなど -> 次のスクロールで取り直す
+                            blocks.delete(index);
+                            $rows.html(
+                                '<div class="result-grid__row"><div class="result-grid__cell">'
+                                + '( ´,_ゝ`) < 結果を取得できませんでした。もう一度実行してね。'
+                                + '</div></div>'
+                            );
+                        });
+                }
+
+                // 見本の行から列幅を決める（全角は半角2文字分で数える）
+                function setColumnWidths(sample) {
+                    const widths = columns.map((col, i) => {
+                        let units = textUnits(col);
+                        sample.forEach(row => {
+                            units = Math.max(units, textUnits(formatCell(row[i])));
+                        });
+                        return Math.min(Math.max(units * 8 + 24, 64), 360);
+                    });
+                    $grid[0].style.setProperty('--grid-columns', widths.map(w => `${w}px`).join(' '));
+                }
+
+                function render() {
+                    frame = null;
+                    if (total === 0) {
+                        $rows.html(
+                            '<div class="result-grid__row"><div class="result-grid__cell">データがありません</div></div>'
+                        );
+                        return;
+                    }
+                    // 閉じているトグルの中などで高さが取れないときは、最大の高さで見積もる
+                    const height = $viewport.innerHeight() || 600;
+                    const scrollTop = Math.max($viewport.scrollTop() - $header.outerHeight(), 0);
+                    const start = Math.max(Math.floor(scrollTop / GRID_ROW_HEIGHT) - GRID_OVERSCAN, 0);
+                    const end = Math.min(Math.ceil((scrollTop + height) / GRID_ROW_HEIGHT) + GRID_OVERSCAN, total);
+
+                    // 表示範囲のブロックを取得
+                    const firstBlock = Math.floor(start / GRID_WINDOW_SIZE);
+                    const lastBlock = Math.floor((end - 1) / GRID_WINDOW_SIZE);
+                    for (let b = firstBlock; b <= lastBlock; b++) {
+                        loadBlock(b);
+                    }
+
+                    let html = '';
+                    for (let i = start; i < end; i++) {
+                        const block = blocks.get(Math.floor(i / GRID_WINDOW_SIZE));
+                        const row = block ? block[i % GRID_WINDOW_SIZE] : null;
+                        const cells = row
+                            ? row.map(cell => `<div class="result-grid__cell">${escapeHtml(formatCell(cell))}</div>`).join('')
+                            : '<div class="result-grid__cell is-loading">…</div>';
+                        html += `<div class="result-grid__row${i % 2 ? ' is-even' : ''}">${cells}</div>`;
+                    }
+                    $rows.css('transform', `translateY(${start * GRID_ROW_HEIGHT}px)`).html(html);
+                }
+
+                function scheduleRender() {
+                    if (frame === null) {
+                        frame = requestAnimationFrame(render);
+                    }
+                }
+
+                $viewport.on('scroll', scheduleRender);
+                $(window).on('resize', scheduleRender);
+                // トグルで開いたときに描画し直す
+                $grid.closest('.toggle-content').on('transitionend', scheduleRender);
+
+                // はみ出したセルだけ、ホバーで全体を表示する
+                $grid.on('mouseenter', '.result-grid__cell', function() {
+                    if (this.scrollWidth > this.clientWidth) {
+                        this.title = this.textContent;
+                    }
+                });
+
+                render();
+            }
+
+            function formatCell(value) {
+                // サーバー側のテーブル表示と同じく、NULLは`None`と表示する
+                return value === null || value === undefined ? 'None' : String(value);
+            }
+
+            function textUnits(text) {
+                let units = 0;
+                for (const ch of String(text)) {
+                    units += ch.charCodeAt(0) > 0xff ? 2 : 1;
+                }
+                return units;
+            }
+
+            function escapeHtml(text) {
+                return text
+                    .replace(/&/g, '&amp;')
+                    .replace(/</g, '&lt;')
+                    .replace(/>/g, '&gt;')
+                    .replace(/"/g, '&quot;');
+            }
+
         /* --------------------------------------------------------------------
             スクロール関係
         -------------------------------------------------------------------- */
@@ -0,0 +1,260 @@
+# リクエストごとの処理時間の計測
+#   リクエスト（またはジョブ）の間、`RequestTiming`をContextVarに置いておき、
+#   各層で`with timing.phase("execute"):`のように処理段階ごとの時間を足し込む
+#     - validate: クエリの検査（db/queries）
+#     - queue:    実行枠の空き待ち（services/admission_service）
+#     - connect:  コネクションの貸出待ち（db/queries）
+#     - execute:  クエリの実行（db/queries）
+#     - fetch:    結果セットの取り出し（db/queries）
+#     - excel:    踏み台Excelでの実行・取り出し（services/query_service, practice_service）
+#     - compare:  結果セットの比較（services/practice_service）
+#     - render:   テンプレートの描画（views/metrics）
+#   正誤判定ではユーザークエリ・正解クエリを並行して流すので、`scope("user")`の中では
+#   `user.execute`のように段階名に前置きをつけて分けて数える
+#   計測中でなければ何もしない（ベンチマークやジョブ以外のスレッドから呼んでも軽い）
+#   終わったら段階ごとの時間を`Server-Timing`ヘッダにし、`/metrics`のヒストグラムに足す
+import contextvars
+import functools
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager, nullcontext
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from dbapp.config import TIMING_SECONDS_BUCKETS, TIMING_ROWS_BUCKETS
+
+# `check_mode`が決まらないリクエスト（SQLコンソールなど）のラベル
+NO_CHECK_MODE = "none"
+
+class Histogram:
+    """ 累積型のヒストグラム（Prometheusの`histogram`と同じ形）
+    """
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        # 呼び出し側のロックの中で使う
+        self._counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def snapshot(self) -> dict:
+        cumulative = []
+        running = 0
+        for bound, count in zip(self.buckets + (float("inf"), ), self._counts):
+            running += count
+            cumulative.append(["+Inf" if bound == float("inf") else bound, running])
+        return {"buckets": cumulative, "count": self.count, "sum": self.sum}
+
+class HistogramFamily:
+    """ ラベルの値の組ごとに`Histogram`を持つ（Prometheusの1つのメトリクス名）
+    """
+
+    def __init__(self, name: str, description: str, label_names: Tuple[str, ...], buckets):
+        self.name = name
+        self.description = description
+        self.label_names = label_names
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._series: Dict[Tuple[str, ...], Histogram] = {}
+
+    def observe(self, label_values: Tuple[str, ...], value: float) -> None:
+        with self._lock:
+            histogram = self._series.get(label_values)
+            if histogram is None:
+                histogram = self._series[label_values] = Histogram(self.buckets)
+            histogram.observe(value)
+
+    def render(self) -> List[str]:
+        """ Prometheusのテキスト形式の行を返す
+        """
+        with self._lock:
+            series = [(values, histogram.snapshot()) for values, histogram in sorted(self._series.items())]
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        for values, snapshot in series:
+            lines.extend(format_histogram(self.name, snapshot, dict(zip(self.label_names, values))))
+        return lines
+
+REQUEST_SECONDS = HistogramFamily(
+    "dbapp_request_duration_seconds", "リクエスト全体の処理時間（秒）",
+    ("route", "check_mode"), TIMING_SECONDS_BUCKETS)
+PHASE_SECONDS = HistogramFamily(
+    "dbapp_request_phase_seconds", "リクエスト内の処理段階ごとの時間（秒）",
+    ("route", "check_mode", "phase"), TIMING_SECONDS_BUCKETS)
+REQUEST_ROWS = HistogramFamily(
+    "dbapp_request_rows", "リクエストで取得した行数",
+    ("route", "check_mode"), TIMING_ROWS_BUCKETS)
+
+class RequestTiming:
+    """ 1リクエスト分の計測値（処理段階ごとの合計秒数、取得した行数、ラベル）
+        正誤判定のワーカーからも足し込むので、更新はロックの中で行う
+    """
+
+    def __init__(self, route: str):
+        self.route = route
+        self.labels: Dict[str, str] = {"check_mode": NO_CHECK_MODE}
+        self.phases: Dict[str, float] = {}
+        self.rows = 0
+        self.started_at = time.perf_counter()
+        self.elapsed: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def add(self, name: str, seconds: float) -> None:
+        with self._lock:
+            self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def add_rows(self, count: int) -> None:
+        with self._lock:
+            self.rows += count
+
+    def stop(self) -> float:
+        """ 計測を終えて、全体の秒数を返す（2回目以降は最初の値を返す）
+        """
+        if self.elapsed is None:
+            self.elapsed = time.perf_counter() - self.started_at
+        return self.elapsed
+
+    def server_timing(self) -> str:
+        """ `Server-Timing`ヘッダの値（ミリ秒）
+        """
+        with self._lock:
+            phases = list(self.phases.items())
+            rows = self.rows
+        parts = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in phases]
+        parts.append(f'rows;desc="{rows}"')
+        parts.append(f"total;dur={self.stop() * 1000:.1f}")
+        return ", ".join(parts)
+
+class _Phase:
+    __slots__ = ("timing", "name", "started_at")
+
+    def __init__(self, timing: RequestTiming, name: str):
+        self.timing = timing
+        self.name = name
+
+    def __enter__(self):
+        self.started_at = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.timing.add(self.name, time.perf_counter() - self.started_at)
+        return False
+
+_current: contextvars.ContextVar[Optional[RequestTiming]] = contextvars.ContextVar(
+    "dbapp_request_timing", default=None)
+_scope: contextvars.ContextVar[str] = contextvars.ContextVar("dbapp_timing_scope", default="")
+_NOT_MEASURING = nullcontext()
+
+def start(route: str) -> Tuple[RequestTiming, contextvars.Token]:
+    """ 計測を始める（`finish()`に戻り値の2つ目を渡して終える）
+    """
+    timing = RequestTiming(route)
+    return timing, _current.set(timing)
+
+def finish(token: contextvars.Token) -> None:
+    """ `start()`の前の状態に戻す（集計は`observe()`で別に行う）
+    """
+    _current.reset(token)
+
+def current() -> Optional[RequestTiming]:
+    return _current.get()
+
+@contextmanager
+def measure(route: str) -> Iterator[RequestTiming]:
+    """ `with`の中を1回分として計測し、抜けるときにヒストグラムに足す（ジョブ用）
+    """
+    timing, token = start(route)
+    try:
+        yield timing
+    finally:
+        finish(token)
+        observe(timing)
+
+def phase(name: str):
+    """ `with`の中の時間を処理段階`name`の時間として足し込む
+    """
+    timing = _current.get()
+    if timing is None:
+        return _NOT_MEASURING
+    return _Phase(timing, _scope.get() + name)
+
+@contextmanager
+def scope(prefix: str) -> Iterator[None]:
+    """ `with`の中で足し込む段階名に`prefix.`を前置きする
+    """
+    token = _scope.set(f"{_scope.get()}{prefix}.")
+    try:
+        yield
+    finally:
+        _scope.reset(token)
+
+def add_rows(count: int) -> None:
+    timing = _current.get()
+    if timing is not None:
+        timing.add_rows(count)
+
+def set_label(name: str, value: str) -> None:
+    timing = _current.get()
+    if timing is not None:
+        timing.labels[name] = str(value)
+
+def wrap(func: Callable) -> Callable:
+    """ 今の計測を引き継いで`func`を呼ぶ関数を返す（別スレッドのワーカーに渡すとき用）
+        呼び出しごとに作り直すこと（同じコンテキストには同時に入れない）
+    """
+    return functools.partial(contextvars.copy_context().run, func)
+
+def observe(timing: RequestTiming) -> None:
+    """ 1リクエスト分の計測値をヒストグラムに足す
+    """
+    check_mode = timing.labels.get("check_mode", NO_CHECK_MODE)
+    labels = (timing.route, check_mode)
+    REQUEST_SECONDS.observe(labels, timing.stop())
+    REQUEST_ROWS.observe(labels, timing.rows)
+    with timing._lock:
+        phases = list(timing.phases.items())
+    for name, seconds in phases:
+        PHASE_SECONDS.observe(labels + (name, ), seconds)
+
+def render_metrics() -> List[str]:
+    """ 計測値のヒストグラムをPrometheusのテキスト形式の行で返す
+    """
+    lines: List[str] = []
+    for family in (REQUEST_SECONDS, PHASE_SECONDS, REQUEST_ROWS):
+        lines.extend(family.render())
+    return lines
+
+# ----------------------------------------------------------------------
+# Prometheusのテキスト形式
+# ----------------------------------------------------------------------
+def format_sample(name: str, value, labels: Optional[Dict[str, str]]=None) -> str:
+    if labels:
+        text = ",".join(f'{key}="{_escape(str(val))}"' for key, val in labels.items())
+        name = f"{name}{{{text}}}"
+    return f"{name} {_format_value(value)}"
+
+def format_histogram(name: str, snapshot: dict, labels: Optional[Dict[str, str]]=None) -> List[str]:
+    """ `Histogram.snapshot()`の形のdictを`_bucket` / `_sum` / `_count`の行にする
+    """
+    labels = labels or {}
+    lines = [
+        format_sample(f"{name}_bucket", count, {**labels, "le": str(bound)})
+        for bound, count in snapshot["buckets"]
+    ]
+    lines.append(format_sample(f"{name}_sum", snapshot["sum"], labels))
+    lines.append(format_sample(f"{name}_count", snapshot["count"], labels))
+    return lines
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_value(value) -> str:
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, int):
+        return str(value)
+    return repr(float(value))
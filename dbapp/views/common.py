@@ -0,0 +1,84 @@
+# 各ページ（Blueprint）で共通に使う処理
+import hmac
+from functools import wraps
+
+from flask import current_app, flash, request
+
+from dbapp.config import RESULT_PAGE_SIZE, QUERY_TIMEOUT
+import dbapp.db.queries as dbq
+from dbapp.services.query_service import exec_query_page
+from dbapp.services.session_service import (
+    save_query_editor_height, set_scroll_to_editor, get_page_info_from_session,
+    get_session_id)
+from dbapp.services.admission_service import admit
+
+def using_excel() -> bool:
+    # DB接続に踏み台Excelを使うかどうか（`create_app()`の設定）
+    return current_app.config["USING_EXCEL"]
+
+def admin_required(view):
+    """ 管理用Web APIにつけるデコレータ
+        `.env`の`ADMIN_TOKEN`と同じ値を`X-Admin-Token`ヘッダで送ったときだけ通す
+        （`ADMIN_TOKEN`が未設定なら、管理用Web APIは使えない）
+        ヘッダで確かめるので、CSRFトークンの確認は`create_app()`で外している
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        token = current_app.config.get("ADMIN_TOKEN")
+        if not token:
+            return {"error": "ADMIN_TOKEN is not configured"}, 403
+        sent = request.headers.get("X-Admin-Token", "")
+        if not hmac.compare_digest(sent.encode("utf-8"), token.encode("utf-8")):
+            return {"error": "Forbidden"}, 403
+        return view(*args, **kwargs)
+    return wrapper
+
+def exec_sql_query(sql_query: str, page: str, use_excel: bool=False,
+                   result_page: int=1, page_size: int=RESULT_PAGE_SIZE) -> tuple[list, list, dict | None]:
+    # クエリ実行 -> 指定ページのレコードセットだけ取得
+    #   実行期限はリクエストを受け付けた時点から数える（受付待ちの時間も含む）
+    deadline = dbq.Deadline(QUERY_TIMEOUT)
+    with admit(get_session_id(), timeout=deadline.remaining()):
+        columns, rows, message, category, page_info = exec_query_page(
+            sql_query=sql_query,
+            page=result_page,
+            page_size=page_size,
+            use_excel=use_excel,
+            deadline=deadline
+        )
+    # フラッシュメッセージ
+    flash(message, category)
+    # セッションにスクロールフラグを立てる
+    set_scroll_to_editor(page, True)
+    # レコードセットとページ情報を返す
+    return columns, rows, page_info
+
+def requested_result_page(source, page: str) -> tuple[int, int]:
+    # 結果セットのページ番号と1ページの行数をリクエストから取り出す
+    #   行数の指定がなければ、直近の実行時の行数を引き継ぐ
+    last_page_info = get_page_info_from_session(page) or {}
+    result_page = source.get("page", 1, type=int)
+    page_size = source.get(
+        "page_size", last_page_info.get("page_size", RESULT_PAGE_SIZE), type=int)
+    return result_page, page_size
+
+def prepare_exec_query(form, page: str) -> tuple[str, str | None]:
+    # クエリ実行の前処理
+    sql_query = form.get("sql_query", "").strip()
+     # CodeMirrorラッパーの高さを保存
+    sql_query_height = request.form.get("sql_query_height")
+    if sql_query_height:
+        # エディタの高さをセッションに保存
+        save_query_editor_height(
+            sql_query_height=sql_query_height,
+            page=page,
+        )
+    return sql_query, sql_query_height
+
+# 混雑で実行を断ったとき -> 429と再試行の目安を返す（`create_app()`で登録）
+def handle_admission_rejected(e):
+    message = f"( ´,_ゝ`) < {e} {e.retry_after}秒ほど待ってから、もう一度実行してね。"
+    headers = {"Retry-After": str(e.retry_after)}
+    if request.path.startswith("/api/"):
+        return {"error": message, "retry_after": e.retry_after}, 429, headers
+    return message, 429, headers
@@ -0,0 +1,304 @@
+# SQLコンソール（トップページ・playground）と、結果セットまわりのWeb API
+from datetime import datetime
+
+from flask import (
+    Blueprint, Response, abort, current_app, flash, redirect, render_template,
+    request, url_for)
+
+from dbapp.config import (
+    DEFAULT_COLUMNS, DEFAULT_ROWS, RESULT_WINDOW_SIZE, MAX_RESULT_WINDOW_SIZE,
+)
+import dbapp.db.queries as dbq
+from dbapp.db.exceptions import DatabaseExecutionError, QueryTimeoutError
+from dbapp.services.file_service import (
+    # ユーザクエリの保存
+    save_query_to_file,
+    # 結果セットの一時保存まわり
+    save_temp_result, get_temp_result_stats, load_temp_result_window)
+from dbapp.services.session_service import (
+    # エディタのクエリ保存関係
+    save_editor_query, get_editor_query,
+    # エディタの高さ関連
+    load_query_editor_height,
+    # エディタへのスクロールフラグ
+    set_scroll_to_editor, pop_scroll_to_editor,
+    # クエリ実行結果
+    save_result_to_session, get_result_from_session,
+    get_page_info_from_session, get_result_id_from_session,
+    # 受付制御用のセッションID
+    get_session_id
+)
+from dbapp.services.admission_service import get_admission_stats
+from dbapp.services.answer_digest_service import invalidate_answer_digests
+from dbapp.services.result_cache_service import (
+    get_result_cache_stats, set_result_cache_enabled, invalidate_result_cache)
+from dbapp.services.export_service import (
+    EXPORT_FORMATS, open_export, iter_csv, iter_ndjson)
+from dbapp.views.common import (
+    admin_required, using_excel, exec_sql_query, requested_result_page, prepare_exec_query)
+
+bp = Blueprint("console", __name__)
+
+# トップページ
+@bp.route("/", methods=["GET", "POST"])
+def index():
+    # ローカル変数初期化
+    sql_query: str = ''
+    columns: list = []
+    rows: list = []
+    scroll_to_editor: bool = False
+    # POSTリクエストのとき
+    if request.method == "POST":
+        # クエリ実行準備
+        sql_query, sql_query_height = prepare_exec_query(form=request.form, page="index")
+
+        # 「保存」ボタンが押された
+        if "save" in request.form:
+            # ユーザが入力したファイル名を取得
+            user_filename = request.form.get("filename", "").strip()
+            # クエリ保存関数呼び出し
+            filename, message, category = save_query_to_file(
+                sql_query=sql_query,
+                user_filename=user_filename,
+                storage_dir=current_app.config["STORAGE_DIR"])
+
+            flash(f"{message}{filename}", category)
+
+            # エディタのクエリをセッションに保存
+            save_editor_query(sql_query=sql_query, page="index")
+            # セッションにスクロールフラグを立てる
+            set_scroll_to_editor(True)
+            # トップページにリダイレクト
+            return redirect(url_for("console.index"))
+        elif "execute" in request.form:
+            # エディタのクエリをセッションに保存（混雑で断られても消えないよう先に）
+            save_editor_query(sql_query=sql_query, page="index")
+            # クエリ実行 -> 1ページ目のレコードセット取得
+            _, page_size = requested_result_page(request.form, page="index")
+            columns, rows, page_info = exec_sql_query(
+                sql_query=sql_query, page="index", use_excel=using_excel(), page_size=page_size)
+            # 結果（表示するページの分だけ）を一時ファイルに保存
+            temp_id = save_temp_result(columns, rows)
+            save_result_to_session(page="index", temp_id=temp_id, page_info=page_info)
+            # セッションにスクロールフラグを立てる
+            set_scroll_to_editor(True)
+            # トップページにリダイレクト
+            return redirect(url_for("console.index"))
+
+    # ページ送り（`?page=N`）のとき
+    #   -> 直近のクエリを指定ページで実行し直してリダイレクト
+    elif "page" in request.args:
+        sql_query = get_editor_query("index")
+        result_page, page_size = requested_result_page(request.args, page="index")
+        columns, rows, page_info = exec_sql_query(
+            sql_query=sql_query, page="index", use_excel=using_excel(),
+            result_page=result_page, page_size=page_size)
+        temp_id = save_temp_result(columns, rows)
+        save_result_to_session(page="index", temp_id=temp_id, page_info=page_info)
+        return redirect(url_for("console.index"))
+
+    # GETリクエストのとき
+    else:
+        # セッションに保存した直近のクエリをテンプレートに渡す
+        sql_query = get_editor_query("index")
+        columns, rows = get_result_from_session("index")
+        page_info = get_page_info_from_session("index")
+        # 結果グリッドは一時保存した結果セットをAPIから少しずつ取得する
+        result_id = get_result_id_from_session("index")
+        if not columns:
+            # デフォルトの擬似テーブルを表示
+            columns, rows = [DEFAULT_COLUMNS, DEFAULT_ROWS]
+            page_info = None
+            result_id = None
+
+    # エディタの高さ情報をセッションから取り出し
+    sql_query_height = load_query_editor_height("index")
+    # エディタへのスクロールフラグをセッションから取り出し
+    scroll_to_editor = pop_scroll_to_editor("index")
+
+    # レコードセットをテンプレートに渡す
+    return render_template(
+        "pages/top/index.html",
+        columns=columns,
+        rows=rows,
+        page_info=page_info,
+        result_id=result_id,
+        pager_endpoint="console.index",
+        export_page="index",
+        table_names=dbq.TABLE_NAMES,
+        sql_query=sql_query,
+        sql_query_height=sql_query_height,
+        scroll_to_editor=scroll_to_editor
+    )
+
+# クエリを実行するだけのページ
+@bp.route('/playground', methods=['GET', 'POST'])
+def playground():
+    # ローカル変数初期化
+    sql_query: str = ''
+    columns: list = []
+    rows: list = []
+    page_info: dict | None = None
+    result_id: str | None = None
+    scroll_to_editor: bool = False
+
+    if request.method == 'POST':
+        # クエリ実行準備
+        sql_query, sql_query_height = prepare_exec_query(form=request.form, page="playground")
+        # エディタのクエリをセッションに保存（ページ送り用）
+        save_editor_query(sql_query=sql_query, page="playground")
+        # クエリ実行 -> 1ページ目のレコードセット取得
+        _, page_size = requested_result_page(request.form, page="playground")
+        columns, rows, page_info = exec_sql_query(
+            sql_query=sql_query, page="playground", use_excel=using_excel(), page_size=page_size)
+    elif "page" in request.args:
+        # ページ送り -> 直近のクエリを指定ページで実行し直す
+        sql_query = get_editor_query("playground")
+        result_page, page_size = requested_result_page(request.args, page="playground")
+        columns, rows, page_info = exec_sql_query(
+            sql_query=sql_query, page="playground", use_excel=using_excel(),
+            result_page=result_page, page_size=page_size)
+    else:
+        # セッションに保存した直近のクエリをテンプレートに渡す
+        sql_query = get_editor_query("playground")
+        # 直前に実行した結果があれば表示
+        columns, rows = get_result_from_session("playground")
+        page_info = get_page_info_from_session("playground")
+        result_id = get_result_id_from_session("playground")
+        if not columns:
+            # デフォルトの擬似テーブルを表示
+            columns, rows = [DEFAULT_COLUMNS, DEFAULT_ROWS]
+            page_info = None
+            result_id = None
+
+    if page_info is not None and (request.method == "POST" or "page" in request.args):
+        # 結果グリッド用に一時保存し、次のページ送りで行数を引き継ぐためページ情報も残す
+        result_id = save_temp_result(columns, rows)
+        save_result_to_session(page="playground", temp_id=result_id, page_info=page_info)
+
+    # エディタの高さ情報をセッションから取り出し
+    sql_query_height = load_query_editor_height(page="playground")
+    # エディタへのスクロールフラグをセッションから取り出し
+    scroll_to_editor = pop_scroll_to_editor(page="playground")
+
+    return render_template(
+        'pages/_legacy/playground.html',
+        columns=columns,
+        rows=rows,
+        page_info=page_info,
+        result_id=result_id,
+        pager_endpoint="console.playground",
+        export_page="playground",
+        table_names=dbq.TABLE_NAMES,
+        sql_query=sql_query,
+        sql_query_height=sql_query_height,
+        scroll_to_editor=scroll_to_editor
+    )
+
+# 結果をエクスポートできるページ
+EXPORT_PAGES = ("index", "playground")
+
+# 直近に実行したクエリの結果をCSV / NDJSONでダウンロードさせる
+#   `?format=csv|ndjson`、CSVは`&bom=1`でBOMつき（Excel向け）
+#   クエリを実行し直し、カーソルから少しずつ読んでそのまま流す
+@bp.route("/export/<page>")
+def export_result(page):
+    if page not in EXPORT_PAGES:
+        abort(404)
+    fmt = request.args.get("format", "csv")
+    if fmt not in EXPORT_FORMATS:
+        abort(400, "( ´,_ゝ`) < 形式はcsvかndjsonを指定してね。")
+    bom = request.args.get("bom") == "1"
+    sql_query = get_editor_query(page)
+    if not sql_query:
+        abort(404, "( ´,_ゝ`) < エクスポートするクエリがないｗｗｗ")
+
+    # ここまでに起きたエラーは、ダウンロードを始める前にステータスコードで返す
+    try:
+        columns, chunks, resources = open_export(
+            sql_query=sql_query, session_id=get_session_id(), use_excel=using_excel())
+    except ValueError as e:
+        abort(400, f"( ´,_ゝ｀) < {e}")
+    except QueryTimeoutError as e:
+        abort(504, f"( ´,_ゝ`) < {e}")
+    except (DatabaseExecutionError, RuntimeError) as e:
+        abort(400, f"( ´,_ゝ`) < クエリ実行に失敗しました。{e}")
+
+    if fmt == "csv":
+        body = iter_csv(columns, chunks, bom=bom)
+    else:
+        body = iter_ndjson(columns, chunks)
+    filename = f"query_result_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{fmt}"
+    response = Response(
+        body,
+        content_type=EXPORT_FORMATS[fmt],
+        headers={
+            "Content-Disposition": f'attachment; filename="{filename}"',
+            "Cache-Control": "no-store",
+            # リバースプロキシにバッファさせない
+            "X-Accel-Buffering": "no",
+        }
+    )
+    # 送り終えたら（途中で切られても）実行枠とコネクションを返す
+    response.call_on_close(resources.close)
+    return response
+
+# 一時保存した結果セットの一部（JSON）を返すWeb API（結果グリッドのスクロール用）
+#   `?offset=N&limit=M`で、N行目（0始まり）からM行を返す
+#   結果IDは推測できないUUIDなので、IDを知っていることを閲覧の条件にする
+@bp.route("/api/results/<result_id>")
+def api_result_window(result_id):
+    offset = max(request.args.get("offset", 0, type=int), 0)
+    limit = request.args.get("limit", RESULT_WINDOW_SIZE, type=int)
+    limit = min(max(limit, 1), MAX_RESULT_WINDOW_SIZE)
+    window = load_temp_result_window(result_id, offset=offset, limit=limit)
+    if window is None:
+        # 期限切れ・追い出し済み
+        return {"error": "Result not found"}, 404
+    return window
+
+# 受付制御の統計情報（JSON）を返すWeb API
+@bp.route("/api/stats/admission")
+def api_admission_stats():
+    # 実行中・待ち行列の数と、待ち時間・行列の長さのヒストグラム
+    return get_admission_stats()
+
+# 結果セット一時保存の統計情報（JSON）を返すWeb API
+@bp.route("/api/stats/temp_results")
+def api_temp_result_stats():
+    # ヒット・ミス・追い出し・期限切れの回数と、件数・合計サイズ
+    return get_temp_result_stats()
+
+# 結果キャッシュの統計情報（JSON）を返すWeb API
+@bp.route("/api/stats/result_cache")
+def api_result_cache_stats():
+    # ヒット率、件数・合計サイズ、追い出しの回数
+    return get_result_cache_stats()
+
+# 結果キャッシュの管理用Web API（`X-Admin-Token`ヘッダが必要）
+#   `enabled`（`true` / `false`）を送ると有効・無効を切り替える
+@bp.route("/api/admin/result_cache", methods=["POST"])
+@admin_required
+def api_result_cache_toggle():
+    enabled = request.form.get("enabled", "").lower()
+    if enabled not in ("true", "false"):
+        return {"error": "Invalid enabled"}, 400
+    set_result_cache_enabled(enabled == "true")
+    return get_result_cache_stats()
+
+# データセットを入れ替えたときに呼ぶWeb API（`X-Admin-Token`ヘッダが必要）
+#   結果キャッシュと保存済みの正解の要約を捨て、テーブル構造も読み直す
+@bp.route("/api/admin/result_cache/invalidate", methods=["POST"])
+@admin_required
+def api_result_cache_invalidate():
+    invalidate_result_cache()
+    stats = get_result_cache_stats()
+    try:
+        stats["answer_digests_deleted"] = invalidate_answer_digests()
+    except Exception as e:
+        stats["answer_digest_error"] = str(e)
+    try:
+        current_app.extensions["schema_cache"].refresh()
+    except Exception as e:
+        stats["schema_error"] = str(e)
+    return stats
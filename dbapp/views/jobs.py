@@ -0,0 +1,149 @@
+# クエリ実行・正誤判定の非同期ジョブ（Web APIと結果ページ）
+from flask import Blueprint, Response, abort, flash, redirect, request, url_for
+
+from dbapp.services.file_service import save_temp_result
+from dbapp.services.job_service import (
+    submit_query_job, submit_judge_job, get_job, cancel_job, get_job_stats,
+    job_result_json, iter_job_events)
+from dbapp.services.session_service import (
+    save_editor_query, set_scroll_to_editor, save_result_to_session, get_session_id)
+from dbapp.views.common import using_excel, requested_result_page, prepare_exec_query
+from dbapp.views.practice import parse_judge_form, render_judge_result
+
+bp = Blueprint("jobs", __name__)
+
+# ジョブでクエリを実行できるページ
+JOB_QUERY_PAGES = ("index", "playground")
+
+def _get_job_or_404(job_id: str):
+    # 自分のセッションのジョブだけ見せる
+    job = get_job(job_id, get_session_id())
+    if job is None:
+        abort(404)
+    return job
+
+def _job_urls(job_id: str) -> dict:
+    return {
+        "status_url": url_for("jobs.api_job_status", job_id=job_id),
+        "events_url": url_for("jobs.api_job_events", job_id=job_id),
+        "result_url": url_for("jobs.api_job_result", job_id=job_id),
+        "cancel_url": url_for("jobs.api_job_cancel", job_id=job_id),
+        "view_url": url_for("jobs.job_result_view", job_id=job_id),
+    }
+
+# クエリ実行・正誤判定をジョブとして受け付けるWeb API
+#   `kind`が`query`ならクエリ実行（`page`は`index`/`playground`）、`judge`なら正誤判定
+#   すぐにジョブIDを返し、実行はワーカーに任せる
+@bp.route("/api/jobs", methods=["POST"])
+def api_submit_job():
+    kind = request.form.get("kind", "query")
+    session_id = get_session_id()
+    if kind == "query":
+        page = request.form.get("page", "index")
+        if page not in JOB_QUERY_PAGES:
+            return {"error": "Invalid page"}, 400
+        sql_query, _ = prepare_exec_query(form=request.form, page=page)
+        save_editor_query(sql_query=sql_query, page=page)
+        _, page_size = requested_result_page(request.form, page=page)
+        job = submit_query_job(
+            session_id=session_id,
+            sql_query=sql_query,
+            page=page,
+            page_size=page_size,
+            use_excel=using_excel()
+        )
+    elif kind == "judge":
+        question_info, answer_query, checkmode, user_query, org_user_query = parse_judge_form(request.form)
+        job = submit_judge_job(
+            session_id=session_id,
+            user_query=user_query,
+            answer_query=answer_query,
+            check_mode=checkmode,
+            question_info=question_info,
+            use_excel=using_excel()
+        )
+        job.params["user_query"] = org_user_query
+    else:
+        return {"error": "Invalid kind"}, 400
+    # `202`: Accepted
+    return {"job_id": job.id, **_job_urls(job.id), **job.snapshot()}, 202
+
+# ジョブの進捗（JSON）を返すWeb API
+@bp.route("/api/jobs/<job_id>")
+def api_job_status(job_id):
+    job = _get_job_or_404(job_id)
+    return job.snapshot()
+
+# ジョブの進捗をServer-Sent Eventsで流すWeb API
+@bp.route("/api/jobs/<job_id>/events")
+def api_job_events(job_id):
+    job = _get_job_or_404(job_id)
+    return Response(
+        iter_job_events(job),
+        mimetype="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            # リバースプロキシにバッファさせない
+            "X-Accel-Buffering": "no",
+        }
+    )
+
+# ジョブの結果（JSON）を返すWeb API
+@bp.route("/api/jobs/<job_id>/result")
+def api_job_result(job_id):
+    job = _get_job_or_404(job_id)
+    if not job.finished:
+        # `409`: Conflict（まだ終わっていない）
+        return {"error": "Job is not finished", **job.snapshot()}, 409
+    return {**job.snapshot(), "result": job_result_json(job) if job.result else None}
+
+# ジョブを中断するWeb API
+@bp.route("/api/jobs/<job_id>/cancel", methods=["POST"])
+def api_job_cancel(job_id):
+    job = cancel_job(job_id, get_session_id())
+    if job is None:
+        abort(404)
+    return job.snapshot()
+
+# ジョブの統計情報（JSON）を返すWeb API
+@bp.route("/api/stats/jobs")
+def api_job_stats():
+    return get_job_stats()
+
+# ジョブの結果をページに反映する
+#   クエリ実行 -> 結果をセッションに保存して元のページにリダイレクト
+#   正誤判定 -> 判定結果ページを表示
+@bp.route("/jobs/<job_id>/result")
+def job_result_view(job_id):
+    job = _get_job_or_404(job_id)
+    if not job.finished:
+        abort(409, "( ´,_ゝ`) < まだ実行中です。")
+
+    if job.kind == "judge":
+        if job.result is None:
+            flash(_job_failure_message(job), "error")
+            question_info = job.params["question_info"]
+            return redirect(url_for(
+                "practice.practice_detail",
+                chapter=question_info[0], section=question_info[1], question=question_info[2]))
+        return render_judge_result(
+            question_info=job.params["question_info"],
+            user_query=job.params["user_query"],
+            **job.result
+        )
+
+    page = job.params["page"]
+    if job.result is None:
+        flash(_job_failure_message(job), "error")
+    else:
+        result = job.result
+        flash(result["message"], result["category"])
+        temp_id = save_temp_result(result["columns"], result["rows"])
+        save_result_to_session(page=page, temp_id=temp_id, page_info=result["page_info"])
+    set_scroll_to_editor(page, True)
+    return redirect(url_for(f"console.{page}"))
+
+def _job_failure_message(job) -> str:
+    if job.phase == "cancelled":
+        return "( ´,_ゝ`) < クエリの実行を中断しました。"
+    return f"( ´,_ゝ`) < クエリ実行に失敗しました。{job.error or ''}"
@@ -0,0 +1,119 @@
+# 処理時間の計測（Server-Timingヘッダ）と、Prometheus形式の`/metrics`
+#   計測の仕組みは`dbapp/timing.py`、各層の計測点はそれぞれのモジュールにある
+import time
+from numbers import Number
+
+from flask import Blueprint, Response, current_app, g, request, template_rendered, before_render_template
+
+from dbapp import timing
+from dbapp.db.connection import get_pool_stats
+from dbapp.services.admission_service import get_admission_stats
+from dbapp.services.answer_digest_service import get_answer_digest_stats
+from dbapp.services.file_service import get_temp_result_stats
+from dbapp.services.job_service import get_job_stats
+from dbapp.services.result_cache_service import get_result_cache_stats
+from dbapp.services.slow_query_service import (
+    ORDER_COLUMNS, get_slow_query_stats, get_top_fingerprints)
+
+bp = Blueprint("metrics", __name__)
+
+# 計測しないエンドポイント（静的ファイル）
+_UNTIMED_ENDPOINTS = ("static", )
+
+def init_timing(app) -> None:
+    """ リクエストごとの計測を`app`に組み込む（`create_app()`から呼ぶ）
+        `SERVER_TIMING`が真なら、応答に`Server-Timing`ヘッダをつける
+    """
+    app.before_request(_start_timing)
+    app.after_request(_finish_timing)
+    app.teardown_request(_reset_timing)
+    before_render_template.connect(_start_render, app)
+    template_rendered.connect(_finish_render, app)
+
+def _start_timing():
+    if request.endpoint in _UNTIMED_ENDPOINTS:
+        return
+    # ルートのラベルはエンドポイント名（URLの値を含めないので、種類が増えすぎない）
+    g.request_timing, g.request_timing_token = timing.start(request.endpoint or "unmatched")
+    g.render_started = []
+
+def _finish_timing(response):
+    request_timing = g.pop("request_timing", None)
+    if request_timing is None:
+        return response
+    # ストリーミングで返す本文（エクスポート・SSE）の時間は含まない
+    if current_app.config["SERVER_TIMING"]:
+        response.headers["Server-Timing"] = request_timing.server_timing()
+    timing.observe(request_timing)
+    return response
+
+def _reset_timing(exc):
+    token = g.pop("request_timing_token", None)
+    if token is not None:
+        timing.finish(token)
+
+def _start_render(sender, template, context, **extra):
+    if "render_started" in g:
+        g.render_started.append(time.perf_counter())
+
+def _finish_render(sender, template, context, **extra):
+    # 描画の中で別のテンプレートを描画したときは、外側の分だけ数える
+    started = g.get("render_started")
+    if not started:
+        return
+    started_at = started.pop()
+    request_timing = timing.current()
+    if not started and request_timing is not None:
+        request_timing.add("render", time.perf_counter() - started_at)
+
+# Prometheus形式のメトリクス
+#   - 計測値のヒストグラム（リクエスト全体・処理段階ごとの時間、取得した行数）
+#   - 各統計情報API（`/api/stats/...`）の数値（ゲージ）
+@bp.route("/metrics")
+def metrics():
+    lines = timing.render_metrics()
+    stats = {
+        "admission": get_admission_stats(),
+        "temp_results": get_temp_result_stats(),
+        "jobs": get_job_stats(),
+        "schema": current_app.extensions["schema_cache"].stats(),
+        "page_cache": current_app.extensions["page_fragments"].stats(),
+        "pool": get_pool_stats(),
+        "slow_queries": get_slow_query_stats(),
+        "result_cache": get_result_cache_stats(),
+        "answer_digests": get_answer_digest_stats(),
+    }
+    for name, values in stats.items():
+        lines.extend(_stats_lines(f"dbapp_{name}", values))
+    return Response("\n".join(lines) + "\n", mimetype="text/plain; version=0.0.4")
+
+# 遅いクエリの指紋ごとの集計（JSON）を返すWeb API
+#   `order`: 並べ替え（`total` / `p95` / `calls` / `max`）、`limit`: 件数（最大100）
+@bp.route("/api/stats/slow_queries")
+def api_slow_queries():
+    order = request.args.get("order", "total")
+    if order not in ORDER_COLUMNS:
+        return {"error": "Invalid order"}, 400
+    limit = min(max(request.args.get("limit", 20, type=int), 1), 100)
+    return {
+        **get_slow_query_stats(),
+        "order": order,
+        "fingerprints": get_top_fingerprints(order=order, limit=limit),
+    }
+
+def _stats_lines(prefix: str, values: dict) -> list:
+    # 入れ子のdictは名前をつなげて平らにする
+    #   ヒストグラムの形（`buckets`・`count`・`sum`）ならヒストグラム、数値はゲージにする
+    #   文字列・None（ETag・最後のエラーなど）は出さない
+    lines = []
+    for key, value in values.items():
+        name = f"{prefix}_{key}"
+        if isinstance(value, dict) and "buckets" in value:
+            lines.append(f"# TYPE {name} histogram")
+            lines.extend(timing.format_histogram(name, value))
+        elif isinstance(value, dict):
+            lines.extend(_stats_lines(name, value))
+        elif isinstance(value, Number):
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(timing.format_sample(name, value))
+    return lines
@@ -0,0 +1,303 @@
+# 練習問題（一覧・問題ページ・正誤判定・問題の編集）
+import time
+
+from flask import (
+    Blueprint, Response, abort, current_app, flash, redirect, render_template,
+    request, session)
+from flask_wtf.csrf import generate_csrf
+from markupsafe import Markup
+
+from dbapp.config import QUERY_TIMEOUT
+import dbapp.db.queries as dbq
+from dbapp.db import practice_queries as pq
+from dbapp.db.practices import (
+    generate_structured_practice_list, get_catalog_version, fetch_question, fetch_answer
+)
+from dbapp.services.answer_digest_service import get_answer_digest_stats, schedule_digest_refresh
+from dbapp.services.file_service import save_temp_result
+from dbapp.services.page_cache_service import make_etag, is_not_modified
+# 正解/不正解判定用
+from dbapp.services.practice_service import compare_queries
+# 結果表示用データ取得用
+from dbapp.services.query_compare.messages import (
+    CompareResult,
+    COMPARE_RESULT_MESSAGES
+)
+from dbapp.services.session_service import (
+    save_editor_query, get_editor_query, pop_editor_query, clear_editor_query,
+    load_query_editor_height, clear_query_editor_height, get_session_id)
+from dbapp.services.admission_service import admit
+from dbapp.views.common import using_excel, prepare_exec_query
+
+bp = Blueprint("practice", __name__)
+
+def _page_fragments():
+    # 練習問題ページの描画済みHTML（`create_app()`で用意する）
+    return current_app.extensions["page_fragments"]
+
+def _cached_page(html_or_render, etag: str, last_modified: float, session_bound: bool=False):
+    # `If-None-Match` / `If-Modified-Since`が最新なら、描画せずに304を返す
+    # セッションで中身が変わるページは、ETagだけで判定して共有キャッシュにも載せない
+    if is_not_modified(etag, None if session_bound else last_modified):
+        response = Response(status=304)
+    else:
+        response = Response(html_or_render(), mimetype="text/html")
+    response.set_etag(etag)
+    response.last_modified = int(last_modified)
+    response.cache_control.no_cache = True
+    if session_bound:
+        response.cache_control.private = True
+        response.vary.add("Cookie")
+    return response
+
+def _editor_state(page: str) -> dict:
+    # 練習問題ページのうち、セッションによって変わる部分
+    #   エディタのクエリ・高さ、フラッシュメッセージ、CSRFトークン
+    #   （署名つきトークンは有効期限があるので、期限の半分ごとに作り直させる）
+    generate_csrf()
+    time_limit = current_app.config.get("WTF_CSRF_TIME_LIMIT", 3600)
+    return {
+        "query": get_editor_query(page),
+        "height": load_query_editor_height(page=page),
+        "flashes": session.get("_flashes"),
+        "csrf": session.get(current_app.config.get("WTF_CSRF_FIELD_NAME", "csrf_token")),
+        "csrf_period": int(time.time() // (time_limit / 2)) if time_limit else None,
+    }
+
+# 練習問題の一覧を表示するページ
+@bp.route('/practices', methods=['GET'])
+def practices():
+    # セッションに記録したエディタの高さ・入力クエリをクリアする
+    clear_editor_query(page="practice")
+    clear_query_editor_height(page="practice")
+
+    # 一覧は問題データだけで決まる -> バージョンが同じなら304、描画済みHTMLを使い回す
+    version, modified_at = get_catalog_version()
+    etag = make_etag("practices", version, current_app.config["TEMPLATE_FINGERPRINT"])
+    return _cached_page(
+        lambda: _page_fragments().get_or_render(
+            version, ("practices",),
+            lambda: render_template(
+                "pages/practices/index.html",
+                chapters=generate_structured_practice_list()
+            )
+        ),
+        etag=etag,
+        last_modified=modified_at
+    )
+
+# 練習問題のページ
+@bp.route('/practices/<int:chapter>/<int:section>/<int:question>', methods=["GET"])
+def practice_detail(chapter, section, question):
+    # 問題データを取得
+    row = fetch_question(
+        chapter_number=chapter,
+        section_number=section,
+        question_number=question
+    )
+
+    # レコードセットがない
+    if row is None:
+        abort(404, "( ´,_ゝ`)ﾌﾟｯ < 指定された問題がないｗｗｗ")
+
+    # ETagには問題データのバージョンと、セッションの状態（エディタのクエリなど）を混ぜる
+    version, modified_at = get_catalog_version()
+    key = (chapter, section, question)
+    etag = make_etag(
+        "practice_detail", version, key, current_app.config["TEMPLATE_FINGERPRINT"],
+        _editor_state("practice"))
+
+    # セッションにエディタの高さとクエリがあれば復元（304でも取り出しはする）
+    preserved_query = pop_editor_query(page="practice")
+    sql_query_height = load_query_editor_height(page="practice")
+
+    def render():
+        # 問題文の部分はセッションによらない -> 描画済みの断片を使い回す
+        question_html = _page_fragments().get_or_render(
+            version, ("practice_question", key),
+            lambda: render_template(
+                "components/practice_question/practice_question.html",
+                row=row
+            )
+        )
+        return render_template(
+            "pages/practices/practice_detail.html",
+            row=row,
+            question_html=Markup(question_html),
+            table_names=dbq.TABLE_NAMES,
+            sql_query=preserved_query,
+            sql_query_height=sql_query_height
+        )
+
+    return _cached_page(render, etag=etag, last_modified=modified_at, session_bound=True)
+
+@bp.route("/api/stats/page_cache")
+def api_page_cache_stats():
+    # 練習問題ページの断片キャッシュの統計情報
+    return _page_fragments().stats()
+
+@bp.route("/api/stats/answer_digests")
+def api_answer_digest_stats():
+    # 正解の要約の統計情報（判定で使えた回数・計算した件数など）
+    return get_answer_digest_stats()
+
+def parse_judge_form(form) -> tuple[tuple, str, str, str, str]:
+    """ 判定フォームから問題番号・正解クエリ・チェックモード・ユーザーのクエリを取り出す
+        併せてエディタの高さとクエリをセッションに保存する
+    """
+    # 章・節・問題番号を取得
+    chapter_number = form.get("chapter_number")
+    section_number = form.get("section_number")
+    question_number = form.get("question_number")
+    # タプルにまとめる
+    question_info = (
+        int(chapter_number),
+        int(section_number),
+        int(question_number)
+    )
+
+    # 正解クエリとチェックモードを取得（問題カタログから）
+    answer_data = fetch_answer(*question_info)
+    if answer_data is None:
+        abort(404, "( ´,_ゝ`)ﾌﾟｯ < 指定された問題がないｗｗｗ")
+    answer_query, checkmode = (answer_data["AnswerQuery"], answer_data["CheckMode"])
+
+    # ユーザが投稿したクエリを取得
+    org_user_query = form.get("sql_query", "")
+    #   併せてエディタの高さをセッションに保存
+    user_query, editor_height = prepare_exec_query(form=form, page="practice")
+    # エディタのクエリをセッションに保存
+    save_editor_query(sql_query=user_query, page="practice")
+    return question_info, answer_query, checkmode, user_query, org_user_query
+
+def render_judge_result(question_info: tuple, user_query: str, result, result_enum, message, detail,
+                        user_columns, user_rows, answer_columns, answer_rows):
+    """ 判定結果ページを描画する
+    """
+    # 次の問題の情報（タプル）を取得
+    next_question_info = pq.get_next_question_key(question_info)
+    # 合格だったら、セッションのクエリ情報は不要なのでポア
+    if result:
+        clear_editor_query(page="practice")
+    # 結果グリッド用に、両方の結果セットを一時保存する
+    user_result_id = save_temp_result(user_columns, user_rows) if user_columns else None
+    answer_result_id = save_temp_result(answer_columns, answer_rows) if answer_columns else None
+
+    return render_template(
+        "pages/practices/judge_result.html",
+        result=result,
+        result_enum=result_enum,
+        message=message,
+        detail=detail,
+        question_info=question_info,
+        next_question_info=next_question_info,
+        user_columns=user_columns,
+        user_rows=user_rows,
+        user_result_id=user_result_id,
+        answer_columns=answer_columns,
+        answer_rows=answer_rows,
+        answer_result_id=answer_result_id,
+        CompareResult=CompareResult,
+        COMPARE_RESULT_MESSAGES=COMPARE_RESULT_MESSAGES,
+        user_query=user_query.strip()
+    )
+
+@bp.route('/practices/judge_result', methods=["POST"])
+def judge_result():
+    """ 答案クエリと正解クエリを受け取って、正誤を判定
+        結果表示ページにリダイレクト
+    """
+    question_info, answer_query, checkmode, user_query, org_user_query = parse_judge_form(request.form)
+
+    # クエリの実行結果を判定
+    #   ユーザークエリと正解クエリを同時に流すので、実行枠は2つ使う
+    deadline = dbq.Deadline(QUERY_TIMEOUT)
+    with admit(get_session_id(), cost=2, timeout=deadline.remaining()):
+        (
+            result, result_enum, message, detail,
+            user_columns, user_rows,
+            answer_columns, answer_rows) = compare_queries(
+                user_query=user_query,
+                answer_query=answer_query,
+                check_mode=checkmode,
+                rule=None,
+                use_excel=using_excel(),
+                deadline=deadline,
+                question_key=question_info
+            )
+
+    return render_judge_result(
+        question_info=question_info,
+        user_query=org_user_query,
+        result=result,
+        result_enum=result_enum,
+        message=message,
+        detail=detail,
+        user_columns=user_columns,
+        user_rows=user_rows,
+        answer_columns=answer_columns,
+        answer_rows=answer_rows
+    )
+
+# 問題・正解クエリの編集ページ
+@bp.route(
+    "/questions/edit/<int:chapter>/<int:section>/<int:question>",
+    methods=["GET", "POST"])
+def questions_edit(chapter, section, question):
+    chapter_number = chapter
+    section_number = section
+    question_number = question
+    token = generate_csrf()
+
+    if request.method == "POST":
+        # フォームから受け取ったデータの検証
+        question_text = request.form.get("question_text", "").strip()
+        answer_query = request.form.get("answer_edit", "").strip()
+        check_mode = request.form.get("check_mode", "strict")
+        # 問題文・正解クエリが空 -> 不受理・差し戻し＆煽りメッセージ
+        if not question_text or not answer_query:
+            flash("m9(^Д^) < 問題文と正解クエリは必須ですｗｗｗ", "error")
+            return redirect(request.url)
+
+        # フォームから受け取った問題・クエリでDBを更新
+        try:
+            pq.update_question(
+                chapter_number=chapter,
+                section_number=section,
+                question_number=question,
+                question_text=question_text,
+                answer_query=answer_query,
+                check_mode=check_mode
+            )
+            flash("( *´∀`) < 更新しました。", "success")
+            # 正解クエリが変わったら、正解の要約を裏で計算し直す
+            if not using_excel():
+                schedule_digest_refresh((chapter, section, question))
+        except Exception as e:
+            flash(f"(((( ；ﾟДﾟ))) < 更新失敗……。{e}...", "error")
+            return redirect(request.url)
+
+        # 編集画面へリダイレクト
+        return redirect(request.url)
+
+    # DBから問題・正解クエリのデータを取得
+    result = pq.get_question_data(chapter_number=chapter_number, section_number=section_number, question_number=question_number)
+
+    chapter_title = result["ChapterTitle"]
+    section_title = result["SectionTitle"]
+    question_text = result["Question"]
+    answer_query = result["AnswerQuery"]
+    check_mode = result["CheckMode"]
+
+    return render_template(
+        'pages/editor/question_editor.html',
+        token=token,
+        chapter_number=chapter_number,
+        chapter_title=chapter_title,
+        section_number=section_number,
+        section_title=section_title,
+        question_number=question_number,
+        question_text=question_text,
+        answer_query=answer_query,
+        check_mode=check_mode
+    )
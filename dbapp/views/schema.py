@@ -0,0 +1,63 @@
+# テーブル構造（スキーマ）の表示とWeb API
+from flask import Blueprint, abort, current_app, render_template, request
+
+import dbapp.db.queries as dbq
+
+bp = Blueprint("schema", __name__)
+
+def _schema_cache():
+    # テーブル構造のキャッシュ（`create_app()`で用意する）
+    return current_app.extensions["schema_cache"]
+
+def _conditional_json(payload: dict, etag: str):
+    # ETagをつけて返す（`If-None-Match`が一致すれば`304`: Not Modified）
+    #   `no-cache`: キャッシュしてよいが、使う前に必ず再検証させる
+    response = current_app.make_response(payload)
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"
+    return response.make_conditional(request)
+
+# 全テーブルの構造データ（JSON）を返すWeb API
+#   {"etag": ..., "tables": {テーブル名: {"columns": [...], "rows": [...]}}}
+@bp.route("/api/tables")
+def api_tables():
+    snapshot = _schema_cache().snapshot()
+    return _conditional_json(snapshot, snapshot["etag"])
+
+# 各テーブルの構造データ（JSON）を返すWeb API
+@bp.route("/api/table/<table_name>")
+def api_table_structure(table_name):
+    allowed_tables = dbq.TABLE_NAMES
+    if table_name not in allowed_tables:
+        # JSONとステータスコード（`400`: Bad Request）を返す
+        return {"error": "Invalid table name"}, 400
+    # キャッシュから返す（`columns`: カラム名のリスト、`rows`: 値のリストのリスト）
+    table = _schema_cache().get_table(table_name)
+    return _conditional_json(
+        {"columns": table["columns"], "rows": table["rows"]}, table["etag"])
+
+# テーブル構造キャッシュの統計情報（JSON）を返すWeb API
+@bp.route("/api/stats/schema")
+def api_schema_stats():
+    return _schema_cache().stats()
+
+# 各テーブルの構造表示用ページ
+@bp.route("/table/<table_name>")
+def show_table_structure(table_name):
+    # 表示するテーブル名のリスト
+    allowed_tables = dbq.TABLE_NAMES
+    # テーブル名がリストになかったら404
+    if table_name not in allowed_tables:
+        abort(404)
+    # テーブル構造をキャッシュから取得
+    table = _schema_cache().get_table(table_name)
+    fields, values = table["columns"], table["rows"]
+
+    # テンプレートにデータを投げる
+    return render_template(
+        "pages/_legacy/table.html",
+        table_names=allowed_tables,
+        table_name=table_name,
+        columns=fields,
+        rows=values
+    )
@@ -0,0 +1,137 @@
+# dbapp/data/import_from_yaml.py のテスト（`schema.sql`で作ったメモリ上のDBを使う）
+#   使い方: リポジトリのルートで `python -m pytest -q tests`
+import os
+import sqlite3
+import sys
+
+import pytest
+
+# `dbapp/data`のツールは、そのディレクトリで実行する前提でimportし合う
+_DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "dbapp", "data")
+sys.path.insert(0, _DATA_DIR)
+
+from import_from_yaml import CHAPTERS, SECTIONS, QUESTIONS, apply_diffs, diff_table
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(":memory:")
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA foreign_keys = ON;")
+    with open(os.path.join(_DATA_DIR, "schema.sql"), encoding="utf-8") as f:
+        conn.executescript(f.read())
+    yield conn
+    conn.close()
+
+def _chapter(chapter, title="章"):
+    return {"chapter_number": chapter, "chapter_title": title}
+
+def _section(chapter, section, title="節"):
+    return {"chapter_number": chapter, "section_number": section, "section_title": title}
+
+def _question(chapter, section, question, text="問題", answer_query="SELECT 1"):
+    return {
+        "chapter_number": chapter, "section_number": section, "question_number": question,
+        "question": text, "answer_query": answer_query,
+    }
+
+def _sync(conn, chapters, sections, questions):
+    diffs = []
+    parent_keys = None
+    for spec, items in ((CHAPTERS, chapters), (SECTIONS, sections), (QUESTIONS, questions)):
+        diff = diff_table(conn, spec, items, parent_keys=parent_keys)
+        diffs.append(diff)
+        parent_keys = diff.keys
+    return diffs, apply_diffs(conn, diffs)
+
+def _keys(conn, table):
+    spec = {"Chapters": CHAPTERS, "Sections": SECTIONS, "Questions": QUESTIONS}[table]
+    return {tuple(row) for row in conn.execute(spec.select_query(keys_only=True))}
+
+def _version(conn):
+    return conn.execute("PRAGMA user_version;").fetchone()[0]
+
+def test_insert_parents_before_children(conn):
+    diffs, written = _sync(conn, [_chapter(1)], [_section(1, 1)], [_question(1, 1, 0), _question(1, 1, 1)])
+
+    assert written
+    assert [len(diff.inserts) for diff in diffs] == [1, 1, 2]
+    assert _keys(conn, "Questions") == {(1, 1, 0), (1, 1, 1)}
+    assert _version(conn) == 1
+
+def test_unchanged_items_write_nothing(conn):
+    _sync(conn, [_chapter(1)], [_section(1, 1)], [_question(1, 1, 0)])
+    diffs, written = _sync(conn, [_chapter(1)], [_section(1, 1)], [_question(1, 1, 0)])
+
+    assert not written
+    assert [diff.unchanged for diff in diffs] == [1, 1, 1]
+    assert _version(conn) == 1
+
+def test_changed_value_is_updated(conn):
+    _sync(conn, [_chapter(1)], [_section(1, 1)], [_question(1, 1, 0)])
+    diffs, _ = _sync(conn, [_chapter(1)], [_section(1, 1)], [_question(1, 1, 0, answer_query="SELECT 2")])
+
+    assert len(diffs[2].updates) == 1
+    assert conn.execute("SELECT AnswerQuery FROM Questions;").fetchone()[0] == "SELECT 2"
+
+def test_invalid_item_is_not_deleted(conn):
+    _sync(conn, [_chapter(1)], [_section(1, 1)], [_question(1, 1, 1)])
+    conn.execute(
+        "INSERT INTO AnswerDigests VALUES (1, 1, 1, 'h', 'v', '[]', 0, 'o', 'm', NULL, 0);")
+    broken = _question(1, 1, 1)
+    del broken["question"]
+
+    diffs, written = _sync(conn, [_chapter(1)], [_section(1, 1)], [broken])
+
+    assert [item for item, _ in diffs[2].failed] == [broken]
+    assert diffs[2].deletes == []
+    assert not written
+    assert _keys(conn, "Questions") == {(1, 1, 1)}
+    assert conn.execute("SELECT COUNT(*) FROM AnswerDigests;").fetchone()[0] == 1
+
+def test_item_without_key_fails(conn):
+    diff = diff_table(conn, QUESTIONS, [{"question": "問題", "answer_query": "SELECT 1"}])
+
+    assert len(diff.failed) == 1
+    assert not diff.changed
+
+def test_duplicate_key_keeps_first(conn):
+    diffs, _ = _sync(conn, [_chapter(1)], [_section(1, 1)],
+                     [_question(1, 1, 0, text="1つ目"), _question(1, 1, 0, text="2つ目")])
+
+    assert [error for _, error in diffs[2].failed] == ["キーが重複しています"]
+    assert conn.execute("SELECT Question FROM Questions;").fetchone()[0] == "1つ目"
+
+def test_missing_parent_fails(conn):
+    diffs, _ = _sync(conn, [_chapter(1)], [_section(1, 1), _section(2, 1)], [_question(1, 2, 0)])
+
+    assert [error for _, error in diffs[1].failed] == ["Chaptersにありません"]
+    assert [error for _, error in diffs[2].failed] == ["Sectionsにありません"]
+    assert _keys(conn, "Sections") == {(1, 1)}
+    assert _keys(conn, "Questions") == set()
+
+def test_deleting_parent_cascades(conn):
+    _sync(conn, [_chapter(1), _chapter(2)], [_section(1, 1), _section(2, 1)],
+          [_question(1, 1, 0), _question(2, 1, 0)])
+    conn.execute(
+        "INSERT INTO AnswerDigests VALUES (2, 1, 0, 'h', 'v', '[]', 0, 'o', 'm', NULL, 0);")
+
+    diffs, written = _sync(conn, [_chapter(1)], [_section(1, 1)], [_question(1, 1, 0)])
+
+    assert written
+    assert [diff.deletes for diff in diffs] == [[(2,)], [(2, 1)], [(2, 1, 0)]]
+    assert _keys(conn, "Chapters") == {(1,)}
+    assert _keys(conn, "Questions") == {(1, 1, 0)}
+    assert conn.execute("SELECT COUNT(*) FROM AnswerDigests;").fetchone()[0] == 0
+
+def test_failed_write_rolls_back(conn):
+    _sync(conn, [_chapter(1)], [_section(1, 1)], [_question(1, 1, 0)])
+    # 親の確認を飛ばして、外部キー制約で書き込みを失敗させる
+    chapters = diff_table(conn, CHAPTERS, [_chapter(1, "新しい章")])
+    questions = diff_table(conn, QUESTIONS, [_question(1, 1, 0), _question(9, 9, 0)])
+
+    with pytest.raises(sqlite3.IntegrityError):
+        apply_diffs(conn, [chapters, questions])
+
+    assert conn.execute("SELECT ChapterTitle FROM Chapters;").fetchone()[0] == "章"
+    assert _keys(conn, "Questions") == {(1, 1, 0)}
+    assert _version(conn) == 1
@@ -0,0 +1,46 @@
+# dbapp/services/query_compare/loose.py のテスト（'loose'モードの比較）
+#   使い方: リポジトリのルートで `python -m pytest -q tests`
+from datetime import date, datetime
+from decimal import Decimal
+
+import pytest
+
+# ODBCのドライバーマネージャーがない環境では読み込めない
+pytest.importorskip("pyodbc", exc_type=ImportError)
+
+from dbapp.services.query_compare.loose import compare_loose
+from dbapp.services.query_compare.messages import CompareResult
+
+def _compare(user_rows, answer_rows, decimals=2):
+    columns = ["c"] * len((user_rows or answer_rows or [()])[0])
+    result, _ = compare_loose((columns, user_rows), (columns, answer_rows), decimals=decimals)
+    return result
+
+def test_order_and_number_types_are_ignored():
+    assert _compare([(1, "a"), (Decimal("2.50"), "b")], [(2.5, "b"), (1.0, "a")]) == CompareResult.OK
+
+def test_values_across_rounding_boundary_match():
+    assert _compare([(0.0049999, )], [(0.0050001, )]) == CompareResult.OK
+    assert _compare([(Decimal("1.005"), )], [(1.0049999, )]) == CompareResult.OK
+
+def test_values_beyond_tolerance_differ():
+    assert _compare([(1.0, )], [(1.01, )]) == CompareResult.ROW_CONTENT_MISMATCH
+    assert _compare([(1.0, )], [(1.01, )], decimals=1) == CompareResult.OK
+
+def test_large_integers_are_exact():
+    assert _compare([(2 ** 53, )], [(2 ** 53 + 1, )]) == CompareResult.ROW_CONTENT_MISMATCH
+    assert _compare([(2 ** 64 - 1, )], [(2 ** 64 - 2, )]) == CompareResult.ROW_CONTENT_MISMATCH
+    assert _compare([(2 ** 64 - 1, )], [(Decimal(2 ** 64 - 1), )]) == CompareResult.OK
+
+def test_null_matches_only_null():
+    assert _compare([(None, ), (0, )], [(0, ), (None, )]) == CompareResult.OK
+    assert _compare([(None, )], [(0, )]) == CompareResult.ROW_CONTENT_MISMATCH
+
+def test_dates_compare_as_text():
+    assert _compare([(datetime(2024, 1, 2, 3, 4, 5, 678), )], [(datetime(2024, 1, 2, 3, 4, 5), )]) == CompareResult.OK
+    assert _compare([(date(2024, 1, 2), )], [("2024-01-02", )]) == CompareResult.OK
+
+def test_row_count_results():
+    assert _compare([(1, ), (2, ), (3, )], [(1, ), (2, )]) == CompareResult.USER_HAS_EXTRA_ROWS
+    assert _compare([(1, )], [(1, ), (2, )]) == CompareResult.USER_MISSING_ROWS
+    assert _compare([(1, ), (3, ), (4, )], [(1, ), (2, )]) == CompareResult.ROW_COUNT_MISMATCH
@@ -0,0 +1,133 @@
+# dbapp/db/pool.py のテスト（コネクションには`sqlite3`を使う）
+#   使い方: リポジトリのルートで `python -m pytest -q tests`
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from dbapp.db.exceptions import PoolTimeoutError
+from dbapp.db.pool import ConnectionPool
+
+class _Factory:
+    """ `sqlite3`のコネクションを作り、同時に開いている数を数える
+        `ping_delay`を指定すると、生存確認のクエリを遅くする
+    """
+
+    def __init__(self, ping_delay: float=0.0):
+        self.ping_delay = ping_delay
+        self.lock = threading.Lock()
+        self.live = 0
+        self.max_live = 0
+
+    def __call__(self):
+        factory = self
+
+        class _Connection(sqlite3.Connection):
+            def cursor(self, *args, **kwargs):
+                if factory.ping_delay:
+                    time.sleep(factory.ping_delay)
+                return super().cursor(*args, **kwargs)
+
+            def close(self):
+                with factory.lock:
+                    factory.live -= 1
+                super().close()
+
+        conn = sqlite3.connect(":memory:", check_same_thread=False, factory=_Connection)
+        with self.lock:
+            self.live += 1
+            self.max_live = max(self.max_live, self.live)
+        return conn
+
+def test_reuses_idle_connection():
+    pool = ConnectionPool(_Factory(), max_size=2)
+    conn = pool.acquire()
+    pool.release(conn)
+    assert pool.acquire() is conn
+    assert pool.stats()["created"] == 1
+
+def test_max_size_is_never_exceeded_while_pinging():
+    # 生存確認中（ロック外）のコネクションも数に入っていること
+    factory = _Factory(ping_delay=0.01)
+    pool = ConnectionPool(factory, max_size=2, ping_after=0.0, checkout_timeout=5.0)
+    errors = []
+
+    def worker():
+        try:
+            for _ in range(20):
+                with pool.connection() as conn:
+                    conn.execute("SELECT 1").fetchall()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    assert factory.max_live <= 2
+    assert pool.stats()["created"] <= 2
+
+def test_idle_timeout_recycles_connection():
+    pool = ConnectionPool(_Factory(), max_size=1, idle_timeout=0.05)
+    conn = pool.acquire()
+    pool.release(conn)
+    time.sleep(0.1)
+    assert pool.acquire() is not conn
+    assert pool.stats()["recycled"] == 1
+
+def test_max_lifetime_recycles_connection():
+    pool = ConnectionPool(_Factory(), max_size=1, max_lifetime=0.05)
+    conn = pool.acquire()
+    pool.release(conn)
+    time.sleep(0.1)
+    assert pool.acquire() is not conn
+    assert pool.stats()["recycled"] == 1
+
+def test_dead_connection_is_discarded():
+    factory = _Factory()
+    pool = ConnectionPool(factory, max_size=1, ping_after=0.0)
+    conn = pool.acquire()
+    pool.release(conn)
+    # 空きのまま死んだコネクション -> 生存確認で捨てて作り直す
+    sqlite3.Connection.close(conn)
+    new_conn = pool.acquire()
+    assert new_conn is not conn
+    assert new_conn.execute("SELECT 1").fetchone() == (1,)
+    assert pool.stats()["recycled"] == 1
+
+def test_release_with_discard_closes_connection():
+    factory = _Factory()
+    pool = ConnectionPool(factory, max_size=1)
+    conn = pool.acquire()
+    pool.release(conn, discard=True)
+    assert factory.live == 0
+    assert pool.acquire() is not conn
+
+def test_checkout_timeout():
+    pool = ConnectionPool(_Factory(), max_size=1)
+    pool.acquire()
+    started_at = time.monotonic()
+    with pytest.raises(PoolTimeoutError):
+        pool.acquire(timeout=0.05)
+    assert time.monotonic() - started_at < 1.0
+
+def test_waiter_gets_released_connection():
+    pool = ConnectionPool(_Factory(), max_size=1)
+    conn = pool.acquire()
+    timer = threading.Timer(0.05, pool.release, args=(conn,))
+    timer.start()
+    assert pool.acquire(timeout=2.0) is conn
+    timer.join()
+
+def test_min_size_is_filled():
+    factory = _Factory()
+    pool = ConnectionPool(factory, min_size=2, max_size=3)
+    pool.fill()
+    assert pool.stats()["idle"] == 2
+    pool.close()
+    assert factory.live == 0
+    with pytest.raises(PoolTimeoutError):
+        pool.acquire()
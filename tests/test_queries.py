@@ -0,0 +1,48 @@
+# dbapp/db/queries.py のテスト（クエリの正規化と指紋、結果キャッシュに置いてよいかの判定）
+#   使い方: リポジトリのルートで `python -m pytest -q tests`
+import pytest
+
+# ODBCのドライバーマネージャーがない環境では読み込めない
+pytest.importorskip("pyodbc", exc_type=ImportError)
+
+from dbapp.db.queries import fingerprint_sql, is_deterministic_sql, normalize_sql
+
+def test_normalize_folds_whitespace_and_comments():
+    assert normalize_sql("SELECT  *\n  FROM Sales -- 全部\n;") == "SELECT * FROM Sales"
+    assert normalize_sql("SELECT /* 列 */ a FROM t # 表\n") == "SELECT a FROM t"
+
+def test_normalize_keeps_case():
+    assert normalize_sql("select count(*) as Count from Sales") != normalize_sql("select count(*) as count from Sales")
+    assert normalize_sql("SELECT 1 AS year") != normalize_sql("SELECT 1 AS Year")
+    assert normalize_sql("select * from Sales") == "select * from Sales"
+
+def test_normalize_keeps_values():
+    assert normalize_sql("SELECT * FROM t WHERE a = 'X'") != normalize_sql("SELECT * FROM t WHERE a = 'x'")
+    assert normalize_sql("SELECT * FROM t WHERE a = 1") != normalize_sql("SELECT * FROM t WHERE a = 2")
+
+def test_normalize_joins_qualified_names_and_operators():
+    assert normalize_sql("SELECT t . col FROM t WHERE a>=1 AND b<>2") == "SELECT t.col FROM t WHERE a >= 1 AND b <> 2"
+    assert normalize_sql("SELECT a > = 1") == "SELECT a > = 1"
+
+def test_fingerprint_replaces_values():
+    assert fingerprint_sql("select * from t where a = 'X' and b >= 1.5") == "SELECT * FROM T WHERE A = ? AND B >= ?"
+    assert fingerprint_sql("SELECT * FROM t WHERE c IN (1, 2,3)") == fingerprint_sql("SELECT * FROM t WHERE c IN (4)")
+    assert fingerprint_sql("SELECT `Order` FROM t") == "SELECT `ORDER` FROM T"
+
+def test_fingerprint_ignores_case_and_comments():
+    assert fingerprint_sql("select a from t -- x") == fingerprint_sql("SELECT A\nFROM T;")
+
+@pytest.mark.parametrize("sql_query", [
+    "SELECT NOW()",
+    "SELECT * FROM Sales WHERE SaleDate < curdate()",
+    "SELECT CURRENT_DATE",
+    "SELECT SYSDATE(), 1",
+    "SELECT * FROM Sales ORDER BY RAND() LIMIT 1",
+    "SELECT UUID()",
+])
+def test_nondeterministic_functions(sql_query):
+    assert not is_deterministic_sql(sql_query)
+
+def test_function_names_in_strings_and_comments_are_ignored():
+    assert is_deterministic_sql("SELECT 'NOW()', `rand` FROM t /* UUID() */")
+    assert is_deterministic_sql("SELECT COUNT(*) FROM Sales")
@@ -0,0 +1,52 @@
+# dbapp/services/result_cache_service.py のテスト（キーの作り方とLRU）
+#   使い方: リポジトリのルートで `python -m pytest -q tests`
+import pytest
+
+# ODBCのドライバーマネージャーがない環境では読み込めない
+pytest.importorskip("pyodbc", exc_type=ImportError)
+
+from dbapp.services import result_cache_service
+from dbapp.services.result_cache_service import ResultCache, result_cache_key
+
+@pytest.fixture
+def versioned(monkeypatch):
+    monkeypatch.setattr(result_cache_service, "has_dataset_version", lambda: True)
+    monkeypatch.setattr(result_cache_service, "get_dataset_version", lambda: "odbc:1")
+
+def test_key_ignores_whitespace_and_comments(versioned):
+    assert result_cache_key("SELECT * FROM Sales", (), ("all", )) == \
+        result_cache_key("SELECT  *\nFROM Sales -- 全部\n", (), ("all", ))
+
+def test_key_keeps_alias_case(versioned):
+    assert result_cache_key("SELECT COUNT(*) AS Count FROM Sales", (), ("all", )) != \
+        result_cache_key("SELECT COUNT(*) AS count FROM Sales", (), ("all", ))
+
+def test_key_includes_params_and_variant(versioned):
+    key = result_cache_key("SELECT * FROM Sales WHERE a = ?", (1, ), ("page", 1, 100, 10000))
+    assert key != result_cache_key("SELECT * FROM Sales WHERE a = ?", (2, ), ("page", 1, 100, 10000))
+    assert key != result_cache_key("SELECT * FROM Sales WHERE a = ?", (1, ), ("page", 2, 100, 10000))
+
+def test_no_key_for_nondeterministic_query(versioned):
+    assert result_cache_key("SELECT NOW()", (), ("all", )) is None
+    assert result_cache_key("SELECT * FROM Sales ORDER BY RAND()", (), ("all", )) is None
+
+def test_no_key_without_dataset_version(monkeypatch):
+    monkeypatch.setattr(result_cache_service, "has_dataset_version", lambda: False)
+    assert result_cache_key("SELECT * FROM Sales", (), ("all", )) is None
+
+def test_cache_skips_none_key():
+    cache = ResultCache(max_bytes=100, max_entry_bytes=100)
+    assert not cache.put(None, "value", 1)
+    assert cache.get(None) is None
+    assert cache.stats()["bypassed"] == 1
+    assert cache.stats()["entries"] == 0
+
+def test_cache_evicts_least_recently_used():
+    cache = ResultCache(max_bytes=100, max_entry_bytes=60)
+    cache.put("a", 1, 40)
+    cache.put("b", 2, 40)
+    assert cache.get("a") == 1
+    cache.put("c", 3, 40)
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == (1, 3)
+    assert not cache.put("d", 4, 61)
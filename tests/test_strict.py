@@ -0,0 +1,84 @@
+# dbapp/services/query_compare/strict.py のテスト（'strict'モードの比較）
+#   使い方: リポジトリのルートで `python -m pytest -q tests`
+from decimal import Decimal
+
+import pytest
+
+# ODBCのドライバーマネージャーがない環境では読み込めない
+pytest.importorskip("pyodbc", exc_type=ImportError)
+
+from dbapp.services.query_compare import strict
+from dbapp.services.query_compare.messages import CompareResult
+from dbapp.services.query_compare.strict import (
+    MultisetDigest, compare_strict, compare_strict_stream, stable_row_hash)
+
+COLUMNS = ["id", "name"]
+
+def _compare(user_rows, answer_rows, user_columns=COLUMNS, answer_columns=COLUMNS):
+    return compare_strict((user_columns, user_rows), (answer_columns, answer_rows))
+
+def test_match():
+    rows = [(1, "a"), (2, "b"), (3, None)]
+    assert _compare(rows, list(rows)) == (CompareResult.OK, {})
+
+def test_equal_numbers_match():
+    result, _ = _compare([(1, Decimal("2.50"))], [(1.0, Decimal("2.5"))])
+    assert result == CompareResult.OK
+
+def test_column_mismatch():
+    assert _compare([], [], user_columns=["id"])[0] == CompareResult.COLUMN_COUNT_MISMATCH
+    assert _compare([], [], user_columns=["id", "Name"])[0] == CompareResult.COLUMN_NAME_MISMATCH
+
+def test_row_count_mismatch():
+    result, detail = _compare([(1, "a")], [(1, "a"), (2, "b")])
+    assert result == CompareResult.ROW_COUNT_MISMATCH
+    assert detail == {"user_rows": 1, "answer_rows": 2}
+
+def test_reorder():
+    result, detail = _compare([(2, "b"), (1, "a")], [(1, "a"), (2, "b")])
+    assert result == CompareResult.ROW_ORDER_MISMATCH
+    assert detail["first_mismatch"] == 0
+
+def test_content_mismatch():
+    result, detail = _compare([(1, "a"), (2, "x")], [(1, "a"), (2, "b")])
+    assert result == CompareResult.ROW_CONTENT_MISMATCH
+    assert detail["first_mismatch"] == 1
+    assert detail["missing"] == [(2, "b")]
+    assert detail["extra"] == [(2, "x")]
+
+def test_hash_colliding_values_are_content_mismatch():
+    # `hash(-1) == hash(-2)`
+    result, _ = compare_strict((["n"], [(-1, ), (5, )]), (["n"], [(-2, ), (5, )]))
+    assert result == CompareResult.ROW_CONTENT_MISMATCH
+
+def test_hash_colliding_values_without_exact_diff(monkeypatch):
+    # 差分を数えきれないときは、多重集合ハッシュで判定する
+    monkeypatch.setattr(strict, "MAX_PENDING_ROWS", 0)
+    result, _ = compare_strict((["n"], [(-1, ), (5, )]), (["n"], [(-2, ), (5, )]))
+    assert result == CompareResult.ROW_CONTENT_MISMATCH
+    result, _ = compare_strict((["n"], [(5, ), (-1, )]), (["n"], [(-1, ), (5, )]))
+    assert result == CompareResult.ROW_ORDER_MISMATCH
+
+def test_stream_with_uneven_chunks():
+    rows = [(i, str(i)) for i in range(2500)]
+    user_chunks = [rows[:7], rows[7:1500], rows[1500:]]
+    answer_chunks = [rows[:1000], rows[1000:2001], rows[2001:]]
+    assert compare_strict_stream(COLUMNS, user_chunks, COLUMNS, answer_chunks)[0] == CompareResult.OK
+
+    reordered = rows[:1200] + rows[1201:2200] + [rows[1200]] + rows[2200:]
+    result, detail = compare_strict_stream(COLUMNS, [reordered], COLUMNS, answer_chunks)
+    assert result == CompareResult.ROW_ORDER_MISMATCH
+    assert detail["first_mismatch"] == 1200
+
+def test_multiset_digest_ignores_order():
+    first, second = MultisetDigest(), MultisetDigest()
+    first.add_many([(1, "a"), (2, None), (1, "a")])
+    second.add_many([(1, "a"), (1, "a"), (2, None)])
+    assert first == second
+    second.add((3, "c"))
+    assert first != second
+
+def test_stable_row_hash():
+    assert stable_row_hash((-1, )) != stable_row_hash((-2, ))
+    assert stable_row_hash((1, )) == stable_row_hash((1.0, )) == stable_row_hash((Decimal("1.00"), ))
+    assert stable_row_hash(("ab", "c")) != stable_row_hash(("a", "bc"))